@@ -1,13 +1,15 @@
-from django.contrib import admin
-from .models import Stock, Sale, UploadedFile, UserProfile
+from django.contrib import admin, messages
+from .models import RequestProfile, Stock, Sale, UploadedFile, UserProfile
+from .jobs import UNPROCESSED, requeue_upload
 
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
-    list_display = ['product_name', 'quantity', 'price', 'supplier', 'user', 'is_low_stock', 'created_at']
-    list_filter = ['user', 'supplier', 'category', 'created_at']
+    list_display = ['product_name', 'quantity', 'price', 'supplier', 'user', 'is_low', 'created_at']
+    list_filter = ['user', 'is_low', 'supplier', 'category', 'created_at']
     search_fields = ['product_name', 'sku', 'supplier']
     list_editable = ['quantity', 'price']
+    list_select_related = ['user']
     ordering = ['-created_at']
     
     def get_queryset(self, request):
@@ -22,6 +24,7 @@ class SaleAdmin(admin.ModelAdmin):
     list_display = ['product', 'quantity_sold', 'unit_price', 'total_amount', 'customer_name', 'sale_date', 'user']
     list_filter = ['user', 'sale_date', 'product__category']
     search_fields = ['product__product_name', 'customer_name', 'customer_phone']
+    list_select_related = ['product', 'user']
     ordering = ['-sale_date']
     readonly_fields = ['total_amount']
     
@@ -34,10 +37,25 @@ class SaleAdmin(admin.ModelAdmin):
 
 @admin.register(UploadedFile)
 class UploadedFileAdmin(admin.ModelAdmin):
-    list_display = ['file_name', 'file_type', 'records_processed', 'processing_status', 'uploaded_at', 'user']
+    list_display = ['file_name', 'file_type', 'records_processed', 'processing_status', 'processing_time',
+                    'uploaded_at', 'user']
     list_filter = ['processing_status', 'file_type', 'uploaded_at', 'user']
     search_fields = ['file_name']
-    readonly_fields = ['records_processed', 'uploaded_at']
+    list_select_related = ['user']
+    readonly_fields = ['records_processed', 'error_count', 'uploaded_at', 'worker', 'started_at', 'heartbeat_at',
+                       'completed_at']
+    actions = ['requeue']
+    
+    @admin.action(description='Requeue selected uploads for processing')
+    def requeue(self, request, queryset):
+        # Completed, running and partly written uploads would apply rows twice
+        requeueable = queryset.filter(UNPROCESSED)
+        for uploaded_file in requeueable:
+            requeue_upload(uploaded_file)
+        skipped = queryset.count() - len(requeueable)
+        if skipped:
+            self.message_user(request, f'Skipped {skipped} upload(s) that are processing or already wrote rows.',
+                              messages.WARNING)
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
@@ -50,3 +68,21 @@ class UploadedFileAdmin(admin.ModelAdmin):
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'company_name', 'phone', 'currency', 'created_at']
     search_fields = ['user__username', 'company_name']
+    list_select_related = ['user']
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['url_name', 'method', 'path', 'status_code', 'total_ms', 'view_ms', 'orm_ms',
+                    'template_ms', 'query_count', 'user', 'started_at']
+    list_filter = ['url_name', 'method', 'status_code', 'started_at']
+    search_fields = ['path', 'user__username']
+    list_select_related = ['user']
+    ordering = ['-total_ms']
+    date_hierarchy = 'started_at'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
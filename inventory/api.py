@@ -0,0 +1,82 @@
+"""
+JSON API for point-of-sale terminals.
+
+Authenticate with a token (``Authorization: Token <key>``; create one with
+``manage.py drf_create_token <username>`` or in the admin) or a session.
+"""
+
+from rest_framework import serializers, status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from .ingestion import SaleBatchError, record_sale_batch
+
+
+SALES_BATCH_MAX_LINES = 1000
+
+
+class SaleLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField(required=False, min_value=1)
+    sku = serializers.CharField(required=False, max_length=100)
+    quantity_sold = serializers.IntegerField(min_value=1)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    customer_name = serializers.CharField(required=False, allow_blank=True, max_length=255)
+    customer_phone = serializers.CharField(required=False, allow_blank=True, max_length=20)
+    customer_email = serializers.EmailField(required=False, allow_blank=True)
+    notes = serializers.CharField(required=False, allow_blank=True)
+    sale_date = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('product') and not attrs.get('sku'):
+            raise serializers.ValidationError('Give either product or sku.')
+        return attrs
+
+
+@api_view(['POST'])
+def sales_batch(request):
+    """Record an array of sales in one transaction.
+
+    Either every line is recorded (201) or none is (400); the response has
+    a result per line in request order.
+    """
+    serializer = SaleLineSerializer(data=request.data, many=True, allow_empty=False,
+                                    max_length=SALES_BATCH_MAX_LINES)
+    if not serializer.is_valid():
+        errors = serializer.errors
+        # Line errors come as a list, or a dict keyed by line index
+        if isinstance(errors, list):
+            errors = dict(enumerate(errors))
+        elif not all(isinstance(key, int) for key in errors):
+            # Not a list at all, or too long/empty
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return rejected([
+            {'line': i, 'status': 'invalid', 'errors': errors[i]} if errors.get(i)
+            else {'line': i, 'status': 'not_applied'}
+            for i in range(len(request.data))
+        ])
+
+    lines = serializer.validated_data
+    try:
+        sales = record_sale_batch(request.user, lines)
+    except SaleBatchError as e:
+        return rejected([
+            {'line': i, 'status': 'rejected', 'errors': [e.errors[i]]} if i in e.errors
+            else {'line': i, 'status': 'not_applied'}
+            for i in range(len(lines))
+        ])
+
+    return Response({
+        'created': len(sales),
+        'results': [{
+            'line': i,
+            'status': 'created',
+            'sale_id': sale.pk,
+            'product': sale.product_id,
+            'quantity_sold': sale.quantity_sold,
+            'total_amount': str(sale.total_amount),
+        } for i, sale in enumerate(sales)],
+    }, status=status.HTTP_201_CREATED)
+
+
+def rejected(results):
+    return Response({'created': 0, 'results': results}, status=status.HTTP_400_BAD_REQUEST)
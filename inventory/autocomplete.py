@@ -0,0 +1,138 @@
+"""
+Autocomplete for the stock search box.
+
+Each worker process keeps in-memory prefix indexes over product names (the
+whole name and each word in it) and SKUs, for its most recently active
+users. An index is stamped with the user's data version from
+``inventory.cache`` and rebuilt once the version moves on, so a keystroke
+costs one cache read and no SQL. Tenants with more products than
+``AUTOCOMPLETE_MAX_ROWS`` are not indexed and use a prefix query instead.
+"""
+
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Stock
+
+
+AUTOCOMPLETE_FIELDS = ['id', 'product_name', 'sku', 'quantity', 'price', 'supplier', 'category']
+
+# Per-worker bounds: indexes kept, and the largest tenant that is indexed
+MAX_INDEXED_USERS = getattr(settings, 'AUTOCOMPLETE_INDEX_USERS', 200)
+MAX_INDEXED_ROWS = getattr(settings, 'AUTOCOMPLETE_MAX_ROWS', 50000)
+
+RESULT_LIMIT = 10
+
+# Match kinds, best first
+NAME_PREFIX, WORD_PREFIX, SKU_PREFIX = range(3)
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+class PrefixIndex:
+    """Sorted keys per match kind, searched with bisect.
+
+    The keys are the lower-cased product name, the name from each later
+    word on (so "wid" and "widget p" both find "Blue Widget Pro") and the
+    SKU. Matches are ranked by kind, then key, so a search stops as soon as
+    it has enough rows.
+    """
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.rows = rows
+        entries = [[] for _ in range(3)]
+        for i, row in enumerate(rows):
+            name = row['product_name'].lower()
+            entries[NAME_PREFIX].append((name, i))
+            for match in re.finditer(r'\s+', name):
+                if match.end() < len(name):
+                    entries[WORD_PREFIX].append((name[match.end():], i))
+            if row['sku']:
+                entries[SKU_PREFIX].append((row['sku'].lower(), i))
+        self.entries = [sorted(kind_entries) for kind_entries in entries]
+        self.keys = [[key for key, _ in kind_entries] for kind_entries in self.entries]
+
+    def search(self, query, limit=RESULT_LIMIT):
+        query = query.lower()
+        results, seen = [], set()
+        for keys, entries in zip(self.keys, self.entries):
+            for position in range(bisect_left(keys, query), len(keys)):
+                key, i = entries[position]
+                if not key.startswith(query):
+                    break
+                if i not in seen:
+                    seen.add(i)
+                    results.append(self.rows[i])
+                    if len(results) == limit:
+                        return results
+        return results
+
+
+class _Unindexed:
+    """Marks a tenant too large to index at ``version``"""
+
+    def __init__(self, version):
+        self.version = version
+
+
+def autocomplete(user, query, version, limit=RESULT_LIMIT):
+    """Up to ``limit`` stock rows (as dicts) whose name, a word of it, or SKU starts with ``query``"""
+    index = get_index(user.pk, version)
+    if isinstance(index, PrefixIndex):
+        return index.search(query, limit)
+
+    rows = (Stock.objects.filter(user=user)
+            .filter(Q(product_name__istartswith=query) | Q(product_name__icontains=f' {query}')
+                    | Q(sku__istartswith=query))
+            .order_by('product_name')
+            .values(*AUTOCOMPLETE_FIELDS)[:limit])
+    return [_row(row) for row in rows]
+
+
+def get_index(user_id, version):
+    """The user's index at ``version``, building it if needed.
+
+    Returns None without a version (no working cache), since the index
+    could never be validated later.
+    """
+    if version is None:
+        return None
+
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None and version is not None and index.version == version:
+            _indexes.move_to_end(user_id)
+            return index
+
+    rows = list(Stock.objects.filter(user_id=user_id)
+                .order_by('product_name', 'id')
+                .values(*AUTOCOMPLETE_FIELDS)[:MAX_INDEXED_ROWS + 1])
+    if len(rows) > MAX_INDEXED_ROWS:
+        index = _Unindexed(version)
+    else:
+        index = PrefixIndex([_row(row) for row in rows], version)
+
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > MAX_INDEXED_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def clear_indexes():
+    with _lock:
+        _indexes.clear()
+
+
+def _row(row):
+    # JSON-ready: the search UI formats the price as a number
+    row['price'] = float(row['price'])
+    return row
@@ -0,0 +1,224 @@
+"""
+Synthetic data and query timing helpers used by the benchmark commands.
+"""
+
+import csv
+import random
+import sqlite3
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+try:
+    import openpyxl
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import DailyProductSales, LowStockCounter, Stock, Sale
+
+
+CATEGORIES = ['Electronics', 'Grocery', 'Hardware', 'Stationery', 'Clothing', 'Toys', 'Beauty', 'Garden']
+SUPPLIERS = [f'Supplier {i}' for i in range(1, 41)]
+
+
+def seed_tenant(user, stocks=1000, sales=10000, days=365, seed=0, batch_size=5000):
+    """Create ``stocks`` products and ``sales`` sales for ``user``.
+
+    Product popularity follows a long-tailed distribution so that a few
+    products account for most sales, as in a real shop.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    products = []
+    for i in range(stocks):
+        products.append(Stock(
+            user=user,
+            product_name=f'{rng.choice(CATEGORIES)} item {i:06d}',
+            quantity=rng.randint(0, 500),
+            price=Decimal(rng.randint(50, 50000)) / 100,
+            supplier=rng.choice(SUPPLIERS),
+            category=rng.choice(CATEGORIES),
+            sku=f'SKU{user.pk:04d}{i:07d}',
+            minimum_stock=rng.randint(0, 50),
+            created_at=now - timedelta(days=rng.uniform(0, days)),
+        ))
+    Stock.objects.bulk_create(products, batch_size=batch_size)
+    LowStockCounter.record_changes(user.pk, {}, LowStockCounter.low_states(Stock.objects.filter(user=user)))
+    products = list(Stock.objects.filter(user=user).only('id', 'price'))
+
+    weights = [1 / (rank + 1) for rank in range(len(products))]
+    batch = []
+    for product in rng.choices(products, weights=weights, k=sales) if products else []:
+        quantity_sold = rng.randint(1, 5)
+        batch.append(Sale(
+            user=user,
+            product_id=product.pk,
+            quantity_sold=quantity_sold,
+            unit_price=product.price,
+            total_amount=product.price * quantity_sold,
+            sale_date=now - timedelta(days=days * rng.random() ** 2),
+        ))
+        if len(batch) >= batch_size:
+            Sale.objects.bulk_create(batch)
+            DailyProductSales.record_sales(batch)
+            batch = []
+    Sale.objects.bulk_create(batch)
+    DailyProductSales.record_sales(batch)
+
+
+def view_queries(user):
+    """The queries behind dashboard, stock_list and sales_list.
+
+    Returns ``(view, label, queryset, evaluate)`` tuples; ``evaluate`` runs
+    the query the same way the view does.
+    """
+    thirty_days_ago = timezone.now() - timedelta(days=30)
+    stocks = Stock.objects.filter(user=user)
+    low_stock = stocks.filter(is_low=True)
+    recent_sales = DailyProductSales.objects.filter(user=user, day__gt=timezone.localdate() - timedelta(days=30))
+    top_products = (recent_sales.values('product__product_name')
+                    .annotate(total_sold=Sum('quantity_sold'))
+                    .order_by('-total_sold')[:5])
+    sales = Sale.objects.filter(user=user, sale_date__gte=thirty_days_ago, sale_date__lte=timezone.now())
+
+    return [
+        ('dashboard', 'total_products', stocks, lambda qs: qs.count()),
+        ('dashboard', 'low_stock_count', LowStockCounter.objects.filter(user=user), lambda qs: qs.first()),
+        ('dashboard', 'low_stock_products', low_stock.order_by('quantity')[:10], list),
+        ('dashboard', 'recent_sales_total', recent_sales,
+         lambda qs: qs.aggregate(total=Sum('revenue'), count=Sum('sales_count'))),
+        ('dashboard', 'top_products', top_products, list),
+        ('stock_list', 'first_page', stocks[:20], list),
+        ('stock_list', 'sku_lookup', stocks.filter(sku=f'SKU{user.pk:04d}0000001'), list),
+        ('sales_list', 'first_page', Sale.objects.filter(user=user)[:20], list),
+        ('sales_list', 'date_filtered_page', sales[:20], list),
+        ('sales_list', 'date_filtered_count', sales, lambda qs: qs.count()),
+    ]
+
+
+def time_query(queryset, evaluate, repeat=5):
+    """Best-of-``repeat`` wall time of ``evaluate(queryset)`` in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        evaluate(queryset.all())
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def explain(queryset, tag=''):
+    """EXPLAIN output for ``queryset``.
+
+    ``tag`` is appended as an SQL comment: SQLite's statement cache would
+    otherwise return a plan prepared before an index was added or dropped.
+    """
+    sql, params = queryset.query.sql_with_params()
+    prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{prefix} {sql} /* {tag} */', params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def search_terms(user):
+    """Representative stock searches: broad, narrow, exact SKU and no match"""
+    return [
+        ('category', 'Electronics'),
+        ('name_fragment', 'item 00123'),
+        ('sku', f'SKU{user.pk:04d}0000050'),
+        ('no_match', 'zzzz'),
+    ]
+
+
+def stock_rows(count, seed=0, prefix='Upload'):
+    """Rows in the format ``process_csv_data`` accepts for a stock file"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            'product_name': f'{prefix} item {i:06d}',
+            'quantity': rng.randint(0, 500),
+            'price': f'{rng.randint(50, 50000) / 100:.2f}',
+            'supplier': rng.choice(SUPPLIERS),
+            'category': rng.choice(CATEGORIES),
+            'sku': f'{prefix.upper()}{i:07d}',
+        }
+
+
+def write_stock_file(path, count, seed=0):
+    """Write a stock upload of ``count`` rows as CSV or XLSX, by ``path``'s extension"""
+    rows = stock_rows(count, seed)
+    fields = ['product_name', 'quantity', 'price', 'supplier', 'category', 'sku']
+    if str(path).endswith('.xlsx'):
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(fields)
+        for row in rows:
+            sheet.append([row[field] for field in fields])
+        workbook.save(path)
+    else:
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def write_legacy_db(path, stocks=1000, sales=10000, seed=0):
+    """Create a database in the old Flask app's schema for ``import_legacy_data``"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('CREATE TABLE stock (ProductName TEXT, Quantity INT, Price REAL)')
+        conn.executemany('INSERT INTO stock VALUES (?, ?, ?)', [
+            (f'Legacy item {i:06d}', rng.randint(0, 500), rng.randint(50, 50000) / 100)
+            for i in range(stocks)
+        ])
+        conn.execute('CREATE TABLE sales (id INTEGER PRIMARY KEY, ProductName TEXT, '
+                     'QuantitySold INT, EntryDate TEXT)')
+        weights = [1 / (rank + 1) for rank in range(stocks)]
+        names = [f'Legacy item {i:06d}' for i in range(stocks)]
+        conn.executemany('INSERT INTO sales (ProductName, QuantitySold, EntryDate) VALUES (?, ?, ?)', [
+            (name, rng.randint(1, 5), f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00')
+            for name in (rng.choices(names, weights=weights, k=sales) if stocks else [])
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def summarize(timings):
+    """Best/median/mean of a list of millisecond timings"""
+    return {
+        'best_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'runs': len(timings),
+    }
+
+
+def find_regressions(results, baseline, threshold=0.2, noise_ms=1.0):
+    """Benchmarks whose best time grew by more than ``threshold`` over ``baseline``.
+
+    Differences below ``noise_ms`` are ignored, since timer noise dominates
+    the fastest benchmarks.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        slower = result['best_ms'] - before['best_ms']
+        if slower > noise_ms and result['best_ms'] > before['best_ms'] * (1 + threshold):
+            regressions.append({
+                'benchmark': name,
+                'baseline_ms': before['best_ms'],
+                'best_ms': result['best_ms'],
+                'change': round(result['best_ms'] / before['best_ms'] - 1, 3) if before['best_ms'] else None,
+            })
+    return regressions
@@ -0,0 +1,95 @@
+"""
+Per-user dashboard cache.
+
+Each user has a version number in the cache. Anything that changes the
+user's stock or sales bumps it, and a cached dashboard is only served when
+it was built at the current version. A read fetches the version and the
+payload together, so a hit costs a single cache round trip. The same
+version stamps the per-worker autocomplete indexes.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 900)
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _version_key(user_id):
+    return f'dashboard:version:{user_id}'
+
+
+def _data_key(user_id, variant=''):
+    # The date is part of the key because the 30-day window moves daily
+    return f'dashboard:data:{user_id}:{timezone.localdate().isoformat()}:{variant}'
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def cache_stats():
+    """Dashboard cache hits/misses seen by this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_dashboard_context(user, build, variant=''):
+    """Return the cached dashboard context of ``user``, calling ``build(user)`` on a miss.
+
+    Each ``variant`` of the dashboard (e.g. a different ordering) is cached separately.
+    """
+    version_key, data_key = _version_key(user.pk), _data_key(user.pk, variant)
+    values = cache.get_many([version_key, data_key])
+
+    version = values.get(version_key)
+    if version is None:
+        version = _init_version(version_key)
+
+    cached = values.get(data_key)
+    if cached is not None and version is not None and cached[0] == version:
+        _count('hits')
+        return cached[1]
+
+    _count('misses')
+    context = build(user)
+    if version is not None:
+        cache.set(data_key, (version, context), DASHBOARD_CACHE_TIMEOUT)
+    return context
+
+
+def get_data_version(user_id):
+    """Current version of ``user_id``'s stock and sales, or None without a working cache"""
+    version_key = _version_key(user_id)
+    version = cache.get(version_key)
+    if version is None:
+        version = _init_version(version_key)
+    return version
+
+
+def _init_version(version_key):
+    # Start from a timestamp so an evicted version never repeats
+    cache.add(version_key, time.time_ns(), None)
+    return cache.get(version_key)
+
+
+def bump_dashboard_version(user_id):
+    """Invalidate the cached dashboard of ``user_id`` once the transaction commits"""
+    transaction.on_commit(lambda: _bump(user_id))
+
+
+def _bump(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        # No version yet: nothing can be cached at a stale one
+        pass
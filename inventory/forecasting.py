@@ -0,0 +1,104 @@
+"""
+Sales velocity forecasts and reorder suggestions.
+
+A product's velocity is an exponentially weighted moving average of the
+units it sold per day over the last ``history_days`` complete days of the
+daily rollup: yesterday has weight 1 and each ``halflife_days`` back halves
+it. Days without sales count as zero, and products younger than the
+window are averaged over their own age only. From the weighted mean and
+variance::
+
+    reorder point = velocity * lead time + z * sigma * sqrt(lead time)
+    days of cover = quantity / velocity
+
+Everything is computed for all products of a tenant at once: the rollup
+is read as arrays, each row weighted by its age, and the sums per product
+taken with ``numpy.bincount``, so there is no Python loop per product or
+per day.
+"""
+
+import math
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+from .models import DailyProductSales, Stock, StockForecast
+
+
+HISTORY_DAYS = 90
+HALFLIFE_DAYS = 14
+LEAD_TIME_DAYS = 7
+SERVICE_Z = 1.65  # About a 95% chance of not running out during the lead time
+
+WRITE_BATCH_SIZE = 5000
+
+
+def compute_forecasts(product_ids, quantities, product_ages, sale_products, sale_ages, sale_quantities,
+                      history_days=HISTORY_DAYS, halflife_days=HALFLIFE_DAYS,
+                      lead_time_days=LEAD_TIME_DAYS, z=SERVICE_Z):
+    """Velocity, reorder point and days of cover per product, as arrays.
+
+    ``product_ids`` must be sorted. Ages are in whole days; a sale age of
+    0 is yesterday.
+    """
+    decay = 0.5 ** (1 / halflife_days)
+    positions = np.searchsorted(product_ids, sale_products)
+    weights = decay ** sale_ages
+
+    # Total weight of the days each product has existed for (a geometric series)
+    days = np.clip(product_ages, 1, history_days)
+    total_weight = (1 - decay ** days) / (1 - decay)
+
+    size = len(product_ids)
+    velocity = np.bincount(positions, weights * sale_quantities, minlength=size) / total_weight
+    mean_square = np.bincount(positions, weights * sale_quantities ** 2, minlength=size) / total_weight
+    sigma = np.sqrt(np.clip(mean_square - velocity ** 2, 0, None))
+
+    reorder_point = np.ceil(velocity * lead_time_days + z * sigma * math.sqrt(lead_time_days)).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(velocity > 0, np.clip(quantities, 0, None) / velocity, np.nan)
+    return velocity, reorder_point, days_of_cover
+
+
+def forecast_user(user, today=None, history_days=HISTORY_DAYS, **options):
+    """Recompute and store the forecasts of all of ``user``'s products; returns how many"""
+    today = today or timezone.localdate()
+    products = list(Stock.objects.filter(user=user).order_by('id').values_list('id', 'quantity', 'created_at'))
+    if not products:
+        return 0
+    ids, quantities, created = zip(*products)
+    product_ids = np.array(ids, dtype=np.int64)
+    zone = timezone.get_current_timezone()
+    created_days = np.array([value.astimezone(zone).date() for value in created], dtype='datetime64[D]')
+    product_ages = (np.datetime64(today, 'D') - created_days).astype(np.int64)
+
+    sales = list(DailyProductSales.objects
+                 .filter(user=user, day__gte=today - timedelta(days=history_days), day__lt=today)
+                 .values_list('product_id', 'day', 'quantity_sold'))
+    if sales:
+        sale_products, sale_days, sale_quantities = (np.array(column) for column in zip(*sales))
+        sale_ages = (np.datetime64(today, 'D') - sale_days.astype('datetime64[D]')).astype(np.int64) - 1
+    else:
+        sale_products = sale_ages = np.array([], dtype=np.int64)
+        sale_quantities = np.array([], dtype=np.float64)
+
+    velocity, reorder_point, days_of_cover = compute_forecasts(
+        product_ids, np.array(quantities, dtype=np.float64), product_ages,
+        sale_products, sale_ages, sale_quantities.astype(np.float64),
+        history_days=history_days, **options,
+    )
+
+    covers = [None if math.isnan(cover) else cover for cover in days_of_cover.tolist()]
+    forecasts = list(zip(ids, velocity.tolist(), reorder_point.tolist(), covers))
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(forecasts), WRITE_BATCH_SIZE):
+            StockForecast.store(user.pk, forecasts[start:start + WRITE_BATCH_SIZE], now)
+    return len(forecasts)
@@ -87,6 +87,12 @@ class FileUploadForm(forms.Form):
         ],
         widget=forms.Select(attrs={'class': 'form-control'})
     )
+    skip_invalid_rows = forms.BooleanField(
+        required=False,
+        label='Skip invalid rows',
+        help_text='Import the valid rows of a file with errors instead of rejecting it',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
 
 
 class StockQueryForm(forms.Form):
@@ -94,6 +100,8 @@ class StockQueryForm(forms.Form):
         max_length=255,
         widget=forms.TextInput(attrs={
             'class': 'form-control',
-            'placeholder': 'Search products...'
+            'placeholder': 'Search products...',
+            'id': 'stock-query',
+            'autocomplete': 'off',
         })
     )
\ No newline at end of file
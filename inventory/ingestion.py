@@ -0,0 +1,398 @@
+"""
+Bulk ingestion of uploaded stock/sales rows.
+
+Uploaded files are checked in full by ``inventory.validation`` first, so
+a file with a bad cell is rejected before any chunk is written.
+
+Rows are consumed in fixed-size chunks. Each chunk preloads the existing
+products it references with one query and is written back with
+``bulk_create``/``bulk_update`` inside a single transaction, instead of one
+``get_or_create`` plus one ``save()`` per row.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django.utils import timezone
+
+from .cache import bump_dashboard_version
+from .models import DailyProductSales, LowStockCounter, Stock, Sale
+from .validation import valid_rows, validate_upload
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 1000
+
+# Attempts at writing a stock chunk whose new products a concurrent upload
+# keeps inserting first
+CONFLICT_RETRIES = 3
+
+# Optional columns that overwrite the stored value when present in the file
+STOCK_TEXT_FIELDS = ['supplier', 'category', 'sku', 'description']
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    """Yield lists of at most ``size`` items from ``iterable``"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_uploaded_file(uploaded_file, progress=None):
+    """Process uploaded CSV/Excel file"""
+    rows = validated_upload_rows(uploaded_file, progress)
+    return process_csv_data(rows, uploaded_file.file_type, uploaded_file.user, progress)
+
+
+def validated_upload_rows(uploaded_file, progress=None):
+    """Validate the whole upload, then return the rows of it to ingest.
+
+    Raises UploadValidationError, before anything is written, when the
+    file has invalid rows and the upload doesn't skip them. ``progress``
+    is called with 0 while validating.
+    """
+    validate_upload(uploaded_file, progress=progress)
+    return valid_rows(uploaded_file)
+
+
+def process_csv_data(data, file_type, user, progress=None):
+    """Process CSV data based on file type"""
+    records_processed = 0
+    
+    if file_type == 'stock':
+        records_processed = ingest_stock_rows(data, user, progress=progress)
+    elif file_type == 'sales':
+        records_processed = ingest_sales_rows(data, user, progress=progress)
+    
+    return records_processed
+
+
+def ingest_stock_rows(rows, user, chunk_size=CHUNK_SIZE, progress=None):
+    """Create or update stock items from an iterable of row dicts.
+
+    Quantities of products that already exist are added to the stored
+    quantity, matching the behaviour of re-uploading a stock file.
+    ``progress`` is called with the running total inside each chunk's
+    transaction, so the count commits with the rows it counts.
+    Returns the number of rows processed.
+    """
+    records_processed = 0
+    for chunk in chunked(rows, chunk_size):
+        records_processed += _ingest_stock_chunk(chunk, user, progress, records_processed)
+    return records_processed
+
+
+def _parse_stock_row(row):
+    """Convert a raw upload row into Stock field values"""
+    values = {
+        'quantity': int(row.get('quantity', 0)),
+        'price': Decimal(str(row.get('price', 0))),
+        'minimum_stock': int(row.get('minimum_stock', 0)),
+    }
+    for field in STOCK_TEXT_FIELDS:
+        values[field] = row.get(field, '')
+    return values
+
+
+def _ingest_stock_chunk(rows, user, progress=None, processed_before=0):
+    # Merge rows for the same product so a file listing it twice adds both
+    # quantities, as the per-row implementation did.
+    parsed = {}
+    records_processed = 0
+    for row in rows:
+        product_name = row.get('product_name')
+        if not product_name:
+            continue
+        values = _parse_stock_row(row)
+        present = {field for field in values if field in row}
+        if product_name in parsed:
+            merged, merged_present = parsed[product_name]
+            quantity = merged['quantity'] + values['quantity']
+            merged.update({field: values[field] for field in present})
+            merged['quantity'] = quantity
+            merged_present |= present
+        else:
+            parsed[product_name] = (values, present)
+        records_processed += 1
+
+    if not parsed:
+        return 0
+
+    for attempt in range(CONFLICT_RETRIES):
+        try:
+            _write_stock_chunk(parsed, user, progress, processed_before + records_processed)
+        except IntegrityError:
+            # A concurrent upload inserted one of the new products after the
+            # preload. Its transaction rolled back, so retry: the product is
+            # then preloaded and the quantity added to it.
+            if attempt == CONFLICT_RETRIES - 1:
+                raise
+        else:
+            return records_processed
+
+
+def _write_stock_chunk(parsed, user, progress, records_processed):
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            stock.product_name: stock
+            for stock in Stock.objects.select_for_update().filter(
+                user=user, product_name__in=list(parsed)
+            ).order_by()
+        }
+
+        to_create = []
+        to_update = []
+        was_low = {}
+        for product_name, (values, present) in parsed.items():
+            stock = existing.get(product_name)
+            if stock is None:
+                to_create.append(Stock(user=user, product_name=product_name, **values))
+                continue
+
+            was_low[stock.pk] = stock.is_low
+            stock.quantity += values['quantity']
+            for field in present - {'quantity'}:
+                setattr(stock, field, values[field])
+            stock.updated_at = now
+            to_update.append(stock)
+
+        if to_update:
+            Stock.objects.bulk_update(to_update, ['quantity', 'price', 'minimum_stock', 'updated_at'] + STOCK_TEXT_FIELDS)
+        if to_create:
+            # Fails with IntegrityError if a concurrent upload inserted one of
+            # these products since the preload
+            Stock.objects.bulk_create(to_create)
+        LowStockCounter.record_transitions(
+            [(user.pk, stock.pk, was_low[stock.pk], stock.quantity <= stock.minimum_stock) for stock in to_update]
+            + [(user.pk, stock.pk, None, stock.quantity <= stock.minimum_stock) for stock in to_create]
+        )
+        bump_dashboard_version(user.pk)
+        if progress:
+            progress(records_processed)
+
+
+def ingest_sales_rows(rows, user, chunk_size=CHUNK_SIZE, progress=None, warn=None):
+    """Record sales from an iterable of row dicts.
+
+    Each chunk resolves its product names with one query, inserts the sales
+    with ``bulk_create`` and applies one ``F('quantity') - n`` update per
+    product. Rows for unknown products, or that would take a product below
+    zero, are skipped and reported through ``warn``. ``progress`` is called
+    with the running total inside each chunk's transaction.
+    Returns the number of sales recorded.
+    """
+    warn = warn or logger.warning
+    records_processed = 0
+    for chunk in chunked(rows, chunk_size):
+        records_processed += _ingest_sales_chunk(chunk, user, warn, progress, records_processed)
+    return records_processed
+
+
+def parse_sale_date(value):
+    """Parse a sale date cell, falling back to now"""
+    if isinstance(value, datetime):
+        # Excel cells are already parsed
+        sale_date = value
+    elif value:
+        try:
+            sale_date = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            try:
+                sale_date = datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return timezone.now()
+    else:
+        return timezone.now()
+
+    if timezone.is_naive(sale_date):
+        sale_date = timezone.make_aware(sale_date)
+    return sale_date
+
+
+def _ingest_sales_chunk(rows, user, warn, progress=None, processed_before=0):
+    rows = [row for row in rows if row.get('product_name')]
+    if not rows:
+        return 0
+
+    with transaction.atomic():
+        # Lock the products so the availability check below stays valid
+        # until the decrements are written.
+        products = {
+            stock.product_name: stock
+            for stock in Stock.objects.select_for_update().filter(
+                user=user, product_name__in={row['product_name'] for row in rows}
+            ).order_by().only('id', 'user_id', 'product_name', 'quantity', 'price', 'minimum_stock')
+        }
+
+        sales = []
+        sold = defaultdict(int)
+        for row in rows:
+            stock = products.get(row['product_name'])
+            if stock is None:
+                warn(f'Stock item "{row["product_name"]}" not found, skipping sale record')
+                continue
+
+            quantity_sold = int(row.get('quantity_sold', 0))
+            unit_price = Decimal(str(row.get('unit_price', stock.price)))
+
+            # Check stock availability against what earlier rows left
+            available = stock.quantity - sold[stock.pk]
+            if available < quantity_sold:
+                warn(f'Insufficient stock for {stock.product_name}. '
+                     f'Available: {available}, Required: {quantity_sold}')
+                continue
+
+            sold[stock.pk] += quantity_sold
+            sales.append(Sale(
+                user=user,
+                product=stock,
+                quantity_sold=quantity_sold,
+                unit_price=unit_price,
+                total_amount=quantity_sold * unit_price,
+                customer_name=row.get('customer_name', ''),
+                customer_phone=row.get('customer_phone', ''),
+                customer_email=row.get('customer_email', ''),
+                notes=row.get('notes', ''),
+                sale_date=parse_sale_date(row.get('sale_date')),
+            ))
+
+        # bulk_create bypasses Sale.save(), so stock is decremented here,
+        # once per product
+        Sale.objects.bulk_create(sales)
+        DailyProductSales.record_sales(sales)
+        now = timezone.now()
+        for stock_id, quantity in sold.items():
+            if quantity:
+                Stock.objects.filter(pk=stock_id).update(
+                    quantity=F('quantity') - quantity, updated_at=now
+                )
+        # The rows are locked, so their state before the decrements is known
+        LowStockCounter.record_transitions([
+            (user.pk, stock.pk, stock.quantity <= stock.minimum_stock,
+             stock.quantity - sold[stock.pk] <= stock.minimum_stock)
+            for stock in products.values() if sold[stock.pk]
+        ])
+        bump_dashboard_version(user.pk)
+        if progress:
+            progress(processed_before + len(sales))
+
+    return len(sales)
+
+
+class SaleBatchError(Exception):
+    """A sale batch was rejected; ``errors`` maps line indexes to messages"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f'{len(errors)} line(s) rejected')
+
+
+def record_sale_batch(user, lines):
+    """Record a batch of sales all-or-nothing.
+
+    ``lines`` are dicts with ``product`` (a Stock id) or ``sku``,
+    ``quantity_sold`` and optionally ``unit_price``, customer fields,
+    ``notes`` and ``sale_date``. The products are resolved with one query,
+    quantities are summed per product and taken off with a single
+    conditional UPDATE, and the sales are inserted with ``bulk_create``.
+    Raises ``SaleBatchError`` without writing anything when any line refers
+    to an unknown product or the batch needs more than is in stock.
+    Returns the created sales in line order.
+    """
+    ids = {line['product'] for line in lines if line.get('product')}
+    skus = {line['sku'] for line in lines if not line.get('product') and line.get('sku')}
+
+    with transaction.atomic():
+        products = list(Stock.objects.filter(user=user).filter(Q(pk__in=ids) | Q(sku__in=skus))
+                        .order_by().only('id', 'product_name', 'sku', 'quantity', 'price'))
+        by_id = {product.pk: product for product in products}
+        by_sku = defaultdict(list)
+        for product in products:
+            if product.sku:
+                by_sku[product.sku].append(product)
+
+        errors = {}
+        resolved = []
+        sold = defaultdict(int)
+        for i, line in enumerate(lines):
+            if line.get('product'):
+                product = by_id.get(line['product'])
+            else:
+                matches = by_sku.get(line['sku'], [])
+                if len(matches) > 1:
+                    errors[i] = f'SKU "{line["sku"]}" matches several products'
+                    continue
+                product = matches[0] if matches else None
+            if product is None:
+                errors[i] = 'Stock item not found'
+                continue
+            sold[product.pk] += line['quantity_sold']
+            resolved.append((i, line, product))
+
+        for i, line, product in resolved:
+            if sold[product.pk] > product.quantity:
+                errors[i] = (f'Insufficient stock for {product.product_name}. '
+                             f'Available: {product.quantity}, Required: {sold[product.pk]}')
+        if errors:
+            raise SaleBatchError(errors)
+
+        if not decrement_stock_levels(sold):
+            # A concurrent sale got there first; nothing has been applied
+            raise SaleBatchError({i: f'Insufficient stock for {product.product_name}'
+                                  for i, line, product in resolved})
+
+        sales = []
+        for i, line, product in resolved:
+            unit_price = line.get('unit_price')
+            if unit_price is None:
+                unit_price = product.price
+            sales.append(Sale(
+                user=user,
+                product=product,
+                quantity_sold=line['quantity_sold'],
+                unit_price=unit_price,
+                total_amount=line['quantity_sold'] * unit_price,
+                customer_name=line.get('customer_name', ''),
+                customer_phone=line.get('customer_phone', ''),
+                customer_email=line.get('customer_email', ''),
+                notes=line.get('notes', ''),
+                sale_date=line.get('sale_date') or timezone.now(),
+            ))
+        Sale.objects.bulk_create(sales)
+        DailyProductSales.record_sales(sales)
+        bump_dashboard_version(user.pk)
+
+    return sales
+
+
+def decrement_stock_levels(sold):
+    """Take ``{stock_id: quantity}`` off stock in one conditional UPDATE.
+
+    Only products that still have enough stock are updated. Returns False
+    when any product was short, in which case the caller must roll back
+    the decrements that did apply.
+    """
+    if not sold:
+        return True
+    enough = Q()
+    for stock_id, quantity in sold.items():
+        enough |= Q(pk=stock_id, quantity__gte=quantity)
+    remaining = Case(
+        *[When(pk=stock_id, then=F('quantity') - quantity) for stock_id, quantity in sold.items()],
+        output_field=IntegerField(),
+    )
+    updated = Stock.objects.filter(enough).update(quantity=remaining, updated_at=timezone.now())
+    if updated != len(sold):
+        return False
+    LowStockCounter.record_decrements(sold)
+    return True
@@ -0,0 +1,208 @@
+"""
+Database-backed job queue for uploaded files.
+
+An upload is enqueued by creating an ``UploadedFile`` in the ``pending``
+state. Worker processes (``manage.py upload_worker``) claim pending uploads
+one at a time and run the ingestion outside the web request.
+
+While it runs, an upload's ``heartbeat_at`` is bumped after every chunk.
+An upload whose heartbeat stops (its worker was killed) is put back in
+the queue if none of its rows were written yet, and marked failed
+otherwise, since processing it again would add the written chunks twice.
+A worker only records progress and outcome on an upload it still owns,
+and stops as soon as it finds the upload was taken from it.
+"""
+
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import bump_dashboard_version
+from .ingestion import process_uploaded_file
+from .models import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+# Uploads none of whose rows were written, so processing them can't add
+# anything twice: claim_upload and requeueing only take these
+UNPROCESSED = Q(processing_status='pending') | Q(processing_status='failed', records_processed=0)
+
+
+class UploadClaimLost(Exception):
+    """The upload was declared stale and taken from this worker while it ran"""
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_next_upload(worker=None):
+    """Atomically move the oldest pending upload to ``processing``.
+
+    Returns the claimed UploadedFile, or None when the queue is empty.
+    """
+    worker = worker or default_worker_name()
+
+    while True:
+        with transaction.atomic():
+            pending = (UploadedFile.objects
+                       .filter(processing_status='pending')
+                       .order_by('uploaded_at', 'id'))
+            if connection.features.has_select_for_update_skip_locked:
+                # Postgres: concurrent workers skip rows another worker holds
+                pending = pending.select_for_update(skip_locked=True)
+            candidate = pending.values_list('pk', flat=True).first()
+            if candidate is None:
+                return None
+
+            # Without row locks (SQLite) the status check turns the claim
+            # into a compare-and-swap: only one worker's UPDATE matches.
+            claimed = _claim(UploadedFile.objects.filter(pk=candidate, processing_status='pending'), worker)
+
+        if claimed:
+            return UploadedFile.objects.select_related('user').get(pk=candidate)
+
+
+def _claim(queryset, worker):
+    now = timezone.now()
+    return queryset.update(
+        processing_status='processing',
+        worker=worker,
+        started_at=now,
+        heartbeat_at=now,
+        completed_at=None,
+        records_processed=0,
+        error_message=None,
+    )
+
+
+def claim_upload(pk, worker=None):
+    """Claim a specific upload that wrote no rows yet, e.g. to process it by hand.
+
+    Returns the claimed UploadedFile, or None when it is processing,
+    completed, a duplicate or was partly written before it failed.
+    """
+    worker = worker or default_worker_name()
+    if not _claim(UploadedFile.objects.filter(UNPROCESSED, pk=pk), worker):
+        return None
+    return UploadedFile.objects.select_related('user').get(pk=pk)
+
+
+def _owned(uploaded_file):
+    """The upload, as long as it is still being processed by the worker that claimed it"""
+    return UploadedFile.objects.filter(pk=uploaded_file.pk, processing_status='processing',
+                                       worker=uploaded_file.worker)
+
+
+def upload_progress(uploaded_file):
+    """A ``progress`` callback recording the records processed and a heartbeat.
+
+    Ingestion calls it in each chunk's transaction, so the count commits
+    with the rows. Raises UploadClaimLost once the upload no longer
+    belongs to this worker, which rolls back the chunk.
+    """
+
+    def progress(records_processed):
+        uploaded_file.records_processed = records_processed
+        uploaded_file.heartbeat_at = timezone.now()
+        if not _owned(uploaded_file).update(records_processed=records_processed,
+                                            heartbeat_at=uploaded_file.heartbeat_at):
+            raise UploadClaimLost(f'Upload {uploaded_file.pk} was taken from worker {uploaded_file.worker}')
+
+    return progress
+
+
+def finish_upload(uploaded_file, records_processed, error=None):
+    """Record the outcome of processing a claimed upload.
+
+    Returns False, recording nothing, when the upload was taken from this
+    worker in the meantime.
+    """
+    if error is None:
+        uploaded_file.processing_status = 'completed'
+        uploaded_file.records_processed = records_processed
+        uploaded_file.error_message = None
+    else:
+        uploaded_file.processing_status = 'failed'
+        uploaded_file.error_message = str(error)
+    uploaded_file.completed_at = timezone.now()
+
+    finished = _owned(uploaded_file).update(
+        processing_status=uploaded_file.processing_status,
+        records_processed=uploaded_file.records_processed,
+        error_message=uploaded_file.error_message,
+        completed_at=uploaded_file.completed_at,
+    )
+    # A failed upload may still have committed some chunks
+    bump_dashboard_version(uploaded_file.user_id)
+    if not finished:
+        logger.warning('Upload %s was taken from worker %s; its outcome was not recorded',
+                       uploaded_file.pk, uploaded_file.worker)
+        uploaded_file.refresh_from_db()
+    return bool(finished)
+
+
+def run_upload(uploaded_file):
+    """Process a claimed upload, recording progress, outcome and timings"""
+    records_processed, error = 0, None
+    try:
+        records_processed = process_uploaded_file(uploaded_file, upload_progress(uploaded_file))
+    except UploadClaimLost as e:
+        logger.warning('%s; stopped processing it', e)
+        error = e
+    except Exception as e:
+        logger.exception('Processing upload %s failed', uploaded_file.pk)
+        error = e
+
+    finish_upload(uploaded_file, records_processed, error)
+    logger.info('Upload %s %s: %s records in %s', uploaded_file.pk, uploaded_file.processing_status,
+                uploaded_file.records_processed, uploaded_file.processing_time)
+    return uploaded_file
+
+
+def requeue_upload(uploaded_file):
+    """Put an upload back in the queue, e.g. after a failure.
+
+    Only for uploads matching ``UNPROCESSED``: requeueing one that wrote
+    rows would add them again.
+    """
+    uploaded_file.processing_status = 'pending'
+    uploaded_file.worker = None
+    uploaded_file.started_at = None
+    uploaded_file.heartbeat_at = None
+    uploaded_file.completed_at = None
+    uploaded_file.error_message = None
+    uploaded_file.save(update_fields=[
+        'processing_status', 'worker', 'started_at', 'heartbeat_at', 'completed_at', 'error_message',
+    ])
+
+
+def recover_stale_uploads(older_than=timedelta(minutes=30)):
+    """Recover uploads whose worker has sent no heartbeat for ``older_than`` (e.g. it was killed).
+
+    Uploads that had not written any rows go back in the queue. The rest
+    are marked failed: processing them again would add the chunks already
+    written a second time. Returns the numbers requeued and failed.
+    """
+    now = timezone.now()
+    cutoff = now - older_than
+    stale = UploadedFile.objects.filter(
+        # Uploads claimed before heartbeats were recorded have only started_at
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        processing_status='processing',
+    )
+    requeued = stale.filter(records_processed=0).update(
+        processing_status='pending', worker=None, started_at=None, heartbeat_at=None,
+    )
+    failed = stale.filter(records_processed__gt=0).update(
+        processing_status='failed',
+        completed_at=now,
+        error_message='The worker stopped responding after writing some rows. Check the imported data '
+                      'before uploading the rest of the file again.',
+    )
+    return requeued, failed
@@ -0,0 +1,251 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from inventory.benchmarks import (HAS_OPENPYXL, find_regressions, search_terms, seed_tenant, summarize,
+                                  write_legacy_db, write_stock_file)
+from inventory.ingestion import process_uploaded_file
+from inventory.models import Stock, UploadedFile
+from inventory.querybudget import QueryRecorder
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Seed synthetic tenants, time the main request and ingestion paths and report JSON, '
+            'optionally flagging regressions against a baseline run')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=2,
+            help='Synthetic tenants to seed'
+        )
+        parser.add_argument(
+            '--stocks',
+            type=int,
+            default=2000,
+            help='Products per tenant'
+        )
+        parser.add_argument(
+            '--sales',
+            type=int,
+            default=20000,
+            help='Sales per tenant'
+        )
+        parser.add_argument(
+            '--upload-rows',
+            type=int,
+            default=1000,
+            help='Rows per generated upload file'
+        )
+        parser.add_argument(
+            '--legacy-sales',
+            type=int,
+            default=5000,
+            help='Sales in the generated legacy database'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs per benchmark'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for the synthetic data'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the JSON report to this file instead of stdout'
+        )
+        parser.add_argument(
+            '--baseline',
+            type=str,
+            help='JSON report of an earlier run to compare against'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=20,
+            help='Percentage slowdown against the baseline that counts as a regression'
+        )
+        parser.add_argument(
+            '--fail-on-regression',
+            action='store_true',
+            help='Exit with an error when a regression is found (for CI)'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the seeded tenants instead of rolling them back'
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as file:
+                    baseline = json.load(file)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Could not read baseline {options["baseline"]}: {e}')
+
+        self.options = options
+        self.results = {}
+        self.tmp_dir = tempfile.mkdtemp(prefix='bench_')
+        try:
+            # Measure without DEBUG's query log and toolbar, write uploads to a
+            # scratch MEDIA_ROOT and allow the test client's host
+            with override_settings(DEBUG=False, MEDIA_ROOT=self.tmp_dir,
+                                   ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                try:
+                    with transaction.atomic():
+                        self.run_benchmarks()
+                        if not options['keep']:
+                            raise Rollback
+                except Rollback:
+                    pass
+        finally:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'parameters': {key: options[key] for key in
+                               ('users', 'stocks', 'sales', 'upload_rows', 'legacy_sales', 'repeat', 'seed')},
+            },
+            'results': self.results,
+        }
+        if baseline is not None:
+            report['regressions'] = find_regressions(self.results, baseline, options['threshold'] / 100)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+            self.print_summary(report)
+        else:
+            self.stdout.write(output)
+
+        regressions = report.get('regressions') or []
+        for regression in regressions:
+            self.stderr.write(self.style.WARNING(
+                f'Regression: {regression["benchmark"]} {regression["baseline_ms"]:.2f} ms -> '
+                f'{regression["best_ms"]:.2f} ms'
+            ))
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} benchmark(s) regressed by more than {options["threshold"]}%')
+
+    def print_summary(self, report):
+        self.stdout.write(f'{"benchmark":<40}{"best":>12}{"median":>12}{"queries":>9}')
+        for name, result in report['results'].items():
+            self.stdout.write(f'{name:<40}{result["best_ms"]:>9.2f} ms{result["median_ms"]:>9.2f} ms'
+                              f'{result["queries"]:>9}')
+
+    def run_benchmarks(self):
+        options = self.options
+        run_id = f'{int(time.time())}_{User.objects.count() + 1}'
+        users = []
+        for i in range(options['users']):
+            user = User.objects.create_user(f'bench_{run_id}_{i}', password='bench')
+            self.stderr.write(f'Seeding {user.username}: {options["stocks"]} products, {options["sales"]} sales...')
+            seed_tenant(user, stocks=options['stocks'], sales=options['sales'], seed=options['seed'] + i)
+            users.append(user)
+        if not users:
+            raise CommandError('--users must be at least 1')
+
+        user = users[0]
+        client = Client()
+        client.force_login(user)
+
+        self.measure('dashboard', lambda: client.get(reverse('dashboard')))
+        for label, term in search_terms(user):
+            self.measure(f'stock_list_search:{label}',
+                         lambda term=term: client.get(reverse('stock_list'), {'q': term}))
+        self.measure('stock_query', lambda: client.get(reverse('stock_query'), {'query': 'item 00'}))
+
+        product = Stock.objects.filter(user=user).order_by('id').first()
+        if product is not None:
+            Stock.objects.filter(pk=product.pk).update(quantity=10 ** 6)
+            self.measure('add_sale', lambda: client.post(reverse('add_sale'), {
+                'product': product.pk, 'quantity_sold': 1, 'unit_price': str(product.price),
+            }))
+
+        formats = ['csv', 'xlsx'] if HAS_OPENPYXL else ['csv']
+        for extension in formats:
+            path = self.write_upload(f'bench.{extension}')
+            self.measure(f'process_uploaded_file:{extension}', process_uploaded_file,
+                         setup=lambda path=path: self.create_upload(path))
+
+        # Only the bench's own uploads: --process-all would also claim
+        # whatever users have queued in this database
+        paths = [self.write_upload(f'queued_{i}.csv') for i in range(3)]
+        self.measure('process_uploads',
+                     lambda uploads: [call_command('process_uploads', '--file-id', upload.pk, stdout=StringIO())
+                                      for upload in uploads],
+                     setup=lambda: [self.create_upload(path) for path in paths])
+
+        legacy_db = os.path.join(self.tmp_dir, 'legacy.db')
+        write_legacy_db(legacy_db, stocks=max(options['stocks'] // 4, 1), sales=options['legacy_sales'],
+                        seed=options['seed'])
+        self.measure('import_legacy_data',
+                     lambda username: call_command('import_legacy_data', '--user', username,
+                                                   '--db-path', legacy_db, stdout=StringIO()),
+                     setup=lambda: self.new_user('legacy').username)
+
+    def measure(self, name, run, setup=None):
+        """Record the timings of ``run`` (called with ``setup()``'s result, if any)"""
+        timings = []
+        for _ in range(self.options['repeat']):
+            args = [setup()] if setup else []
+            recorder = QueryRecorder()
+            with recorder.record():
+                started = time.perf_counter()
+                response = run(*args)
+                elapsed = (time.perf_counter() - started) * 1000
+            status = getattr(response, 'status_code', None)
+            if status is not None and status >= 400:
+                raise CommandError(f'{name} returned HTTP {status}')
+            timings.append(elapsed)
+        self.results[name] = {**summarize(timings), 'queries': recorder.count}
+        self.stderr.write(f'{name}: {self.results[name]["best_ms"]:.2f} ms')
+
+    def new_user(self, label):
+        return User.objects.create_user(f'bench_{label}_{User.objects.count() + 1}_{time.time_ns()}')
+
+    def write_upload(self, name):
+        os.makedirs(os.path.join(self.tmp_dir, 'uploads'), exist_ok=True)
+        path = os.path.join('uploads', name)
+        write_stock_file(os.path.join(self.tmp_dir, path), self.options['upload_rows'], self.options['seed'])
+        return path
+
+    def create_upload(self, path):
+        # A fresh tenant per run, so each run inserts the same rows
+        return UploadedFile.objects.create(
+            user=self.new_user('upload'),
+            file_name=os.path.basename(path),
+            file_path=path,
+            file_type='stock',
+        )
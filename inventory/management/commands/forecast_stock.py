@@ -0,0 +1,67 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from inventory import forecasting
+from inventory.cache import bump_dashboard_version
+
+
+class Command(BaseCommand):
+    help = 'Recompute sales velocity, reorder points and days of cover of every product (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Only forecast the products of this user'
+        )
+        parser.add_argument(
+            '--history-days',
+            type=int,
+            default=forecasting.HISTORY_DAYS,
+            help='Days of sales the velocity is averaged over'
+        )
+        parser.add_argument(
+            '--halflife-days',
+            type=float,
+            default=forecasting.HALFLIFE_DAYS,
+            help='Age in days at which a day of sales counts half as much as yesterday'
+        )
+        parser.add_argument(
+            '--lead-time-days',
+            type=float,
+            default=forecasting.LEAD_TIME_DAYS,
+            help='Days a reorder takes to arrive; the reorder point covers this long'
+        )
+        parser.add_argument(
+            '--service-z',
+            type=float,
+            default=forecasting.SERVICE_Z,
+            help='Safety stock in standard deviations of daily sales (1.65 for about 95%%)'
+        )
+
+    def handle(self, *args, **options):
+        if not forecasting.HAS_NUMPY:
+            raise CommandError('numpy is required to compute forecasts.')
+        if options['history_days'] < 1 or options['halflife_days'] <= 0:
+            raise CommandError('--history-days and --halflife-days must be positive.')
+
+        users = User.objects.filter(stocks__isnull=False).distinct()
+        if options['user']:
+            users = User.objects.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f'User "{options["user"]}" does not exist.')
+
+        for user in users.iterator():
+            started = time.perf_counter()
+            count = forecasting.forecast_user(
+                user,
+                history_days=options['history_days'],
+                halflife_days=options['halflife_days'],
+                lead_time_days=options['lead_time_days'],
+                z=options['service_z'],
+            )
+            bump_dashboard_version(user.pk)
+            self.stdout.write(f'{user.username}: {count} products in {time.perf_counter() - started:.2f}s')
+
+        self.stdout.write(self.style.SUCCESS('Forecasts updated'))
@@ -1,10 +1,13 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
-from inventory.models import Stock, Sale
+from django.db import transaction
+from inventory.models import Stock, Sale, DailyProductSales, ImportCheckpoint, LowStockCounter
+from inventory.ingestion import parse_sale_date
+from inventory.cache import bump_dashboard_version
 import sqlite3
 import os
+import time
 from decimal import Decimal
-from datetime import datetime
 
 
 class Command(BaseCommand):
@@ -28,11 +31,35 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear existing data before import'
         )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue an interrupted import from its last checkpoint'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows fetched and inserted per batch'
+        )
+        parser.add_argument(
+            '--progress-every',
+            type=int,
+            default=100000,
+            help='Report progress after this many rows'
+        )
 
     def handle(self, *args, **options):
         db_path = options['db_path']
         username = options['user']
         clear_data = options['clear']
+        self.resume = options['resume']
+        self.batch_size = options['batch_size']
+        self.progress_every = options['progress_every']
+        self.source = os.path.abspath(db_path)
+
+        if clear_data and self.resume:
+            raise CommandError('--clear and --resume cannot be used together.')
 
         # Check if database file exists
         if not os.path.exists(db_path):
@@ -51,6 +78,7 @@ class Command(BaseCommand):
             self.stdout.write('Clearing existing data...')
             Stock.objects.filter(user=user).delete()
             Sale.objects.filter(user=user).delete()
+            ImportCheckpoint.objects.filter(user=user, source=self.source).delete()
 
         # Connect to old database
         conn = sqlite3.connect(db_path)
@@ -77,109 +105,133 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f'Error importing sales data: {e}'))
 
         conn.close()
+        bump_dashboard_version(user.pk)
         self.stdout.write(self.style.SUCCESS('Data import completed successfully!'))
 
     def import_stock_data(self, cursor, user):
         """Import stock data from old database"""
         self.stdout.write('Importing stock data...')
         
-        # Get column names
-        cursor.execute("PRAGMA table_info(stock)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # Fetch all stock data
-        cursor.execute("SELECT * FROM stock")
-        rows = cursor.fetchall()
+        update_fields = ['quantity', 'price', 'supplier', 'category', 'sku', 'description', 'minimum_stock',
+                         'updated_at']
         
-        stock_count = 0
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-            
-            # Map old fields to new model fields
-            stock_data = {
-                'user': user,
-                'product_name': row_dict.get('ProductName', row_dict.get('product_name', 'Unknown')),
-                'quantity': int(row_dict.get('Quantity', row_dict.get('quantity', 0))),
-                'price': Decimal(str(row_dict.get('Price', row_dict.get('price', 0)))),
-                'supplier': row_dict.get('Supplier', row_dict.get('supplier', '')),
-                'category': row_dict.get('Category', row_dict.get('category', '')),
-                'sku': row_dict.get('SKU', row_dict.get('sku', '')),
-                'description': row_dict.get('Description', row_dict.get('description', '')),
-                'minimum_stock': int(row_dict.get('MinimumStock', row_dict.get('minimum_stock', 0))),
-            }
-            
-            # Create or update stock
-            stock, created = Stock.objects.get_or_create(
-                user=user,
-                product_name=stock_data['product_name'],
-                defaults=stock_data
+        def save_batch(rows):
+            # One row per product: an upsert can't touch the same row twice.
+            # The last row for a name wins, as when rows were saved one by one.
+            stocks = {}
+            for row_dict in rows:
+                stock = Stock(**self.map_stock_row(row_dict, user))
+                stocks[stock.product_name] = stock
+            stocks = list(stocks.values())
+            batch = Stock.objects.filter(user=user, product_name__in=[stock.product_name for stock in stocks])
+            low_before = LowStockCounter.low_states(batch)
+            # Create or update stock, one statement per batch
+            Stock.objects.bulk_create(
+                stocks,
+                update_conflicts=True,
+                unique_fields=['user', 'product_name'],
+                update_fields=update_fields,
             )
-            
-            if not created:
-                # Update existing stock
-                for key, value in stock_data.items():
-                    if key != 'user' and key != 'product_name':
-                        setattr(stock, key, value)
-                stock.save()
-            
-            stock_count += 1
+            LowStockCounter.record_changes(user.pk, low_before, LowStockCounter.low_states(batch))
+            return len(rows)
         
+        stock_count = self.import_table(cursor, user, 'stock', save_batch)
         self.stdout.write(f'Imported {stock_count} stock items')
 
+    def map_stock_row(self, row_dict, user):
+        """Map old fields to new model fields"""
+        return {
+            'user': user,
+            'product_name': row_dict.get('ProductName', row_dict.get('product_name', 'Unknown')),
+            'quantity': int(row_dict.get('Quantity', row_dict.get('quantity', 0))),
+            'price': Decimal(str(row_dict.get('Price', row_dict.get('price', 0)))),
+            'supplier': row_dict.get('Supplier', row_dict.get('supplier', '')),
+            'category': row_dict.get('Category', row_dict.get('category', '')),
+            'sku': row_dict.get('SKU', row_dict.get('sku', '')),
+            'description': row_dict.get('Description', row_dict.get('description', '')),
+            'minimum_stock': int(row_dict.get('MinimumStock', row_dict.get('minimum_stock', 0))),
+        }
+
     def import_sales_data(self, cursor, user):
         """Import sales data from old database"""
         self.stdout.write('Importing sales data...')
         
-        # Get column names
-        cursor.execute("PRAGMA table_info(sales)")
-        columns = [column[1] for column in cursor.fetchall()]
+        # Product name -> (id, price), loaded once instead of a query per sale
+        products = {
+            name: (stock_id, price)
+            for name, stock_id, price in Stock.objects.filter(user=user).values_list('product_name', 'id', 'price')
+        }
         
-        # Fetch all sales data
-        cursor.execute("SELECT * FROM sales")
-        rows = cursor.fetchall()
-        
-        sales_count = 0
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-            
-            # Find corresponding stock item
-            product_name = row_dict.get('ProductName', row_dict.get('product_name', ''))
-            try:
-                stock = Stock.objects.get(user=user, product_name=product_name)
-            except Stock.DoesNotExist:
-                self.stdout.write(self.style.WARNING(f'Stock item "{product_name}" not found, skipping sale record'))
-                continue
+        def save_batch(rows):
+            sales = []
+            for row_dict in rows:
+                # Find corresponding stock item
+                product_name = row_dict.get('ProductName', row_dict.get('product_name', ''))
+                if product_name not in products:
+                    self.stdout.write(self.style.WARNING(f'Stock item "{product_name}" not found, skipping sale record'))
+                    continue
+                stock_id, stock_price = products[product_name]
+                
+                quantity_sold = int(row_dict.get('QuantitySold', row_dict.get('quantity_sold', 0)))
+                unit_price = Decimal(str(row_dict.get('UnitPrice', row_dict.get('unit_price', stock_price))))
+                
+                sales.append(Sale(
+                    user=user,
+                    product_id=stock_id,
+                    quantity_sold=quantity_sold,
+                    unit_price=unit_price,
+                    total_amount=quantity_sold * unit_price,
+                    customer_name=row_dict.get('CustomerName', row_dict.get('customer_name', '')),
+                    customer_phone=row_dict.get('CustomerPhone', row_dict.get('customer_phone', '')),
+                    customer_email=row_dict.get('CustomerEmail', row_dict.get('customer_email', '')),
+                    notes=row_dict.get('Notes', row_dict.get('notes', '')),
+                    sale_date=parse_sale_date(row_dict.get('EntryDate', row_dict.get('sale_date'))),
+                ))
             
-            # Parse date
-            sale_date = row_dict.get('EntryDate', row_dict.get('sale_date', datetime.now()))
-            if isinstance(sale_date, str):
-                try:
-                    sale_date = datetime.strptime(sale_date, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    try:
-                        sale_date = datetime.strptime(sale_date, '%Y-%m-%d')
-                    except ValueError:
-                        sale_date = datetime.now()
-            
-            # Create sale record
-            quantity_sold = int(row_dict.get('QuantitySold', row_dict.get('quantity_sold', 0)))
-            unit_price = Decimal(str(row_dict.get('UnitPrice', row_dict.get('unit_price', stock.price))))
+            # bulk_create skips Sale.save(), so historical sales don't touch stock
+            Sale.objects.bulk_create(sales)
+            DailyProductSales.record_sales(sales)
+            return len(sales)
+        
+        sales_count = self.import_table(cursor, user, 'sales', save_batch)
+        self.stdout.write(f'Imported {sales_count} sales records')
+
+    def import_table(self, cursor, user, table, save_batch):
+        """Stream a legacy table in rowid order, saving and checkpointing each batch"""
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(user=user, source=self.source, table=table)
+        if not self.resume:
+            checkpoint.last_rowid = 0
+            checkpoint.rows_read = 0
+        elif checkpoint.last_rowid:
+            self.stdout.write(f'Resuming {table} after rowid {checkpoint.last_rowid} '
+                              f'({checkpoint.rows_read} rows already read)')
+        
+        cursor.execute(f'SELECT rowid, * FROM "{table}" WHERE rowid > ? ORDER BY rowid', (checkpoint.last_rowid,))
+        columns = [column[0] for column in cursor.description[1:]]
+        
+        imported = 0
+        read = 0
+        next_report = self.progress_every
+        started = time.monotonic()
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
             
-            sale_data = {
-                'user': user,
-                'product': stock,
-                'quantity_sold': quantity_sold,
-                'unit_price': unit_price,
-                'total_amount': quantity_sold * unit_price,
-                'customer_name': row_dict.get('CustomerName', row_dict.get('customer_name', '')),
-                'customer_phone': row_dict.get('CustomerPhone', row_dict.get('customer_phone', '')),
-                'customer_email': row_dict.get('CustomerEmail', row_dict.get('customer_email', '')),
-                'notes': row_dict.get('Notes', row_dict.get('notes', '')),
-                'sale_date': sale_date,
-            }
+            # The checkpoint commits with the batch, so a resumed import
+            # neither skips nor duplicates rows.
+            with transaction.atomic():
+                imported += save_batch([dict(zip(columns, row[1:])) for row in rows])
+                checkpoint.last_rowid = rows[-1][0]
+                checkpoint.rows_read += len(rows)
+                checkpoint.save()
+            read += len(rows)
             
-            # Create sale (don't auto-update stock since it's historical data)
-            Sale.objects.create(**sale_data)
-            sales_count += 1
+            if checkpoint.rows_read >= next_report:
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'  {table}: {checkpoint.rows_read} rows read '
+                                  f'({read / elapsed if elapsed else 0:.0f} rows/sec)')
+                next_report = checkpoint.rows_read + self.progress_every
         
-        self.stdout.write(f'Imported {sales_count} sales records')
\ No newline at end of file
+        checkpoint.save()
+        return imported
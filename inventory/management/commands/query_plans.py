@@ -0,0 +1,117 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from inventory.models import Stock, Sale
+from inventory.benchmarks import explain, seed_tenant, time_query, view_queries
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Show query plans and timings of the main views with and without the tuned indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Measure an existing user instead of a seeded one'
+        )
+        parser.add_argument(
+            '--stocks',
+            type=int,
+            default=20000,
+            help='Products to seed for the benchmark user'
+        )
+        parser.add_argument(
+            '--sales',
+            type=int,
+            default=200000,
+            help='Sales to seed for the benchmark user'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs per query; the best time is reported'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the seeded data instead of rolling it back'
+        )
+        parser.add_argument(
+            '--no-plans',
+            action='store_true',
+            help='Only print timings'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = self.get_user(options)
+
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+
+                after = self.measure(user, options['repeat'], 'after')
+
+                # Index DDL is transactional on SQLite and PostgreSQL, so the
+                # "before" state is measured in a savepoint and rolled back.
+                savepoint = transaction.savepoint()
+                self.drop_indexes()
+                before = self.measure(user, options['repeat'], 'before')
+                transaction.savepoint_rollback(savepoint)
+
+                self.report(before, after, show_plans=not options['no_plans'])
+
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
+
+    def get_user(self, options):
+        if options['user']:
+            try:
+                return User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User "{options["user"]}" does not exist.')
+
+        user = User.objects.create_user(f'query_plans_{User.objects.count() + 1}')
+        self.stdout.write(f'Seeding {options["stocks"]} products and {options["sales"]} sales...')
+        seed_tenant(user, stocks=options['stocks'], sales=options['sales'])
+        return user
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in (Stock, Sale):
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+
+    def measure(self, user, repeat, tag):
+        results = {}
+        for view, label, queryset, evaluate in view_queries(user):
+            results[(view, label)] = {
+                'plan': explain(queryset, tag),
+                'ms': time_query(queryset, evaluate, repeat),
+            }
+        return results
+
+    def report(self, before, after, show_plans=True):
+        current_view = None
+        for key in after:
+            view, label = key
+            if view != current_view:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n{view}'))
+                current_view = view
+
+            before_ms, after_ms = before[key]['ms'], after[key]['ms']
+            speedup = before_ms / after_ms if after_ms else 0
+            self.stdout.write(f'  {label:<22} before {before_ms:9.2f} ms   after {after_ms:9.2f} ms   x{speedup:.1f}')
+
+            if show_plans:
+                for name, result in (('before', before[key]), ('after', after[key])):
+                    self.stdout.write(f'    plan ({name}):')
+                    for line in result['plan'].splitlines():
+                        self.stdout.write(f'      {line}')
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from inventory.models import Sale, DailyProductSales
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the daily product sales rollup from the sales history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Only rebuild the rollup of this user'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rollup rows inserted per batch'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f'User "{options["user"]}" does not exist.')
+
+        for user in users.iterator():
+            rows = self.rebuild_user(user, options['batch_size'])
+            self.stdout.write(f'{user.username}: {rows} daily rows')
+
+        self.stdout.write(self.style.SUCCESS('Sales rollup rebuilt'))
+
+    def rebuild_user(self, user, batch_size):
+        """Replace a user's rollup with totals aggregated from Sale"""
+        # TruncDate buckets in the current time zone, like DailyProductSales.day_of
+        daily_totals = (Sale.objects.filter(user=user)
+                        .annotate(day=TruncDate('sale_date'))
+                        .values('day', 'product_id')
+                        .annotate(quantity=Sum('quantity_sold'), revenue=Sum('total_amount'), count=Count('id'))
+                        .order_by())
+
+        rows = 0
+        with transaction.atomic():
+            DailyProductSales.objects.filter(user=user).delete()
+
+            batch = []
+            for totals in daily_totals.iterator(chunk_size=batch_size):
+                batch.append(DailyProductSales(
+                    user=user,
+                    day=totals['day'],
+                    product_id=totals['product_id'],
+                    quantity_sold=totals['quantity'],
+                    revenue=totals['revenue'],
+                    sales_count=totals['count'],
+                ))
+                if len(batch) >= batch_size:
+                    DailyProductSales.objects.bulk_create(batch)
+                    rows += len(batch)
+                    batch = []
+            DailyProductSales.objects.bulk_create(batch)
+            rows += len(batch)
+
+        return rows
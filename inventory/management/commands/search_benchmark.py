@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import transaction
+from inventory.models import Stock
+from inventory.benchmarks import search_terms, seed_tenant, time_query
+from inventory.search import _icontains_filter, search_stocks
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare the indexed product search with the icontains scan on a seeded tenant'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stocks',
+            type=int,
+            default=100000,
+            help='Products to seed for the benchmark user'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs per query; the best time is reported'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(f'search_benchmark_{User.objects.count() + 1}')
+                self.stdout.write(f'Seeding {options["stocks"]} products...')
+                seed_tenant(user, stocks=options['stocks'], sales=0)
+
+                self.stdout.write(f'{"query":<16}{"matches":>9}{"scan page":>14}{"scan count":>14}'
+                                  f'{"indexed page":>15}{"indexed count":>16}')
+                for label, term in search_terms(user):
+                    scan = Stock.objects.filter(user=user).filter(_icontains_filter(term))
+                    results = search_stocks(user, term)
+                    timings = [
+                        time_query(queryset, evaluate, options['repeat'])
+                        for queryset in (scan, results)
+                        for evaluate in (lambda qs: list(qs[:20]), lambda qs: qs.count())
+                    ]
+                    self.stdout.write(f'{label:<16}{results.count():>9}' +
+                                      ''.join(f'{ms:>12.2f} ms' for ms in timings))
+                raise Rollback
+        except Rollback:
+            pass
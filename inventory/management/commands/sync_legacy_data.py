@@ -0,0 +1,328 @@
+"""
+Incremental sync from a legacy POS export.
+
+Replaces the old process_data.py script, which deleted the whole stock
+table (and the last days of sales) and re-inserted every row on each sync.
+Rows are matched on their legacy primary key (the SQLite rowid, which an
+INTEGER PRIMARY KEY column aliases), stored in ``legacy_id`` next to the
+``--source`` it came from in ``legacy_source``, so tills syncing into the
+same account never match each other's rows:
+
+* stock exports are full snapshots: new products are inserted, changed
+  ones updated, and products that left the export deleted (unless they
+  still have sales);
+* sales are read above the source's watermark, kept in ``ImportCheckpoint``,
+  plus a look-back window of recent days, where the till may still edit or
+  void sales. New rows are inserted, changed ones updated, and sales that
+  disappeared from the window deleted.
+
+Unchanged rows are not written. Everything runs in one transaction, so a
+failed sync leaves the data and the watermark as they were.
+"""
+
+import os
+import sqlite3
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from inventory.cache import bump_dashboard_version
+from inventory.ingestion import parse_sale_date
+from inventory.models import DailyProductSales, ImportCheckpoint, LowStockCounter, Sale, Stock
+
+
+STOCK_FIELDS = ['product_name', 'quantity', 'price', 'supplier', 'category', 'sku', 'description',
+                'minimum_stock']
+SALE_FIELDS = ['product_id', 'quantity_sold', 'unit_price', 'total_amount', 'customer_name', 'customer_phone',
+               'customer_email', 'notes', 'sale_date']
+
+
+class Rollback(Exception):
+    pass
+
+
+def column(row, *names, default=None):
+    """The first of ``names`` that is set in a legacy row"""
+    for name in names:
+        if row.get(name) is not None:
+            return row[name]
+    return default
+
+
+def money(value):
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def stock_fields(row):
+    return {
+        'product_name': str(column(row, 'ProductName', 'product_name', default='Unknown')),
+        'quantity': int(column(row, 'Quantity', 'quantity', default=0)),
+        'price': money(column(row, 'Price', 'price', default=0)),
+        'supplier': column(row, 'Supplier', 'supplier', default=''),
+        'category': column(row, 'Category', 'category', default=''),
+        'sku': column(row, 'SKU', 'sku', default=''),
+        'description': column(row, 'Description', 'description', default=''),
+        'minimum_stock': int(column(row, 'MinimumStock', 'minimum_stock', default=0)),
+    }
+
+
+def changed(current, fields):
+    # NULL and '' are the same to the legacy system
+    return any((current[name] if current[name] is not None else '') != value for name, value in fields.items())
+
+
+class Command(BaseCommand):
+    help = 'Apply only the changed rows of a legacy POS export, matched on the legacy primary key'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--db-path',
+            type=str,
+            default='smc.db',
+            help='Path to the legacy SQLite export'
+        )
+        parser.add_argument(
+            '--user',
+            type=str,
+            required=True,
+            help='Username to sync the data into'
+        )
+        parser.add_argument(
+            '--source',
+            type=str,
+            default='legacy-sync',
+            help='Name the synced rows and the sales watermark are kept under; use one per till or export'
+        )
+        parser.add_argument(
+            '--lookback-days',
+            type=int,
+            default=20,
+            help='Days of already synced sales to re-check for edits and deletes (1 for daily exports)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows fetched and written per batch'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the changes without applying them'
+        )
+        parser.add_argument(
+            '--remove-file',
+            action='store_true',
+            help='Delete the export after a successful sync'
+        )
+
+    def handle(self, *args, **options):
+        db_path = options['db_path']
+        self.batch_size = options['batch_size']
+
+        if not os.path.exists(db_path):
+            raise CommandError(f'Database file "{db_path}" does not exist.')
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["user"]}" does not exist. Please create the user first.')
+
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('stock', 'sales')")
+        tables = {name for name, in cursor.fetchall()}
+        if not tables:
+            raise CommandError(f'"{db_path}" has neither a stock nor a sales table.')
+
+        counts = {}
+        try:
+            with transaction.atomic():
+                if 'stock' in tables:
+                    counts['stock'] = self.sync_stock(cursor, user, options['source'])
+                if 'sales' in tables:
+                    counts['sales'] = self.sync_sales(cursor, user, options['source'], options['lookback_days'])
+                if options['dry_run']:
+                    raise Rollback
+        except Rollback:
+            pass
+        finally:
+            conn.close()
+
+        for table, (inserted, updated, deleted) in counts.items():
+            self.stdout.write(f'{table}: {inserted} inserted, {updated} updated, {deleted} deleted')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run, nothing was written'))
+            return
+
+        bump_dashboard_version(user.pk)
+        if options['remove_file']:
+            os.remove(db_path)
+        self.stdout.write(self.style.SUCCESS('Sync completed successfully!'))
+
+    def sync_stock(self, cursor, user, source):
+        """Diff the stock snapshot against the user's products synced from ``source``"""
+        stocks = Stock.objects.filter(user=user)
+        current = {row['legacy_id']: row for row in stocks.filter(legacy_source=source, legacy_id__isnull=False)
+                   .values('id', 'legacy_id', *STOCK_FIELDS)}
+        # Products added by hand or by an earlier full import are adopted by name
+        unmatched = dict(stocks.filter(legacy_id__isnull=True).values_list('product_name', 'id'))
+        # Product names are unique per user, so another source's products are left alone
+        elsewhere = set(stocks.filter(legacy_id__isnull=False).exclude(legacy_source=source)
+                        .values_list('product_name', flat=True))
+        skipped = 0
+
+        low_before = LowStockCounter.low_states(stocks)
+        inserted = updated = 0
+        now = timezone.now()
+        cursor.execute('SELECT rowid, * FROM "stock" ORDER BY rowid')
+        columns = [description[0] for description in cursor.description[1:]]
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+
+            new, changes = [], []
+            for row in rows:
+                key, fields = row[0], stock_fields(dict(zip(columns, row[1:])))
+                existing = current.pop(key, None)
+                if existing is not None:
+                    if changed(existing, fields):
+                        changes.append(Stock(pk=existing['id'], legacy_source=source, legacy_id=key, updated_at=now,
+                                             **fields))
+                elif fields['product_name'] in unmatched:
+                    pk = unmatched.pop(fields['product_name'])
+                    changes.append(Stock(pk=pk, legacy_source=source, legacy_id=key, updated_at=now, **fields))
+                elif fields['product_name'] in elsewhere:
+                    skipped += 1
+                else:
+                    new.append(Stock(user=user, legacy_source=source, legacy_id=key, **fields))
+
+            Stock.objects.bulk_create(new)
+            # bulk_update skips auto_now, so updated_at is set above
+            Stock.objects.bulk_update(changes, [*STOCK_FIELDS, 'legacy_source', 'legacy_id', 'updated_at'])
+            inserted += len(new)
+            updated += len(changes)
+
+        LowStockCounter.record_changes(user.pk, low_before, LowStockCounter.low_states(stocks))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{skipped} product(s) already synced from another source were skipped'
+            ))
+
+        # Whatever is left in ``current`` is gone from the export
+        gone = Stock.objects.filter(pk__in=[row['id'] for row in current.values()])
+        kept = gone.filter(sales__isnull=False).distinct().count()
+        if kept:
+            self.stdout.write(self.style.WARNING(
+                f'{kept} product(s) missing from the export still have sales and were kept'
+            ))
+        gone.filter(sales__isnull=True).delete()
+        return inserted, updated, len(current) - kept
+
+    def sync_sales(self, cursor, user, source, lookback_days):
+        """Apply new sales above the watermark and edits and deletes inside the look-back window"""
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(user=user, source=source, table='sales')
+        watermark = checkpoint.last_rowid
+        since = timezone.localdate() - timedelta(days=lookback_days)
+        window_start = timezone.make_aware(datetime.combine(since, time.min))
+
+        products = {
+            name: (stock_id, price)
+            for name, stock_id, price in Stock.objects.filter(user=user).values_list('product_name', 'id', 'price')
+        }
+
+        cursor.execute('SELECT * FROM "sales" LIMIT 0')
+        columns = [description[0] for description in cursor.description]
+        date_column = next((name for name in ('EntryDate', 'sale_date') if name in columns), None)
+        if date_column:
+            # Legacy dates are ISO strings, so they compare as text
+            cursor.execute(f'SELECT rowid, * FROM "sales" WHERE rowid > ? OR "{date_column}" >= ? ORDER BY rowid',
+                           (watermark, since.isoformat()))
+        else:
+            cursor.execute('SELECT rowid, * FROM "sales" WHERE rowid > ? ORDER BY rowid', (watermark,))
+
+        seen = set()
+        last_key = watermark
+        inserted, removed, added = [], [], []
+        skipped = 0
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+
+            keys = [row[0] for row in rows]
+            existing = {sale.legacy_id: sale
+                        for sale in Sale.objects.filter(user=user, legacy_source=source, legacy_id__in=keys)}
+            new, changes = [], []
+            for row in rows:
+                key, row_dict = row[0], dict(zip(columns, row[1:]))
+                seen.add(key)
+                last_key = max(last_key, key)
+
+                product_name = column(row_dict, 'ProductName', 'product_name', default='')
+                if product_name not in products:
+                    skipped += 1
+                    continue
+                stock_id, stock_price = products[product_name]
+                quantity_sold = int(column(row_dict, 'QuantitySold', 'quantity_sold', default=0))
+                unit_price = money(column(row_dict, 'UnitPrice', 'unit_price', default=stock_price))
+                fields = {
+                    'product_id': stock_id,
+                    'quantity_sold': quantity_sold,
+                    'unit_price': unit_price,
+                    'total_amount': quantity_sold * unit_price,
+                    'customer_name': column(row_dict, 'CustomerName', 'customer_name', default=''),
+                    'customer_phone': column(row_dict, 'CustomerPhone', 'customer_phone', default=''),
+                    'customer_email': column(row_dict, 'CustomerEmail', 'customer_email', default=''),
+                    'notes': column(row_dict, 'Notes', 'notes', default=''),
+                }
+                raw_date = row_dict.get(date_column) if date_column else None
+
+                sale = existing.get(key)
+                if sale is None:
+                    new.append(Sale(user=user, legacy_source=source, legacy_id=key,
+                                    sale_date=parse_sale_date(raw_date), **fields))
+                    continue
+                # An undated row keeps the date it was first synced with
+                fields['sale_date'] = parse_sale_date(raw_date) if raw_date else sale.sale_date
+                if changed(vars(sale), fields):
+                    changes.append(Sale(pk=sale.pk, user=user, legacy_source=source, legacy_id=key, **fields))
+                    removed.append(sale)
+
+            # bulk_create skips Sale.save(), so synced sales don't touch stock;
+            # the stock export carries the till's quantities
+            Sale.objects.bulk_create(new)
+            Sale.objects.bulk_update(changes, SALE_FIELDS)
+            inserted.extend(new)
+            added.extend(changes)
+
+        # Synced sales among the rows read that the export no longer has were voided
+        synced = Sale.objects.filter(user=user, legacy_source=source, legacy_id__isnull=False, legacy_id__lte=last_key)
+        if date_column:
+            synced = synced.filter(sale_date__gte=window_start)
+        else:
+            # Only the rows above the watermark were read
+            synced = synced.filter(legacy_id__gt=watermark)
+        voided = [
+            sale for sale in synced.only('id', 'legacy_id')
+            if sale.legacy_id not in seen
+        ]
+        for start in range(0, len(voided), self.batch_size):
+            Sale.objects.filter(pk__in=[sale.pk for sale in voided[start:start + self.batch_size]]).delete()
+
+        # Keep the daily rollup in step: add what was written and take back
+        # out the old values of edited sales. Deleting the voided ones took
+        # them out already.
+        DailyProductSales.record_sales(inserted + added)
+        DailyProductSales.remove_sales(removed)
+
+        if skipped:
+            self.stdout.write(self.style.WARNING(f'{skipped} sale(s) for unknown products were skipped'))
+
+        checkpoint.last_rowid = last_key
+        checkpoint.rows_read += len(seen)
+        checkpoint.save()
+        return len(inserted), len(added), len(voided)
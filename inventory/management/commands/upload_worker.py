@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from inventory.jobs import (claim_next_upload, default_worker_name, recover_stale_uploads,
+                            run_upload)
+from datetime import timedelta
+import time
+
+
+class Command(BaseCommand):
+    help = 'Run a worker that processes queued file uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process every pending upload, then exit instead of polling'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls when the queue is empty'
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=30,
+            help='Recover uploads whose worker has sent no heartbeat for this many minutes'
+        )
+        parser.add_argument(
+            '--worker-name',
+            type=str,
+            help='Name recorded on claimed uploads (defaults to host:pid)'
+        )
+
+    def handle(self, *args, **options):
+        worker = options['worker_name'] or default_worker_name()
+        stale_after = timedelta(minutes=options['stale_after'])
+
+        self.stdout.write(f'Upload worker {worker} started')
+
+        try:
+            while True:
+                requeued, failed = recover_stale_uploads(stale_after)
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale uploads'))
+                if failed:
+                    self.stdout.write(self.style.WARNING(
+                        f'Marked {failed} stale uploads failed; they had already written some rows'
+                    ))
+
+                uploaded_file = claim_next_upload(worker)
+                if uploaded_file is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f'Processing file: {uploaded_file.file_name}')
+                run_upload(uploaded_file)
+
+                if uploaded_file.processing_status == 'completed':
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Processed {uploaded_file.records_processed} records from '
+                        f'{uploaded_file.file_name} in {uploaded_file.processing_time}'
+                    ))
+                else:
+                    self.stdout.write(self.style.ERROR(
+                        f'Error processing {uploaded_file.file_name}: {uploaded_file.error_message}'
+                    ))
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(f'Upload worker {worker} stopped')
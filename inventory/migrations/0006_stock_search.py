@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:20
+
+from django.db import migrations
+
+# The SQL is frozen here rather than imported from inventory.search, so
+# later changes to the search module can't change what this migration does.
+# inventory.signals re-creates the SQLite triggers from the current
+# definitions after every migrate.
+
+SEARCH_FIELDS = ['product_name', 'sku', 'supplier', 'category']
+
+FTS_TABLE = 'inventory_stock_fts'
+
+POSTGRES_INDEX_SQL = ['CREATE EXTENSION IF NOT EXISTS pg_trgm'] + [
+    f'CREATE INDEX IF NOT EXISTS stock_{field}_trgm_idx ON inventory_stock '
+    f'USING gin ({field} gin_trgm_ops)'
+    for field in SEARCH_FIELDS
+]
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON inventory_stock BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, product_name, sku, supplier, category)
+            VALUES (new.id, new.product_name, new.sku, new.supplier, new.category);
+        END''',
+    f'{FTS_TABLE}_ad': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON inventory_stock BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, product_name, sku, supplier, category)
+            VALUES ('delete', old.id, old.product_name, old.sku, old.supplier, old.category);
+        END''',
+    f'{FTS_TABLE}_au': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF product_name, sku, supplier, category ON inventory_stock BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, product_name, sku, supplier, category)
+            VALUES ('delete', old.id, old.product_name, old.sku, old.supplier, old.category);
+            INSERT INTO {FTS_TABLE} (rowid, product_name, sku, supplier, category)
+            VALUES (new.id, new.product_name, new.sku, new.supplier, new.category);
+        END''',
+}
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_INDEX_SQL:
+                cursor.execute(sql)
+
+        elif connection.vendor == 'sqlite':
+            # The trigram tokenizer needs SQLite 3.34+
+            cursor.execute('SELECT sqlite_version()')
+            if tuple(int(part) for part in cursor.fetchone()[0].split('.')) < (3, 34):
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{', '.join(SEARCH_FIELDS)}, content='inventory_stock', content_rowid='id', "
+                f"tokenize='trigram')"
+            )
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for field in SEARCH_FIELDS:
+                cursor.execute(f'DROP INDEX IF EXISTS stock_{field}_trgm_idx')
+        elif connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_daily_product_sales'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_low_stock(apps, schema_editor):
+    Stock = apps.get_model('inventory', 'Stock')
+    LowStockCounter = apps.get_model('inventory', 'LowStockCounter')
+    counts = Stock.objects.filter(is_low=True).order_by().values('user_id').annotate(count=Count('id'))
+    LowStockCounter.objects.bulk_create(
+        [LowStockCounter(user_id=row['user_id'], count=row['count']) for row in counts],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('inventory', '0010_stock_forecast'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LowStockCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='low_stock_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='stock',
+            name='stock_low_stock_idx',
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='is_low',
+            field=models.GeneratedField(db_persist=True, expression=models.ExpressionWrapper(models.Q(('quantity__lte', models.F('minimum_stock'))), output_field=models.BooleanField()), output_field=models.BooleanField()),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(condition=models.Q(('is_low', True)), fields=['user', 'quantity'], name='stock_is_low_idx'),
+        ),
+        migrations.RunPython(count_low_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_upload_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='error_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='error_report',
+            field=models.FileField(blank=True, null=True, upload_to='upload_reports/'),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='skip_invalid_rows',
+            field=models.BooleanField(default=False),
+        ),
+    ]
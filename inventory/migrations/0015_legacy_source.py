@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:02
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+DEFAULT_SOURCE = 'legacy-sync'  # sync_legacy_data's default --source
+
+
+def assign_sources(apps, schema_editor):
+    """Rows synced so far belong to the user's sync source, when there was only one"""
+    ImportCheckpoint = apps.get_model('inventory', 'ImportCheckpoint')
+    sources = {}
+    for user_id, source in ImportCheckpoint.objects.filter(table='sales').values_list('user_id', 'source'):
+        # import_legacy_data keys its checkpoints by the database's absolute path
+        if not os.path.isabs(source):
+            sources.setdefault(user_id, set()).add(source)
+    for model_name in ('Stock', 'Sale'):
+        rows = apps.get_model('inventory', model_name).objects.filter(legacy_id__isnull=False, legacy_source__isnull=True)
+        for user_id, names in sources.items():
+            if len(names) == 1:
+                rows.filter(user_id=user_id).update(legacy_source=next(iter(names)))
+        rows.update(legacy_source=DEFAULT_SOURCE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_upload_heartbeat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='sale',
+            name='sale_user_legacy_id_uniq',
+        ),
+        migrations.RemoveConstraint(
+            model_name='stock',
+            name='stock_user_legacy_id_uniq',
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='legacy_source',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='legacy_source',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(assign_sources, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='sale',
+            constraint=models.UniqueConstraint(fields=('user', 'legacy_source', 'legacy_id'), name='sale_user_legacy_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(fields=('user', 'legacy_source', 'legacy_id'), name='stock_user_legacy_uniq'),
+        ),
+    ]
@@ -1,6 +1,28 @@
-from django.db import models
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, models, transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import User
+from django.dispatch import Signal
 from django.utils import timezone
+from django.utils.timezone import now
+
+
+# Sent once a transaction commits, per user, with the products that crossed
+# their minimum_stock in it: sender=Stock, user_id, went_low and recovered
+# (lists of Stock ids)
+low_stock_crossed = Signal()
+
+
+class InsufficientStockError(Exception):
+    """Raised when a sale asks for more than the product has in stock"""
+    
+    def __init__(self, product_id, requested, available):
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+        super().__init__(f'Not enough stock available. Current stock: {available}')
 
 
 class Stock(models.Model):
@@ -14,19 +36,51 @@ class Stock(models.Model):
     sku = models.CharField(max_length=100, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     minimum_stock = models.IntegerField(default=0)
+    # Kept by the database, so every write path (including bulk updates) sets it
+    is_low = models.GeneratedField(
+        expression=models.ExpressionWrapper(Q(quantity__lte=F('minimum_stock')), output_field=models.BooleanField()),
+        output_field=models.BooleanField(),
+        db_persist=True,
+    )
+    legacy_id = models.BigIntegerField(blank=True, null=True)  # Primary key in the legacy POS database
+    legacy_source = models.CharField(max_length=255, blank=True, null=True)  # The till/export legacy_id is from
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
         unique_together = ['user', 'product_name']  # Prevent duplicate products per user
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'legacy_source', 'legacy_id'], name='stock_user_legacy_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='stock_user_created_idx'),
+            models.Index(fields=['user', 'sku'], name='stock_user_sku_idx'),
+            # Delta sync of the offline stock snapshot
+            models.Index(fields=['user', 'updated_at'], name='stock_user_updated_idx'),
+            # Only low-stock rows are indexed, so the dashboard alert stays cheap
+            models.Index(fields=['user', 'quantity'], name='stock_is_low_idx', condition=models.Q(is_low=True)),
+        ]
     
     def __str__(self):
         return f"{self.product_name} ({self.quantity})"
     
-    @property
-    def is_low_stock(self):
-        return self.quantity <= self.minimum_stock
+    def save(self, *args, **kwargs):
+        is_low = self.quantity <= self.minimum_stock
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'quantity', 'minimum_stock'} & set(update_fields):
+            return super().save(*args, **kwargs)
+        
+        with transaction.atomic():
+            was_low = None
+            if not self._state.adding:
+                # Locked, so a concurrent change can't be counted twice
+                was_low = (Stock.objects.select_for_update().filter(pk=self.pk)
+                           .values_list('is_low', flat=True).first())
+            super().save(*args, **kwargs)
+            LowStockCounter.record_transitions([(self.user_id, self.pk, was_low, is_low)])
+        # The generated column was computed by the database; keep the instance in step
+        self.is_low = is_low
 
 
 class Sale(models.Model):
@@ -41,10 +95,18 @@ class Sale(models.Model):
     customer_email = models.EmailField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
     sale_date = models.DateTimeField(default=timezone.now)
+    legacy_id = models.BigIntegerField(blank=True, null=True)  # Primary key in the legacy POS database
+    legacy_source = models.CharField(max_length=255, blank=True, null=True)  # The till/export legacy_id is from
     created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-sale_date']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'legacy_source', 'legacy_id'], name='sale_user_legacy_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-sale_date'], name='sale_user_date_idx'),
+        ]
     
     def __str__(self):
         return f"Sale: {self.product.product_name} x{self.quantity_sold} - ${self.total_amount}"
@@ -54,12 +116,233 @@ class Sale(models.Model):
         if not self.total_amount:
             self.total_amount = self.quantity_sold * self.unit_price
         
-        # Update stock quantity when sale is created
-        if not self.pk:  # Only on creation
-            self.product.quantity -= self.quantity_sold
-            self.product.save()
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            # Update stock quantity when sale is created
+            creating = not self.pk
+            previous = None
+            if creating:  # Only on creation
+                self.decrement_stock()
+            elif update_fields is None or set(update_fields) & set(ROLLUP_SALE_FIELDS):
+                # An edit replaces the stored values in the daily rollup
+                previous = Sale.objects.select_for_update().only(*ROLLUP_SALE_FIELDS).filter(pk=self.pk).first()
+            
+            super().save(*args, **kwargs)
+            
+            if creating or previous is not None:
+                DailyProductSales.record_sales([self])
+            if previous is not None:
+                DailyProductSales.remove_sales([previous])
+    
+    def decrement_stock(self):
+        """Take quantity_sold off the product in one conditional UPDATE.
+
+        The availability check and the decrement happen in the same
+        statement, so concurrent sales can neither oversell nor overwrite
+        each other's changes, and no other Stock column is rewritten.
+        """
+        updated = Stock.objects.filter(
+            pk=self.product_id, quantity__gte=self.quantity_sold
+        ).update(quantity=F('quantity') - self.quantity_sold, updated_at=timezone.now())
+        if not updated:
+            available = Stock.objects.filter(pk=self.product_id).values_list('quantity', flat=True).first()
+            raise InsufficientStockError(self.product_id, self.quantity_sold, available or 0)
+        LowStockCounter.record_decrements({self.product_id: self.quantity_sold})
+
+
+# Sale fields the daily rollup is computed from
+ROLLUP_SALE_FIELDS = ['user', 'product', 'quantity_sold', 'total_amount', 'sale_date']
+
+
+class DailyProductSales(models.Model):
+    """Per-day sales totals of a product, kept in step with Sale inserts, edits and deletes"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    product = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='daily_sales')
+    quantity_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sales_count = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['user', 'day', 'product']
+        verbose_name_plural = 'daily product sales'
+    
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.quantity_sold} sold"
+    
+    @staticmethod
+    def day_of(sale_date):
+        if timezone.is_aware(sale_date):
+            return timezone.localdate(sale_date)
+        return sale_date.date()
+    
+    @classmethod
+    def record_sales(cls, sales, sign=1):
+        """Add newly inserted sales to their daily totals.
+
+        Runs a single upsert that increments existing rows, so it is safe to
+        call from concurrent transactions. Call it in the same transaction
+        as the Sale insert. ``sign=-1`` takes deleted sales (or the old
+        values of updated ones) back out.
+        """
+        totals = defaultdict(lambda: [0, Decimal('0'), 0])
+        for sale in sales:
+            total = totals[(sale.user_id, cls.day_of(sale.sale_date), sale.product_id)]
+            total[0] += sign * sale.quantity_sold
+            total[1] += sign * sale.total_amount
+            total[2] += sign
+        if not totals:
+            return
         
-        super().save(*args, **kwargs)
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = (
+            f'INSERT INTO {table} (user_id, day, product_id, quantity_sold, revenue, sales_count) '
+            f'VALUES (%s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT (user_id, day, product_id) DO UPDATE SET '
+            f'quantity_sold = {table}.quantity_sold + EXCLUDED.quantity_sold, '
+            f'revenue = {table}.revenue + EXCLUDED.revenue, '
+            f'sales_count = {table}.sales_count + EXCLUDED.sales_count'
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (user_id, day, product_id, quantity, revenue, count)
+                for (user_id, day, product_id), (quantity, revenue, count) in totals.items()
+            ])
+    
+    @classmethod
+    def remove_sales(cls, sales):
+        """Take deleted sales, or the old values of edited ones, out of their daily totals.
+
+        Days left without sales are dropped.
+        """
+        cls.record_sales(sales, sign=-1)
+        cls.objects.filter(user_id__in={sale.user_id for sale in sales}, sales_count__lte=0).delete()
+
+
+class LowStockCounter(models.Model):
+    """Number of a user's products at or below their minimum_stock.
+
+    ``Stock.is_low`` is maintained by the database, but the count and the
+    threshold crossings are not: every path that changes quantity or
+    minimum_stock reports its transitions to ``record_transitions`` in its
+    transaction, which adjusts the counters and queues one
+    ``low_stock_crossed`` signal per user for when the transaction commits.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='low_stock_counter')
+    count = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.count} low"
+    
+    @classmethod
+    def count_for(cls, user):
+        return cls.objects.filter(user=user).values_list('count', flat=True).first() or 0
+    
+    @classmethod
+    def record_transitions(cls, transitions):
+        """Apply ``(user_id, stock_id, was_low, is_low)`` tuples.
+
+        ``was_low`` is None for a new product and ``is_low`` None for a
+        deleted one; those change the count but are not crossings unless a
+        new product starts out low.
+        """
+        deltas = defaultdict(int)
+        crossings = defaultdict(lambda: ([], []))
+        for user_id, stock_id, was_low, is_low in transitions:
+            if bool(was_low) == bool(is_low):
+                continue
+            deltas[user_id] += 1 if is_low else -1
+            if is_low:
+                crossings[user_id][0].append(stock_id)
+            elif was_low and is_low is not None:
+                crossings[user_id][1].append(stock_id)
+        deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+        if deltas:
+            table = connection.ops.quote_name(cls._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {table} (user_id, count) VALUES (%s, %s) '
+                    f'ON CONFLICT (user_id) DO UPDATE SET count = {table}.count + EXCLUDED.count',
+                    list(deltas.items()),
+                )
+        if crossings:
+            events = dict(crossings)
+            transaction.on_commit(lambda: cls._send(events))
+    
+    @classmethod
+    def record_decrements(cls, sold):
+        """Record the transitions of ``{stock_id: quantity}`` just taken off stock.
+
+        Reads the rows after the UPDATE, which still holds their locks, so
+        the state before is exactly the state after plus what was sold.
+        """
+        rows = Stock.objects.filter(pk__in=list(sold)).values_list('id', 'user_id', 'quantity', 'minimum_stock')
+        cls.record_transitions([
+            (user_id, stock_id, quantity + sold[stock_id] <= minimum_stock, quantity <= minimum_stock)
+            for stock_id, user_id, quantity, minimum_stock in rows
+        ])
+    
+    @staticmethod
+    def low_states(stocks):
+        """``{id: is_low}`` of a Stock queryset, taken before and after a bulk write for ``record_changes``"""
+        return dict(stocks.order_by().values_list('id', 'is_low'))
+    
+    @classmethod
+    def record_changes(cls, user_id, before, after):
+        """Record the transitions between two ``low_states``; products missing from ``before`` are new"""
+        cls.record_transitions([
+            (user_id, stock_id, before.get(stock_id), is_low)
+            for stock_id, is_low in after.items() if before.get(stock_id) != is_low
+        ])
+    
+    @staticmethod
+    def _send(events):
+        for user_id, (went_low, recovered) in events.items():
+            low_stock_crossed.send(sender=Stock, user_id=user_id, went_low=went_low, recovered=recovered)
+
+
+class StockForecast(models.Model):
+    """Sales velocity and suggested reorder point of a product, computed nightly by forecast_stock"""
+    product = models.OneToOneField(Stock, on_delete=models.CASCADE, primary_key=True, related_name='forecast')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_forecasts')
+    velocity = models.FloatField(default=0)  # Units sold per day, exponentially weighted
+    reorder_point = models.IntegerField(default=0)
+    days_of_cover = models.FloatField(blank=True, null=True)  # None when the product isn't selling
+    computed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'days_of_cover'], name='forecast_user_cover_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.velocity:.2f}/day"
+    
+    @classmethod
+    def store(cls, user_id, forecasts, computed_at):
+        """Insert or replace ``(product_id, velocity, reorder_point, days_of_cover)`` rows.
+
+        One upsert statement per batch, without building model instances,
+        as forecast_stock rewrites every product of a tenant each night.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = (
+            f'INSERT INTO {table} (product_id, user_id, velocity, reorder_point, days_of_cover, computed_at) '
+            f'VALUES (%s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT (product_id) DO UPDATE SET '
+            f'velocity = EXCLUDED.velocity, '
+            f'reorder_point = EXCLUDED.reorder_point, '
+            f'days_of_cover = EXCLUDED.days_of_cover, '
+            f'computed_at = EXCLUDED.computed_at'
+        )
+        computed_at = connection.ops.adapt_datetimefield_value(computed_at)
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (product_id, user_id, velocity, reorder_point, days_of_cover, computed_at)
+                for product_id, velocity, reorder_point, days_of_cover in forecasts
+            ])
 
 
 class UploadedFile(models.Model):
@@ -77,16 +360,91 @@ class UploadedFile(models.Model):
             ('processing', 'Processing'),
             ('completed', 'Completed'),
             ('failed', 'Failed'),
+            ('duplicate', 'Duplicate'),
         ],
         default='pending'
     )
     error_message = models.TextField(blank=True, null=True)
+    sha256 = models.CharField(max_length=64, blank=True, null=True)  # Of the file's content
+    # The earlier upload of the same content, for uploads that were not processed again
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True,
+                                     related_name='duplicates')
+    skip_invalid_rows = models.BooleanField(default=False)  # Import the valid rows of a file with errors
+    error_count = models.IntegerField(default=0)  # Invalid cells found by validation
+    error_report = models.FileField(upload_to='upload_reports/', blank=True, null=True)
+    worker = models.CharField(max_length=100, blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)  # Last sign of life from the worker
+    completed_at = models.DateTimeField(blank=True, null=True)
     
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['processing_status', 'uploaded_at'], name='upload_queue_idx'),
+            models.Index(fields=['user', 'sha256'], name='upload_user_sha256_idx'),
+        ]
     
     def __str__(self):
         return f"{self.file_name} - {self.processing_status}"
+    
+    @property
+    def processing_time(self):
+        if self.started_at and self.completed_at:
+            return self.completed_at - self.started_at
+        return None
+
+
+class StockTombstone(models.Model):
+    """Marks a deleted product, so offline snapshots can drop it on their next delta sync"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_tombstones')
+    stock_id = models.IntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Stock {self.stock_id} deleted {self.deleted_at}"
+
+
+class ImportCheckpoint(models.Model):
+    """Progress marker for resumable imports from a legacy database"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_checkpoints')
+    source = models.CharField(max_length=255)
+    table = models.CharField(max_length=100)
+    last_rowid = models.BigIntegerField(default=0)
+    rows_read = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'source', 'table']
+    
+    def __str__(self):
+        return f"{self.source}:{self.table} @ {self.last_rowid}"
+
+
+class RequestProfile(models.Model):
+    """Timings of a profiled request, kept in a capped ring buffer"""
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    url_name = models.CharField(max_length=100, blank=True, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    started_at = models.DateTimeField(default=timezone.now)
+    total_ms = models.FloatField()
+    view_ms = models.FloatField()
+    orm_ms = models.FloatField()
+    template_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    top_frames = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['-total_ms']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.total_ms:.0f} ms)"
 
 
 class UserProfile(models.Model):
@@ -97,7 +455,7 @@ class UserProfile(models.Model):
     address = models.TextField(blank=True, null=True)
     timezone = models.CharField(max_length=50, default='UTC')
     currency = models.CharField(max_length=3, default='USD')
-    created_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(default=now)
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
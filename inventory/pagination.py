@@ -0,0 +1,184 @@
+"""
+Cursor pagination for the stock and sales listings.
+
+``Paginator`` runs a ``COUNT(*)`` on every page and reaches deep pages with
+a growing ``OFFSET``, so its cost grows with the page number. Here a page
+is addressed by an opaque cursor holding the sort key of the row it starts
+after, e.g. ``(sale_date, id)``, and is fetched with an indexed range
+condition instead. No total count is needed: one extra row is fetched to
+tell whether there is a next page.
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+
+PAGE_SIZE = 20
+
+
+class CursorPage:
+    """One page of results, with cursors for its neighbours"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = None
+        self.previous_url = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(kind, position):
+    # isoformat() rather than DjangoJSONEncoder, which drops microseconds
+    data = json.dumps([kind, position], default=lambda value: value.isoformat(), separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """``(kind, position)`` from a cursor token, or None if it is malformed"""
+    if not token:
+        return None
+    try:
+        kind, position = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+    return kind, position
+
+
+def keyset_page(queryset, token=None, keys=('created_at', 'id'), per_page=PAGE_SIZE):
+    """The page of ``queryset``, newest first by ``keys``, that ``token`` points at.
+
+    The last key must be unique (normally ``id``) so that rows sharing the
+    other key values are neither skipped nor repeated. An invalid or stale
+    token gives the first page.
+    """
+    position = _keyset_position(queryset.model, decode_cursor(token), keys)
+    if position is None:
+        return _keyset_first_page(queryset, keys, per_page)
+
+    direction, values = position
+    if direction == 'next':
+        rows = list(queryset.filter(_after(keys, values, 'lt'))
+                    .order_by(*[f'-{key}' for key in keys])[:per_page + 1])
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if not rows:
+            return _keyset_first_page(queryset, keys, per_page)
+        return CursorPage(
+            rows,
+            next_cursor=_row_cursor('next', rows[-1], keys) if has_more else None,
+            previous_cursor=_row_cursor('prev', rows[0], keys),
+        )
+
+    rows = list(queryset.filter(_after(keys, values, 'gt')).order_by(*keys)[:per_page + 1])
+    if len(rows) <= per_page:
+        # Back at the start: show a full first page rather than a short one
+        return _keyset_first_page(queryset, keys, per_page)
+    rows = rows[:per_page][::-1]
+    return CursorPage(
+        rows,
+        next_cursor=_row_cursor('next', rows[-1], keys),
+        previous_cursor=_row_cursor('prev', rows[0], keys),
+    )
+
+
+def offset_page(results, token=None, per_page=PAGE_SIZE):
+    """A page of relevance-ranked ``results`` (a sliceable), without counting them.
+
+    Ranked search results can't be keyset-paginated, but ranking already
+    scores every match, so the offset adds little on top of it.
+    """
+    cursor = decode_cursor(token)
+    offset = 0
+    if cursor and cursor[0] == 'offset' and isinstance(cursor[1], int):
+        offset = max(cursor[1], 0)
+
+    rows = list(results[offset:offset + per_page + 1])
+    return CursorPage(
+        rows[:per_page],
+        next_cursor=encode_cursor('offset', offset + per_page) if len(rows) > per_page else None,
+        previous_cursor=encode_cursor('offset', max(offset - per_page, 0)) if offset else None,
+    )
+
+
+def add_page_urls(page, request, param='cursor'):
+    """Set ``next_url``/``previous_url`` on ``page``, keeping the other query parameters"""
+    for attr, cursor in (('next_url', page.next_cursor), ('previous_url', page.previous_cursor)):
+        if cursor is not None:
+            params = request.GET.copy()
+            params.pop('page', None)
+            params[param] = cursor
+            setattr(page, attr, f'?{params.urlencode()}')
+    return page
+
+
+def estimated_count(queryset):
+    """The planner's row estimate for ``queryset`` on PostgreSQL, else None.
+
+    Much cheaper than ``count()`` on a large table, and close enough for a
+    "about N results" label.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def _keyset_first_page(queryset, keys, per_page):
+    rows = list(queryset.order_by(*[f'-{key}' for key in keys])[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    return CursorPage(rows, next_cursor=_row_cursor('next', rows[-1], keys) if has_more else None)
+
+
+def _keyset_position(model, cursor, keys):
+    if cursor is None:
+        return None
+    direction, values = cursor
+    if direction not in ('next', 'prev') or not isinstance(values, list) or len(values) != len(keys):
+        return None
+    try:
+        return direction, [model._meta.get_field(key).to_python(value) for key, value in zip(keys, values)]
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+
+def _row_cursor(direction, row, keys):
+    return encode_cursor(direction, [getattr(row, key) for key in keys])
+
+
+def _after(keys, values, lookup):
+    # (k1, k2) < (v1, v2) spelled out as k1 < v1 OR (k1 = v1 AND k2 < v2).
+    # The redundant k1 <= v1 gives the planner a range on the (user, k1) index.
+    condition = Q()
+    for i, key in enumerate(keys):
+        condition |= Q(**{key: value for key, value in zip(keys[:i], values[:i])},
+                       **{f'{key}__{lookup}': values[i]})
+    return Q(**{f'{keys[0]}__{lookup}e': values[0]}) & condition
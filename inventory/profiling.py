@@ -0,0 +1,142 @@
+"""
+Opt-in request profiler.
+
+``RequestProfilerMiddleware`` profiles requests of the users listed in
+``PROFILING_USERS`` plus a random ``PROFILING_SAMPLE_RATE`` percent of all
+requests. Each profiled request runs under cProfile and its wall time is
+split into ORM (time spent executing SQL), template rendering (excluding
+SQL run from templates) and view (the rest). Requests slower than
+``PROFILING_SLOW_MS`` also keep their top cProfile frames.
+
+Records are stored as ``RequestProfile`` rows, trimmed to the newest
+``PROFILING_BUFFER_SIZE``, and listed slowest first in the admin.
+"""
+
+import cProfile
+import io
+import logging
+import pstats
+import random
+import sys
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.base import Template
+
+from .models import RequestProfile
+from .querybudget import QueryRecorder
+
+
+logger = logging.getLogger(__name__)
+
+TOP_FRAMES = 25
+
+_TEMPLATE_RENDER = Template.render.__code__
+_TEMPLATE_RENDER_KEY = (_TEMPLATE_RENDER.co_filename, _TEMPLATE_RENDER.co_firstlineno,
+                        _TEMPLATE_RENDER.co_name)
+
+
+class ProfilingQueryRecorder(QueryRecorder):
+    """A QueryRecorder that also tells apart SQL run while rendering a template"""
+
+    def __init__(self):
+        super().__init__()
+        self.template_duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        before = self.duration
+        try:
+            return super().__call__(execute, sql, params, many, context)
+        finally:
+            if _in_template_render():
+                self.template_duration += self.duration - before
+
+
+def _in_template_render():
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code is _TEMPLATE_RENDER:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def should_profile(request):
+    usernames = getattr(settings, 'PROFILING_USERS', [])
+    if usernames and request.user.is_authenticated and request.user.get_username() in usernames:
+        return True
+    return random.random() * 100 < getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+
+
+def record_profile(**fields):
+    """Store a profile and drop the ones that fell out of the ring buffer"""
+    profile = RequestProfile.objects.create(**fields)
+    size = getattr(settings, 'PROFILING_BUFFER_SIZE', 500)
+    RequestProfile.objects.filter(pk__lte=profile.pk - size).delete()
+    return profile
+
+
+class RequestProfilerMiddleware:
+    """Profile a configurable subset of requests. Enabled by ``PROFILING_ENABLED``."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        recorder = ProfilingQueryRecorder()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this process
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        try:
+            with recorder.record():
+                response = self.get_response(request)
+        finally:
+            profiler.disable()
+        total = time.perf_counter() - started
+
+        try:
+            self.save(request, response, profiler, recorder, total)
+        except Exception:
+            logger.exception('Could not store the profile of %s', request.path)
+        return response
+
+    def save(self, request, response, profiler, recorder, total):
+        stats = pstats.Stats(profiler)
+        render = stats.stats.get(_TEMPLATE_RENDER_KEY)
+        template = (render[3] if render else 0.0) - recorder.template_duration
+        orm = recorder.duration
+        view = max(total - orm - template, 0.0)
+
+        top_frames = ''
+        if total * 1000 >= getattr(settings, 'PROFILING_SLOW_MS', 500):
+            output = io.StringIO()
+            stats.stream = output
+            stats.sort_stats('cumulative').print_stats(TOP_FRAMES)
+            top_frames = output.getvalue()
+
+        match = request.resolver_match
+        user = getattr(request, 'user', None)
+        record_profile(
+            user=user if user is not None and user.is_authenticated else None,
+            url_name=match.view_name if match else '',
+            method=request.method,
+            path=request.path[:500],
+            status_code=response.status_code,
+            total_ms=total * 1000,
+            view_ms=view * 1000,
+            orm_ms=orm * 1000,
+            template_ms=max(template, 0.0) * 1000,
+            query_count=recorder.count,
+            top_frames=top_frames,
+        )
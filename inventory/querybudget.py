@@ -0,0 +1,138 @@
+"""
+Per-request SQL query budgets.
+
+Each URL name can declare how many queries a request to it may run
+(see ``declare_query_budgets`` in inventory/urls.py). ``QueryRecorder``
+counts and times every query run on any database connection and groups
+them by shape, i.e. the SQL with its parameters and IN lists collapsed, so
+that an N+1 shows up as one shape repeated N times.
+
+``QueryBudgetMiddleware`` records every request and logs the ones over
+budget or with repeated shapes; with ``QUERY_BUDGET_STRICT`` it raises
+``QueryBudgetExceeded`` instead, which fails the test that made the
+request. ``assert_query_budget`` does the same around any block of code.
+"""
+
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# A shape run this many times in one request is reported as a likely N+1
+DUPLICATE_QUERY_THRESHOLD = getattr(settings, 'QUERY_BUDGET_DUPLICATE_THRESHOLD', 3)
+
+_budgets = {}
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def declare_query_budgets(budgets):
+    """Register ``{url_name: max_queries}`` and return the mapping"""
+    _budgets.update(budgets)
+    return budgets
+
+
+def get_query_budget(url_name):
+    return _budgets.get(url_name)
+
+
+def query_shape(sql):
+    """``sql`` with literals and IN-list lengths normalised away"""
+    return _NUMBER.sub('N', _IN_LIST.sub('IN (...)', sql))
+
+
+class QueryRecorder:
+    """Count, time and group by shape the queries run while it is active"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def duplicates(self, threshold=DUPLICATE_QUERY_THRESHOLD):
+        return {shape: n for shape, n in self.shapes.items() if n >= threshold}
+
+    def problems(self, budget):
+        """Human readable budget violations, empty when within budget"""
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f'{self.count} queries, budget is {budget}')
+        for shape, n in self.duplicates().items():
+            problems.append(f'{n} queries of the same shape: {shape[:200]}')
+        return problems
+
+
+@contextmanager
+def assert_query_budget(budget, label='block'):
+    """Fail if the block runs more than ``budget`` queries or repeats a query shape"""
+    recorder = QueryRecorder()
+    with recorder.record():
+        yield recorder
+    problems = recorder.problems(budget)
+    if problems:
+        raise QueryBudgetExceeded(f'{label}: ' + '; '.join(problems))
+
+
+class QueryBudgetMiddleware:
+    """Check every request against the query budget of its URL name.
+
+    Enabled by ``QUERY_BUDGET_ENABLED``. Also adds a ``Server-Timing``
+    header with the query count and time, visible in browser dev tools.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        url_name = match.view_name if match else None
+        budget = get_query_budget(url_name)
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"'
+        )
+
+        problems = recorder.problems(budget)
+        if problems:
+            message = f'{request.method} {request.path} ({url_name}): ' + '; '.join(problems)
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning('Query budget exceeded: %s', message)
+        else:
+            logger.debug('%s %s: %s queries in %.1f ms', request.method, request.path,
+                         recorder.count, recorder.duration * 1000)
+        return response
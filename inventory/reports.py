@@ -0,0 +1,190 @@
+"""
+Sales reports: revenue and quantity per day, week or month, by product,
+category and supplier, over any date range.
+
+Buckets follow the user's ``UserProfile.timezone``. When that is the
+server's time zone the report reads the ``DailyProductSales`` rollup,
+whose days are already local to it; otherwise it truncates
+``Sale.sale_date`` in the user's zone. Either way the database groups by
+(bucket, product) with ``Trunc`` and returns plain tuples, which pandas
+joins to the products and pivots into per-bucket series for each
+dimension.
+
+Reports are cached per (user, range, grain) at the user's data version
+from ``inventory.cache``, so any stock or sales change invalidates them.
+"""
+
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import DateTimeField, F, FloatField, Sum
+from django.db.models.functions import Trunc, TruncMonth, TruncWeek
+
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+
+from .cache import get_data_version
+from .models import DailyProductSales, Sale, Stock, UserProfile
+
+
+GRAINS = {
+    # grain: (pandas frequency, first day of the bucket holding a date)
+    'day': ('D', lambda day: day),
+    'week': ('W-MON', lambda day: day - timedelta(days=day.weekday())),
+    'month': ('MS', lambda day: day.replace(day=1)),
+}
+DIMENSIONS = ['product', 'category', 'supplier']
+
+# Series per dimension; the rest are summed into OTHER
+TOP_SERIES = 10
+OTHER = 'Other'
+NONE_LABEL = '(none)'
+
+REPORT_CACHE_TIMEOUT = getattr(settings, 'REPORT_CACHE_TIMEOUT', 3600)
+
+
+def user_timezone(user):
+    """The user's profile time zone, or the server's if unset or unknown"""
+    name = UserProfile.objects.filter(user=user).values_list('timezone', flat=True).first()
+    try:
+        return ZoneInfo(name or settings.TIME_ZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(settings.TIME_ZONE)
+
+
+def sales_report(user, start, end, grain, zone=None):
+    """Revenue and quantity of ``user``'s sales from ``start`` to ``end`` (dates, inclusive), cached.
+
+    ``zone`` defaults to ``user_timezone(user)``.
+    """
+    if grain not in GRAINS:
+        raise ValueError(f'grain must be one of {", ".join(GRAINS)}')
+    if end < start:
+        raise ValueError('The end date is before the start date')
+    zone = zone or user_timezone(user)
+
+    version = get_data_version(user.pk)
+    key = f'reports:sales:{user.pk}:{version}:{zone.key}:{start.isoformat()}:{end.isoformat()}:{grain}'
+    if version is not None:
+        report = cache.get(key)
+        if report is not None:
+            return report
+
+    report = build_sales_report(user, start, end, grain, zone)
+    if version is not None:
+        cache.set(key, report, REPORT_CACHE_TIMEOUT)
+    return report
+
+
+def build_sales_report(user, start, end, grain, zone):
+    frequency, bucket_start = GRAINS[grain]
+    buckets = pd.date_range(bucket_start(start), end, freq=frequency)
+
+    rows = _bucketed_rows(user, start, end, grain, zone)
+    frame = pd.DataFrame.from_records(list(rows), columns=['bucket', 'product_id', 'quantity', 'revenue'])
+    # Names and groupings are joined here rather than grouped on in SQL,
+    # which keeps the aggregate narrow
+    products = pd.DataFrame.from_records(
+        list(Stock.objects.filter(user=user).values_list('id', 'product_name', 'category', 'supplier')),
+        columns=['product_id', 'product', 'category', 'supplier'],
+    )
+    frame = frame.merge(products, on='product_id')
+    if len(frame):
+        if _reads_rollup(zone):
+            frame['bucket'] = pd.to_datetime(frame['bucket'])
+        else:
+            # Midnights in the user's zone, as naive dates like the rollup's
+            frame['bucket'] = pd.to_datetime(frame['bucket'], utc=True).dt.tz_convert(zone).dt.tz_localize(None)
+        frame['quantity'] = frame['quantity'].astype('int64')
+        frame['revenue'] = frame['revenue'].astype('float64')
+        frame[['category', 'supplier']] = frame[['category', 'supplier']].replace('', None).fillna(NONE_LABEL)
+
+    report = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'grain': grain,
+        'timezone': zone.key,
+        'buckets': [bucket.date().isoformat() for bucket in buckets],
+        'totals': _series(frame, buckets),
+    }
+    for dimension in DIMENSIONS:
+        report[dimension] = _breakdown(frame, dimension, buckets)
+    return report
+
+
+def _bucketed_rows(user, start, end, grain, zone):
+    """(bucket, product_id, quantity, revenue) tuples, grouped in the database"""
+    if _reads_rollup(zone):
+        rows = DailyProductSales.objects.filter(user=user, day__gte=start, day__lte=end)
+        bucket = {'day': F('day'), 'week': TruncWeek('day'), 'month': TruncMonth('day')}[grain]
+        quantity, revenue = Sum('quantity_sold'), Sum('revenue', output_field=FloatField())
+    else:
+        rows = Sale.objects.filter(
+            user=user,
+            sale_date__gte=_midnight(start, zone),
+            sale_date__lt=_midnight(end + timedelta(days=1), zone),
+        )
+        bucket = Trunc('sale_date', grain, output_field=DateTimeField(), tzinfo=zone)
+        quantity, revenue = Sum('quantity_sold'), Sum('total_amount', output_field=FloatField())
+    # Revenue comes back as floats: pandas would convert Decimals anyway
+    return (rows.annotate(bucket=bucket)
+            .order_by()
+            .values_list('bucket', 'product_id')
+            .annotate(quantity=quantity, revenue=revenue)
+            .values_list('bucket', 'product_id', 'quantity', 'revenue'))
+
+
+def _midnight(day, zone):
+    return datetime.combine(day, time.min, tzinfo=zone)
+
+
+def _reads_rollup(zone):
+    # Rollup days are local to the server's time zone
+    return zone.key == settings.TIME_ZONE
+
+
+def _series(frame, buckets):
+    """Per-bucket quantity and revenue lists of ``frame``, zero-filled"""
+    if not len(frame):
+        zeros = [0] * len(buckets)
+        return {'quantity': zeros, 'revenue': [0.0] * len(buckets)}
+    sums = frame.groupby('bucket')[['quantity', 'revenue']].sum().reindex(buckets, fill_value=0)
+    return {
+        'quantity': sums['quantity'].astype('int64').tolist(),
+        'revenue': sums['revenue'].round(2).tolist(),
+    }
+
+
+def _breakdown(frame, dimension, buckets):
+    """Series of the top ``TOP_SERIES`` values of ``dimension`` by revenue, then OTHER"""
+    if not len(frame):
+        return []
+    totals = frame.groupby(dimension)['revenue'].sum().sort_values(ascending=False, kind='stable')
+    top = totals.index[:TOP_SERIES]
+    labels = frame[dimension].where(frame[dimension].isin(top), OTHER)
+    sums = (frame.assign(label=labels)
+            .groupby(['label', 'bucket'])[['quantity', 'revenue']].sum())
+
+    series = []
+    for label in [*top, *([OTHER] if len(totals) > TOP_SERIES else [])]:
+        values = sums.loc[label].reindex(buckets, fill_value=0)
+        series.append({
+            'name': label,
+            'quantity': values['quantity'].astype('int64').tolist(),
+            'revenue': values['revenue'].round(2).tolist(),
+            'total_quantity': int(values['quantity'].sum()),
+            'total_revenue': round(float(values['revenue'].sum()), 2),
+        })
+    return series
+
+
+def parse_range(params, today):
+    """``start``/``end`` dates from request parameters, the last 90 days by default"""
+    end = date.fromisoformat(params['end']) if params.get('end') else today
+    start = date.fromisoformat(params['start']) if params.get('start') else end - timedelta(days=89)
+    return start, end
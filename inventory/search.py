@@ -0,0 +1,210 @@
+"""
+Product search for stock_list and stock_query.
+
+PostgreSQL uses pg_trgm GIN indexes, which serve the ``icontains`` filters
+directly, and orders by trigram similarity. SQLite keeps an FTS5 shadow
+table (trigram tokenizer) in sync with inventory_stock through triggers and
+orders by bm25. Anything else, and queries too short for a trigram index,
+fall back to a plain ``icontains`` scan.
+"""
+
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Stock
+
+
+SEARCH_FIELDS = ['product_name', 'sku', 'supplier', 'category']
+
+# Exact-match filters that can narrow a search (the stock list's filters)
+FILTER_FIELDS = ['category', 'supplier']
+
+# Trigram indexes can't help with shorter queries
+MIN_INDEXED_QUERY_LENGTH = 3
+
+FTS_TABLE = 'inventory_stock_fts'
+
+# bm25 column weights, in SEARCH_FIELDS order
+FTS_WEIGHTS = (10.0, 5.0, 1.0, 1.0)
+
+POSTGRES_INDEX_SQL = ['CREATE EXTENSION IF NOT EXISTS pg_trgm'] + [
+    f'CREATE INDEX IF NOT EXISTS stock_{field}_trgm_idx ON inventory_stock '
+    f'USING gin ({field} gin_trgm_ops)'
+    for field in SEARCH_FIELDS
+]
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON inventory_stock BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, product_name, sku, supplier, category)
+            VALUES (new.id, new.product_name, new.sku, new.supplier, new.category);
+        END''',
+    f'{FTS_TABLE}_ad': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON inventory_stock BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, product_name, sku, supplier, category)
+            VALUES ('delete', old.id, old.product_name, old.sku, old.supplier, old.category);
+        END''',
+    f'{FTS_TABLE}_au': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF product_name, sku, supplier, category ON inventory_stock BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, product_name, sku, supplier, category)
+            VALUES ('delete', old.id, old.product_name, old.sku, old.supplier, old.category);
+            INSERT INTO {FTS_TABLE} (rowid, product_name, sku, supplier, category)
+            VALUES (new.id, new.product_name, new.sku, new.supplier, new.category);
+        END''',
+}
+
+
+def install_search_index(connection):
+    """Create the search index for ``connection``'s backend, if it has one.
+
+    Idempotent. On SQLite it also restores the sync triggers, which are
+    dropped whenever a migration rebuilds inventory_stock, and then
+    rebuilds the FTS table from the stock rows.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_INDEX_SQL:
+                cursor.execute(sql)
+
+        elif connection.vendor == 'sqlite' and _sqlite_has_trigram_tokenizer(cursor):
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{', '.join(SEARCH_FIELDS)}, content='inventory_stock', content_rowid='id', "
+                f"tokenize='trigram')"
+            )
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'inventory_stock'")
+            existing = {row[0] for row in cursor.fetchall()}
+            if not set(SQLITE_TRIGGERS) <= existing:
+                for sql in SQLITE_TRIGGERS.values():
+                    cursor.execute(sql)
+                cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def _sqlite_has_trigram_tokenizer(cursor):
+    # The trigram tokenizer needs SQLite 3.34+
+    cursor.execute('SELECT sqlite_version()')
+    version = tuple(int(part) for part in cursor.fetchone()[0].split('.'))
+    return version >= (3, 34)
+
+
+def _sqlite_fts_available(connection):
+    if not hasattr(connection, '_inventory_fts_available'):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            connection._inventory_fts_available = cursor.fetchone() is not None
+    return connection._inventory_fts_available
+
+
+def search_stocks(user, query, using='default', filters=None):
+    """Stock items of ``user`` matching ``query``, most relevant first.
+
+    ``filters`` maps fields in ``FILTER_FIELDS`` to exact values. Returns a
+    QuerySet, or on SQLite an ``FtsSearchResults`` that supports
+    slicing the same way, which is all ``pagination.offset_page`` needs to
+    page through them without counting.
+    """
+    filters = filters or {}
+    if set(filters) - set(FILTER_FIELDS):
+        raise ValueError(f'Stock search can only filter on {", ".join(FILTER_FIELDS)}')
+    stocks = Stock.objects.filter(user=user, **filters)
+    connection = connections[using]
+
+    if len(query) >= MIN_INDEXED_QUERY_LENGTH:
+        if connection.vendor == 'postgresql':
+            return _postgres_search(stocks, query)
+        if connection.vendor == 'sqlite' and _sqlite_fts_available(connection):
+            return FtsSearchResults(user, query, using, filters)
+
+    return _icontains_search(stocks, query)
+
+
+def _icontains_filter(query):
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': query})
+    return condition
+
+
+def _icontains_search(stocks, query):
+    relevance = Case(
+        When(product_name__istartswith=query, then=Value(0)),
+        When(product_name__icontains=query, then=Value(1)),
+        When(sku__icontains=query, then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField(),
+    )
+    return (stocks.filter(_icontains_filter(query))
+            .annotate(relevance=relevance)
+            .order_by('relevance', 'product_name'))
+
+
+def _postgres_search(stocks, query):
+    # Imported here: django.contrib.postgres needs a PostgreSQL driver
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    # The trigram GIN indexes serve the ILIKE '%query%' filters
+    similarity = Greatest(*[TrigramSimilarity(field, query) for field in SEARCH_FIELDS])
+    return (stocks.filter(_icontains_filter(query))
+            .annotate(relevance=similarity)
+            .order_by('-relevance', 'product_name'))
+
+
+class FtsSearchResults:
+    """Lazy, sliceable SQLite FTS5 search results"""
+
+    def __init__(self, user, query, using='default', filters=None):
+        self.user = user
+        self.query = query
+        self.using = using
+        self.filters = filters or {}
+        # Quote as one FTS5 string so user input can't inject query syntax
+        self.match = '"' + query.replace('"', '""') + '"'
+        # Field names come from FILTER_FIELDS, values are parameters
+        self.where = ''.join(f' AND s.{field} = %s' for field in self.filters)
+        self.params = [self.match, self.user.pk, *self.filters.values()]
+        self._count = None
+
+    # CROSS JOIN makes SQLite run the MATCH once and look up each hit by
+    # primary key; otherwise it may re-run the MATCH for every stock row.
+    def _execute(self, sql, params):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def count(self):
+        if self._count is None:
+            self._count = self._execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE} CROSS JOIN inventory_stock s ON s.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s AND s.user_id = %s{self.where}',
+                self.params,
+            )[0][0]
+        return self._count
+
+    def all(self):
+        return FtsSearchResults(self.user, self.query, self.using, self.filters)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:self.count()])
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        if stop <= start:
+            return []
+
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        ids = [row[0] for row in self._execute(
+            f'SELECT s.id FROM {FTS_TABLE} CROSS JOIN inventory_stock s ON s.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s AND s.user_id = %s{self.where} '
+            f'ORDER BY bm25({FTS_TABLE}, {weights}), s.product_name LIMIT %s OFFSET %s',
+            [*self.params, stop - start, start],
+        )]
+        stocks = Stock.objects.using(self.using).in_bulk(ids)
+        return [stocks[pk] for pk in ids if pk in stocks]
@@ -0,0 +1,48 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_dashboard_version
+from .models import DailyProductSales, LowStockCounter, Stock, StockTombstone, Sale
+from .search import install_search_index
+
+
+@receiver([post_save, post_delete], sender=Stock)
+@receiver([post_save, post_delete], sender=Sale)
+def invalidate_dashboard(sender, instance, **kwargs):
+    """Stock/Sale changes made through the ORM invalidate the owner's dashboard"""
+    bump_dashboard_version(instance.user_id)
+
+
+@receiver(post_delete, sender=Stock)
+def record_stock_tombstone(sender, instance, origin=None, **kwargs):
+    """Remember deleted products for delta syncs of offline snapshots"""
+    # Not when the whole account is being deleted, tombstones included
+    if getattr(origin, 'model', type(origin)) is not Stock:
+        return
+    StockTombstone.objects.create(user_id=instance.user_id, stock_id=instance.pk)
+
+
+@receiver(post_delete, sender=Stock)
+def uncount_low_stock(sender, instance, origin=None, **kwargs):
+    """A deleted low-stock product leaves its owner's low-stock count"""
+    # The counter goes too when the whole account is deleted
+    if getattr(origin, 'model', type(origin)) is not Stock:
+        return
+    LowStockCounter.record_transitions([(instance.user_id, instance.pk, instance.is_low, None)])
+
+
+@receiver(post_delete, sender=Sale)
+def unrecord_deleted_sale(sender, instance, origin=None, **kwargs):
+    """A deleted sale leaves the daily sales rollup"""
+    # Deleting its product or the whole account deletes the rollup rows too
+    if getattr(origin, 'model', type(origin)) is not Sale:
+        return
+    DailyProductSales.remove_sales([instance])
+
+
+def restore_search_index(sender, using, **kwargs):
+    """Re-create the SQLite search triggers after migrations rebuilt inventory_stock"""
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        install_search_index(connection)
@@ -0,0 +1,88 @@
+"""
+Compact per-user stock snapshots for the offline service worker.
+
+The service worker keeps the user's products in IndexedDB and answers the
+search box from there. It downloads a full snapshot once, then asks for
+``?since=<cursor>`` with the cursor of its last response and gets only the
+rows whose ``updated_at`` moved on, plus the ids of products deleted since
+(from ``StockTombstone``). Rows are sent as arrays in ``SNAPSHOT_FIELDS``
+order to keep the payload small.
+
+Writers stamp ``updated_at`` when they write a row, not when they commit,
+and uploads or ``sync_legacy_data`` can keep a transaction open for
+minutes. So the cursor is not the time of the read but the start of the
+oldest transaction still open then (on PostgreSQL): anything committed
+later was written after that, and the next delta picks it up. A delta
+also reaches back ``SNAPSHOT_OVERLAP`` before the cursor, for clock skew
+between servers and timestamps taken just before a transaction's first
+query; clients apply rows idempotently. Tombstones are kept for
+``STOCK_TOMBSTONE_DAYS``; a cursor older than that gets a full snapshot.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Stock, StockTombstone
+
+
+SNAPSHOT_FIELDS = ['id', 'product_name', 'sku', 'quantity', 'price', 'supplier', 'category', 'minimum_stock']
+
+SNAPSHOT_OVERLAP = timedelta(seconds=getattr(settings, 'SNAPSHOT_OVERLAP_SECONDS', 5))
+TOMBSTONE_RETENTION = timedelta(days=getattr(settings, 'STOCK_TOMBSTONE_DAYS', 30))
+
+
+def oldest_open_transaction():
+    """Start of the oldest other transaction open in the database, or None.
+
+    Only PostgreSQL exposes this; elsewhere only commits later than the
+    cursor by less than ``SNAPSHOT_OVERLAP`` are caught.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT min(xact_start) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+        )
+        return cursor.fetchone()[0]
+
+
+def stock_snapshot(user, since=None):
+    """The user's products changed after ``since`` (all of them if None or too old)"""
+    now = timezone.now()
+    # Taken before the rows are read: whatever is still uncommitted then
+    # was written after the cursor
+    oldest = oldest_open_transaction()
+    cursor = min(now, oldest) if oldest else now
+    cutoff = now - TOMBSTONE_RETENTION
+    full = since is None or since < cutoff
+
+    stocks = Stock.objects.filter(user=user)
+    deleted = []
+    if full:
+        # Nobody can still need tombstones older than a full snapshot would be
+        StockTombstone.objects.filter(user=user, deleted_at__lt=cutoff).delete()
+    else:
+        since -= SNAPSHOT_OVERLAP
+        stocks = stocks.filter(updated_at__gt=since)
+        deleted = list(StockTombstone.objects.filter(user=user, deleted_at__gt=since)
+                       .values_list('stock_id', flat=True).distinct())
+
+    price = SNAPSHOT_FIELDS.index('price')
+    rows = []
+    for row in stocks.order_by().values_list(*SNAPSHOT_FIELDS):
+        row = list(row)
+        row[price] = float(row[price])
+        rows.append(row)
+
+    return {
+        'user': user.pk,
+        'full': full,
+        'cursor': cursor.isoformat(),
+        'fields': SNAPSHOT_FIELDS,
+        'rows': rows,
+        'deleted': deleted,
+    }
@@ -1,3 +1,1371 @@
-from django.test import TestCase
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from unittest import mock
+from io import StringIO
+from decimal import Decimal
 
-# Create your tests here.
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from django.utils import timezone
+
+from .autocomplete import clear_indexes
+from .forecasting import forecast_user
+from .cache import cache_stats
+from .search import FtsSearchResults, search_stocks
+from .ingestion import ingest_sales_rows, ingest_stock_rows, record_sale_batch
+from .jobs import UploadClaimLost, claim_next_upload, claim_upload, recover_stale_uploads, run_upload
+from .pagination import keyset_page
+from .validation import COLUMNS, VALIDATION_CHUNK_SIZE, check_frame, read_xlsx_chunks
+from .querybudget import QueryBudgetExceeded, assert_query_budget, get_query_budget
+from . import autocomplete, querybudget, urls
+from .models import (DailyProductSales, ImportCheckpoint, InsufficientStockError, LowStockCounter, RequestProfile,
+                     Sale, Stock, StockForecast, StockTombstone, UploadedFile, UserProfile, low_stock_crossed)
+
+
+class StockIngestionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+
+    def test_creates_new_products(self):
+        rows = [
+            {'product_name': 'Widget', 'quantity': '5', 'price': '2.50', 'sku': 'W1'},
+            {'product_name': 'Gadget', 'quantity': '3', 'price': '1.00'},
+            {'product_name': '', 'quantity': '9', 'price': '1.00'},
+        ]
+        self.assertEqual(ingest_stock_rows(rows, self.user), 2)
+        widget = Stock.objects.get(user=self.user, product_name='Widget')
+        self.assertEqual(widget.quantity, 5)
+        self.assertEqual(widget.price, Decimal('2.50'))
+        self.assertEqual(widget.sku, 'W1')
+
+    def test_reupload_adds_quantity(self):
+        Stock.objects.create(user=self.user, product_name='Widget', quantity=10,
+                             price=Decimal('1.00'), supplier='Acme')
+        rows = [{'product_name': 'Widget', 'quantity': '4', 'price': '1.25'}]
+        ingest_stock_rows(rows, self.user)
+        widget = Stock.objects.get(user=self.user, product_name='Widget')
+        self.assertEqual(widget.quantity, 14)
+        self.assertEqual(widget.price, Decimal('1.25'))
+        self.assertEqual(widget.supplier, 'Acme')
+
+    def test_duplicate_rows_accumulate_across_chunks(self):
+        rows = [{'product_name': 'Widget', 'quantity': '1', 'price': '1'}] * 5
+        self.assertEqual(ingest_stock_rows(rows, self.user, chunk_size=2), 5)
+        self.assertEqual(Stock.objects.get(user=self.user, product_name='Widget').quantity, 5)
+
+    def test_chunk_uses_constant_queries(self):
+        Stock.objects.create(user=self.user, product_name='P0', quantity=1, price=1)
+        rows = [{'product_name': f'P{i}', 'quantity': '1', 'price': '1'} for i in range(50)]
+        # savepoint/transaction handling aside: preload, bulk_update, bulk_create
+        with self.assertNumQueries(5):
+            ingest_stock_rows(rows, self.user)
+        self.assertEqual(Stock.objects.filter(user=self.user).count(), 50)
+
+    def test_product_inserted_concurrently_gets_quantity_added(self):
+        # Widget appears after the first preload, as if another upload committed it
+        Stock.objects.create(user=self.user, product_name='Widget', quantity=4, price=1, minimum_stock=6)
+        select_for_update = Stock.objects.select_for_update
+        preloads = [Stock.objects.none(), select_for_update()]
+        with mock.patch.object(Stock.objects, 'select_for_update', side_effect=lambda: preloads.pop(0)):
+            ingest_stock_rows([{'product_name': 'Widget', 'quantity': 5}], self.user)
+        self.assertEqual(Stock.objects.get(user=self.user, product_name='Widget').quantity, 9)
+        self.assertEqual(LowStockCounter.count_for(self.user), 0)
+
+
+class SalesIngestionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.widget = Stock.objects.create(user=self.user, product_name='Widget', quantity=5,
+                                           price=Decimal('2.00'))
+        self.gadget = Stock.objects.create(user=self.user, product_name='Gadget', quantity=10,
+                                           price=Decimal('1.00'))
+
+    def test_records_sales_and_decrements_stock_once_per_product(self):
+        rows = [
+            {'product_name': 'Widget', 'quantity_sold': '2', 'sale_date': '2024-01-02'},
+            {'product_name': 'Widget', 'quantity_sold': '2', 'unit_price': '3.00'},
+            {'product_name': 'Gadget', 'quantity_sold': '4'},
+        ]
+        # lock/preload, bulk insert, rollup upsert, one update per product
+        with self.assertNumQueries(7):
+            self.assertEqual(ingest_sales_rows(rows, self.user), 3)
+        self.widget.refresh_from_db()
+        self.gadget.refresh_from_db()
+        self.assertEqual(self.widget.quantity, 1)
+        self.assertEqual(self.gadget.quantity, 6)
+        self.assertEqual(Sale.objects.filter(product=self.widget).count(), 2)
+        self.assertEqual(Sale.objects.get(unit_price=Decimal('3.00')).total_amount, Decimal('6.00'))
+
+    def test_availability_checked_against_earlier_rows(self):
+        warnings = []
+        rows = [
+            {'product_name': 'Widget', 'quantity_sold': '4'},
+            {'product_name': 'Widget', 'quantity_sold': '4'},
+            {'product_name': 'Missing', 'quantity_sold': '1'},
+        ]
+        self.assertEqual(ingest_sales_rows(rows, self.user, warn=warnings.append), 1)
+        self.assertEqual(len(warnings), 2)
+        self.assertIn('Available: 1, Required: 4', warnings[0])
+        self.assertIn('"Missing" not found', warnings[1])
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.quantity, 1)
+
+
+class UploadQueueTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('shop', password='pass')
+
+    def upload(self, content, name='stock.csv', file_type='stock'):
+        return UploadedFile.objects.create(
+            user=self.user, file_name=name, file_type=file_type,
+            file_path=SimpleUploadedFile(name, content),
+        )
+
+    def test_view_only_enqueues(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('upload_file'), {
+            'file': SimpleUploadedFile('stock.csv', b'product_name,quantity,price\nWidget,5,1.00\n'),
+            'file_type': 'stock',
+        })
+        self.assertRedirects(response, reverse('upload_file'))
+        self.assertEqual(UploadedFile.objects.get().processing_status, 'pending')
+        self.assertFalse(Stock.objects.exists())
+
+    def test_claim_and_run(self):
+        first = self.upload(b'product_name,quantity,price\nWidget,5,1.00\n')
+        second = self.upload(b'product_name,quantity,price\nGadget,2,1.00\n')
+
+        claimed = claim_next_upload('test-worker')
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.processing_status, 'processing')
+        self.assertEqual(claimed.worker, 'test-worker')
+        self.assertEqual(claim_next_upload('other').pk, second.pk)
+        self.assertIsNone(claim_next_upload('other'))
+
+        run_upload(claimed)
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.processing_status, 'completed')
+        self.assertEqual(claimed.records_processed, 1)
+        self.assertIsNotNone(claimed.processing_time)
+        self.assertEqual(Stock.objects.get(product_name='Widget').quantity, 5)
+
+    def test_failure_is_recorded(self):
+        self.upload(b'product_name,quantity,price\nWidget,lots,1.00\n')
+        uploaded_file = run_upload(claim_next_upload())
+        self.assertEqual(uploaded_file.processing_status, 'failed')
+        self.assertIn('lots', uploaded_file.error_message)
+
+    def test_only_uploads_without_heartbeat_are_recovered(self):
+        long_ago = timezone.now() - timezone.timedelta(hours=2)
+        running, crashed_early, crashed_late = (self.upload(b'product_name\nWidget\n') for _ in range(3))
+        UploadedFile.objects.update(processing_status='processing', worker='w', started_at=long_ago)
+        UploadedFile.objects.filter(pk=running.pk).update(heartbeat_at=timezone.now(), records_processed=5000)
+        UploadedFile.objects.filter(pk=crashed_early.pk).update(heartbeat_at=long_ago)
+        UploadedFile.objects.filter(pk=crashed_late.pk).update(heartbeat_at=long_ago, records_processed=1000)
+
+        self.assertEqual(recover_stale_uploads(), (1, 1))
+        statuses = dict(UploadedFile.objects.values_list('pk', 'processing_status'))
+        self.assertEqual([statuses[running.pk], statuses[crashed_early.pk], statuses[crashed_late.pk]],
+                         ['processing', 'pending', 'failed'])
+
+    def test_worker_stops_when_its_upload_is_taken(self):
+        self.upload(b'product_name,quantity\nWidget,5\n')
+        claimed = claim_next_upload('slow-worker')
+        # Declared stale and claimed by another worker meanwhile
+        UploadedFile.objects.filter(pk=claimed.pk).update(worker='other-worker')
+        run_upload(claimed)
+        self.assertEqual((claimed.processing_status, claimed.worker), ('processing', 'other-worker'))
+        self.assertFalse(Stock.objects.exists())
+
+    def test_partly_written_uploads_are_not_reprocessed(self):
+        untouched, partial = self.upload(b'product_name,quantity\nWidget,5\n'), self.upload(b'product_name\nWidget\n')
+        UploadedFile.objects.update(processing_status='failed')
+        UploadedFile.objects.filter(pk=partial.pk).update(records_processed=1000)
+        self.assertIsNone(claim_upload(partial.pk))
+        self.assertEqual(claim_upload(untouched.pk).pk, untouched.pk)
+
+        admin_user = User.objects.create_superuser('admin', password='pass')
+        self.client.force_login(admin_user)
+        UploadedFile.objects.filter(pk=untouched.pk).update(processing_status='failed')
+        self.client.post(reverse('admin:inventory_uploadedfile_changelist'), {
+            'action': 'requeue', '_selected_action': [untouched.pk, partial.pk],
+        })
+        statuses = dict(UploadedFile.objects.values_list('pk', 'processing_status'))
+        self.assertEqual([statuses[untouched.pk], statuses[partial.pk]], ['pending', 'failed'])
+
+    def test_progress_is_recorded_in_the_chunk_transaction(self):
+        def progress(records_processed):
+            if records_processed > 1:
+                raise UploadClaimLost()
+
+        rows = [{'product_name': name, 'quantity': '1'} for name in ('Widget', 'Gadget')]
+        with self.assertRaises(UploadClaimLost):
+            ingest_stock_rows(rows, self.user, chunk_size=1, progress=progress)
+        self.assertEqual(list(Stock.objects.values_list('product_name', flat=True)), ['Widget'])
+
+    def test_process_uploads_claims_the_file(self):
+        upload = self.upload(b'product_name,quantity\nWidget,5\n')
+        call_command('process_uploads', '--file-id', upload.pk, stdout=StringIO())
+        upload.refresh_from_db()
+        self.assertEqual((upload.processing_status, upload.records_processed), ('completed', 1))
+        self.assertIsNotNone(upload.heartbeat_at)
+        with self.assertRaisesMessage(CommandError, 'is completed; only pending uploads'):
+            call_command('process_uploads', '--file-id', upload.pk, stdout=StringIO())
+        self.assertEqual(Stock.objects.get().quantity, 5)
+
+    def post_upload(self, content, name='stock.csv', file_type='stock'):
+        return self.client.post(reverse('upload_file'), {
+            'file': SimpleUploadedFile(name, content), 'file_type': file_type,
+        }, follow=True)
+
+    def test_same_content_is_stored_and_processed_once(self):
+        content = b'product_name,quantity,price\nWidget,5,1.00\n'
+        self.client.force_login(self.user)
+        self.post_upload(content)
+        response = self.post_upload(content, name='stock-again.csv')
+        self.assertContains(response, 'it was not processed again')
+
+        first, second = UploadedFile.objects.order_by('id')
+        self.assertEqual(first.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual((second.processing_status, second.duplicate_of), ('duplicate', first))
+        self.assertEqual(second.file_path.name, first.file_path.name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [os.path.basename(first.file_path.name)])
+        run_upload(claim_next_upload())
+        self.assertIsNone(claim_next_upload())
+        self.assertEqual(Stock.objects.get(product_name='Widget').quantity, 5)
+
+    def test_failed_or_other_type_uploads_are_queued_again(self):
+        content = b'product_name,quantity,price\nWidget,lots,1.00\n'
+        self.client.force_login(self.user)
+        self.post_upload(content)
+        run_upload(claim_next_upload())
+        self.post_upload(content)
+        self.post_upload(content, file_type='sales')
+        self.assertEqual(UploadedFile.objects.filter(processing_status='pending').count(), 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'uploads'))), 1)
+
+    def test_partly_imported_uploads_are_not_queued_again(self):
+        content = b'product_name,quantity,price\nWidget,5,1.00\n'
+        self.client.force_login(self.user)
+        self.post_upload(content)
+        UploadedFile.objects.update(processing_status='failed', records_processed=1)
+        response = self.post_upload(content)
+        self.assertContains(response, 'failed after importing 1 records, so it was not processed again')
+        self.assertEqual(UploadedFile.objects.latest('id').processing_status, 'duplicate')
+
+    def test_invalid_rows_reject_the_whole_file_with_a_report(self):
+        self.upload(b'product_name,quantity,price\nWidget,5,1.00\nGadget,,2.00\n'
+                    b'Gizmo,many,x\n\n,3,1.00\nDoohickey,1.5,-1\n')
+        uploaded_file = run_upload(claim_next_upload())
+        self.assertEqual(uploaded_file.processing_status, 'failed')
+        self.assertIn('3 of 5 rows have errors, so nothing was imported', uploaded_file.error_message)
+        self.assertFalse(Stock.objects.exists())
+
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('upload_file')), '5 errors')
+        response = self.client.get(reverse('upload_report', args=[uploaded_file.pk]))
+        report = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(report, [
+            ['row', 'column', 'value', 'error'],
+            ['4', 'quantity', 'many', '"many" is not a whole number'],
+            ['4', 'price', 'x', '"x" is not a number below 100000000'],
+            ['6', 'product_name', '', 'Required'],
+            ['7', 'quantity', '1.5', '"1.5" is not a whole number'],
+            ['7', 'price', '-1', 'Must be at least 0'],
+        ])
+        other = User.objects.create_user('other', password='pass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('upload_report', args=[uploaded_file.pk])).status_code, 404)
+
+    def test_skip_invalid_rows_imports_the_rest(self):
+        Stock.objects.create(user=self.user, product_name='Widget', quantity=10, price=Decimal('2.00'))
+        self.client.force_login(self.user)
+        self.client.post(reverse('upload_file'), {
+            'file': SimpleUploadedFile('sales.csv', b'product_name,quantity_sold,sale_date\nWidget,2,2024-01-05\n'
+                                                   b'Unknown,1,\nWidget,3,yesterday\nWidget,,\n'),
+            'file_type': 'sales', 'skip_invalid_rows': 'on',
+        })
+        uploaded_file = run_upload(claim_next_upload())
+        self.assertEqual((uploaded_file.processing_status, uploaded_file.records_processed), ('completed', 1))
+        self.assertEqual(uploaded_file.error_count, 3)
+        self.assertTrue(uploaded_file.error_report)
+        sale = Sale.objects.get()
+        self.assertEqual((sale.quantity_sold, sale.unit_price, sale.sale_date.date().isoformat()),
+                         (2, Decimal('2.00'), '2024-01-05'))
+        self.assertEqual(Stock.objects.get().quantity, 8)
+
+    def test_bom_and_windows_encodings(self):
+        self.upload('﻿product_name,quantity\nCafé,1\n'.encode('utf-8'), name='utf8.csv')
+        self.upload('product_name,quantity\nCrème,2\n'.encode('cp1252'), name='excel.csv')
+        self.upload('product_name,quantity\nNaïve,3\n'.encode('utf-16'), name='utf16.csv')
+        for _ in range(3):
+            self.assertEqual(run_upload(claim_next_upload()).processing_status, 'completed')
+        self.assertEqual(dict(Stock.objects.values_list('product_name', 'quantity')),
+                         {'Café': 1, 'Crème': 2, 'Naïve': 3})
+
+    def test_missing_required_column(self):
+        self.upload(b'product_name,quantity\nWidget,1\n', name='sales.csv', file_type='sales')
+        uploaded_file = run_upload(claim_next_upload())
+        self.assertEqual(uploaded_file.processing_status, 'failed')
+        self.assertEqual(uploaded_file.error_message, 'Missing required column(s): quantity_sold')
+
+
+class XlsxReaderTests(TestCase):
+    def test_streams_chunks_and_skips_blank_rows(self):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['product_name', 'quantity', 'price'])
+        for i in range(3):
+            sheet.append([f'P{i}', i, 1.5])
+        sheet.append([None, None, None])
+        with tempfile.NamedTemporaryFile(suffix='.xlsx') as tmp:
+            workbook.save(tmp.name)
+            frames = list(read_xlsx_chunks(tmp.name, 2))
+        self.assertEqual([list(frame.index) for frame in frames], [[2, 3], [4, 5]])
+        rows = [row for frame in frames for row in check_frame(frame, COLUMNS['stock'])[0]]
+        self.assertEqual(rows[0], {'product_name': 'P0', 'quantity': 0, 'price': '1.5'})
+        self.assertEqual(len(rows), 3)
+
+
+class ImportLegacyDataTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.db_path = os.path.join(tmp_dir, 'smc.db')
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE stock (ProductName TEXT, Quantity INT, Price REAL)')
+        conn.executemany('INSERT INTO stock VALUES (?, ?, ?)', [(f'P{i}', 10, 1.5) for i in range(5)])
+        conn.execute('CREATE TABLE sales (id INTEGER PRIMARY KEY, ProductName TEXT, '
+                     'QuantitySold INT, EntryDate TEXT)')
+        conn.executemany('INSERT INTO sales (ProductName, QuantitySold, EntryDate) VALUES (?, ?, ?)',
+                         [(f'P{i % 6}', 1, '2024-01-02 10:00:00') for i in range(30)])
+        conn.commit()
+        conn.close()
+
+    def run_import(self, *args):
+        call_command('import_legacy_data', '--user', 'shop', '--db-path', self.db_path,
+                     '--batch-size', '7', *args, stdout=StringIO())
+
+    def test_streams_batches_without_touching_stock(self):
+        self.run_import()
+        self.assertEqual(Stock.objects.filter(user=self.user).count(), 5)
+        # every sixth sale references a product that doesn't exist
+        self.assertEqual(Sale.objects.filter(user=self.user).count(), 25)
+        self.assertEqual(Stock.objects.get(product_name='P0').quantity, 10)
+        checkpoint = ImportCheckpoint.objects.get(user=self.user, table='sales')
+        self.assertEqual((checkpoint.last_rowid, checkpoint.rows_read), (30, 30))
+
+    def test_resume_continues_after_checkpoint(self):
+        self.run_import()
+        # Pretend the import died after the first two sales batches
+        Sale.objects.filter(pk__in=Sale.objects.order_by('-id').values('id')[:13]).delete()
+        ImportCheckpoint.objects.filter(table='sales').update(last_rowid=14, rows_read=14)
+        self.run_import('--resume')
+        self.assertEqual(Sale.objects.filter(user=self.user).count(), 25)
+
+    def test_repeated_products_in_a_batch_keep_the_last_row(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO stock VALUES ('P0', 3, 2.0)")
+        conn.commit()
+        conn.close()
+        Stock.objects.create(user=self.user, product_name='P0', quantity=1, price=1)
+        Stock.objects.filter(user=self.user).update(updated_at=timezone.now() - timezone.timedelta(days=1))
+        self.run_import()
+        p0 = Stock.objects.get(user=self.user, product_name='P0')
+        self.assertEqual((p0.quantity, p0.price), (3, Decimal('2.00')))
+        # Shows up in offline snapshot deltas
+        self.assertGreater(p0.updated_at, timezone.now() - timezone.timedelta(minutes=1))
+
+
+class SyncLegacyDataTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.db_path = os.path.join(tmp_dir, 'export.db')
+        today = timezone.localdate().isoformat()
+        self.legacy = sqlite3.connect(self.db_path)
+        self.addCleanup(self.legacy.close)
+        self.legacy.execute('CREATE TABLE stock (id INTEGER PRIMARY KEY, ProductName TEXT, Quantity INT, Price REAL)')
+        self.legacy.executemany('INSERT INTO stock VALUES (?, ?, ?, ?)', [(i, f'P{i}', 10, 1.5) for i in range(1, 5)])
+        self.legacy.execute('CREATE TABLE sales (id INTEGER PRIMARY KEY, ProductName TEXT, QuantitySold INT, '
+                            'UnitPrice REAL, EntryDate TEXT)')
+        self.legacy.executemany('INSERT INTO sales VALUES (?, ?, ?, ?, ?)', [
+            (1, 'P1', 1, 1.5, '2020-01-02 10:00:00'),
+            (2, 'P2', 2, 1.5, f'{today} 09:00:00'),
+            (3, 'P1', 3, 1.5, f'{today} 10:00:00'),
+        ])
+        self.legacy.commit()
+
+    def sync(self, *args):
+        out = StringIO()
+        call_command('sync_legacy_data', '--user', 'shop', '--db-path', self.db_path,
+                     '--lookback-days', '1', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_second_sync_without_changes_writes_nothing(self):
+        output = self.sync()
+        self.assertIn('stock: 4 inserted, 0 updated, 0 deleted', output)
+        self.assertIn('sales: 3 inserted, 0 updated, 0 deleted', output)
+        with CaptureQueriesContext(connection) as queries:
+            output = self.sync()
+        self.assertIn('stock: 0 inserted, 0 updated, 0 deleted', output)
+        self.assertIn('sales: 0 inserted, 0 updated, 0 deleted', output)
+        self.assertFalse([q for q in queries if q['sql'].startswith(('INSERT INTO "inventory_s',
+                                                                      'UPDATE "inventory_s'))])
+        self.assertEqual(ImportCheckpoint.objects.get(user=self.user, table='sales').last_rowid, 3)
+
+    def test_applies_only_changed_rows(self):
+        self.sync()
+        untouched = Stock.objects.get(legacy_id=2).updated_at
+        self.legacy.execute('UPDATE stock SET Quantity = 7 WHERE id = 1')
+        self.legacy.execute('DELETE FROM stock WHERE id = 4')
+        self.legacy.execute("INSERT INTO stock VALUES (5, 'P5', 3, 2.0)")
+        self.legacy.execute('UPDATE sales SET QuantitySold = 5 WHERE id = 3')
+        self.legacy.execute('DELETE FROM sales WHERE id = 2')
+        self.legacy.execute("INSERT INTO sales VALUES (4, 'P5', 1, 2.0, '2020-01-03 10:00:00')")
+        self.legacy.commit()
+
+        output = self.sync()
+        self.assertIn('stock: 1 inserted, 1 updated, 1 deleted', output)
+        self.assertIn('sales: 1 inserted, 1 updated, 1 deleted', output)
+        self.assertEqual(Stock.objects.get(legacy_id=1).quantity, 7)
+        self.assertEqual(Stock.objects.get(legacy_id=2).updated_at, untouched)
+        self.assertFalse(Stock.objects.filter(product_name='P4').exists())
+        self.assertEqual(sorted(Sale.objects.values_list('legacy_id', flat=True)), [1, 3, 4])
+        # The rollup follows the edit and the void
+        p1 = Stock.objects.get(legacy_id=1)
+        today = DailyProductSales.objects.get(product=p1, day=timezone.localdate())
+        self.assertEqual((today.quantity_sold, today.sales_count), (5, 1))
+        self.assertFalse(DailyProductSales.objects.filter(product__legacy_id=2).exists())
+        self.assertEqual(ImportCheckpoint.objects.get(user=self.user, table='sales').last_rowid, 4)
+
+    def test_adopts_existing_products_and_keeps_those_with_sales(self):
+        Stock.objects.create(user=self.user, product_name='P1', quantity=10, price=Decimal('1.50'))
+        self.sync()
+        self.assertEqual(Stock.objects.filter(user=self.user).count(), 4)
+        self.legacy.execute('DELETE FROM stock WHERE id = 1')
+        self.legacy.commit()
+        output = self.sync()
+        self.assertIn('stock: 0 inserted, 0 updated, 0 deleted', output)
+        self.assertTrue(Stock.objects.filter(product_name='P1').exists())
+
+    def test_updated_products_stay_with_their_source(self):
+        self.sync('--source', 'till-1')
+        for quantity in (7, 8):
+            self.legacy.execute('UPDATE stock SET Quantity = ? WHERE id = 1', (quantity,))
+            self.legacy.commit()
+            output = self.sync('--source', 'till-1')
+            self.assertIn('stock: 0 inserted, 1 updated, 0 deleted', output)
+            self.assertNotIn('another source', output)
+        p1 = Stock.objects.get(legacy_id=1)
+        self.assertEqual((p1.quantity, p1.legacy_source), (8, 'till-1'))
+
+    def test_undated_exports_only_void_rows_they_read(self):
+        self.legacy.execute('CREATE TABLE undated (id INTEGER PRIMARY KEY, ProductName TEXT, QuantitySold INT)')
+        self.legacy.execute('INSERT INTO undated SELECT id, ProductName, QuantitySold FROM sales')
+        self.legacy.execute('DROP TABLE sales')
+        self.legacy.execute('ALTER TABLE undated RENAME TO sales')
+        self.legacy.commit()
+        self.sync()
+        # The next export adds sale 5 and voided sale 4, which was never synced
+        self.legacy.execute("INSERT INTO sales VALUES (5, 'P2', 1)")
+        self.legacy.commit()
+        output = self.sync()
+        self.assertIn('sales: 1 inserted, 0 updated, 0 deleted', output)
+        self.assertEqual(sorted(Sale.objects.values_list('legacy_id', flat=True)), [1, 2, 3, 5])
+
+    def test_sources_with_the_same_keys_stay_apart(self):
+        self.sync('--source', 'till-1')
+        other_path = os.path.join(os.path.dirname(self.db_path), 'till-2.db')
+        other = sqlite3.connect(other_path)
+        other.execute('CREATE TABLE stock (id INTEGER PRIMARY KEY, ProductName TEXT, Quantity INT, Price REAL)')
+        other.executemany('INSERT INTO stock VALUES (?, ?, ?, ?)', [(1, 'P1', 99, 9.0), (2, 'Q2', 5, 2.0)])
+        other.execute('CREATE TABLE sales (id INTEGER PRIMARY KEY, ProductName TEXT, QuantitySold INT, '
+                      'UnitPrice REAL, EntryDate TEXT)')
+        other.execute('INSERT INTO sales VALUES (?, ?, ?, ?, ?)',
+                      (2, 'Q2', 4, 2.0, f'{timezone.localdate().isoformat()} 11:00:00'))
+        other.commit()
+        other.close()
+
+        output = StringIO()
+        call_command('sync_legacy_data', '--user', 'shop', '--db-path', other_path, '--source', 'till-2',
+                     '--lookback-days', '1', stdout=output)
+        self.assertIn('stock: 1 inserted, 0 updated, 0 deleted', output.getvalue())
+        self.assertIn('sales: 1 inserted, 0 updated, 0 deleted', output.getvalue())
+        self.assertEqual(Stock.objects.get(product_name='P1').quantity, 10)
+        self.assertEqual(Sale.objects.filter(legacy_id=2).count(), 2)
+
+        # Syncing till-1 again neither updates nor voids till-2's sale 2
+        self.assertIn('sales: 0 inserted, 0 updated, 0 deleted', self.sync('--source', 'till-1'))
+        self.assertEqual(Sale.objects.get(legacy_source='till-2', legacy_id=2).quantity_sold, 4)
+
+    def test_dry_run_rolls_back(self):
+        output = self.sync('--dry-run')
+        self.assertIn('stock: 4 inserted', output)
+        self.assertFalse(Stock.objects.exists())
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+
+class QueryPlansCommandTests(TestCase):
+    def test_reports_before_and_after(self):
+        out = StringIO()
+        call_command('query_plans', '--stocks', '50', '--sales', '200', '--repeat', '1', stdout=out)
+        self.assertIn('sales_list', out.getvalue())
+        self.assertIn('sale_user_date_idx', out.getvalue())
+        # Seeded data is rolled back
+        self.assertFalse(Sale.objects.exists())
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.widget = Stock.objects.create(user=self.user, product_name='Widget', quantity=100,
+                                           price=Decimal('2.00'))
+
+    def rollup(self):
+        return DailyProductSales.objects.get(user=self.user, product=self.widget,
+                                             day=timezone.localdate())
+
+    def test_sale_save_and_bulk_ingestion_update_rollup(self):
+        Sale.objects.create(user=self.user, product=self.widget, quantity_sold=2,
+                            unit_price=Decimal('2.00'), total_amount=Decimal('4.00'))
+        ingest_sales_rows([{'product_name': 'Widget', 'quantity_sold': '3'}], self.user)
+        rollup = self.rollup()
+        self.assertEqual((rollup.quantity_sold, rollup.revenue, rollup.sales_count),
+                         (5, Decimal('10.00'), 2))
+
+    def test_dashboard_reads_rollup(self):
+        ingest_sales_rows([{'product_name': 'Widget', 'quantity_sold': '3'}], self.user)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['sales_count'], 1)
+        self.assertEqual(response.context['total_sales'], Decimal('6.00'))
+        self.assertEqual(list(response.context['top_products']),
+                         [{'product__product_name': 'Widget', 'total_sold': 3}])
+
+    def test_rebuild_matches_incremental_rollup(self):
+        for quantity in (1, 2, 3):
+            Sale.objects.create(user=self.user, product=self.widget, quantity_sold=quantity,
+                                unit_price=Decimal('2.00'), total_amount=quantity * Decimal('2.00'))
+        incremental = self.rollup()
+        DailyProductSales.objects.all().delete()
+        call_command('rebuild_sales_rollup', stdout=StringIO())
+        rebuilt = self.rollup()
+        self.assertEqual((rebuilt.quantity_sold, rebuilt.revenue, rebuilt.sales_count),
+                         (incremental.quantity_sold, incremental.revenue, incremental.sales_count))
+
+    def test_edited_and_deleted_sales_leave_rollup(self):
+        kept, edited, deleted = (
+            Sale.objects.create(user=self.user, product=self.widget, quantity_sold=quantity,
+                                unit_price=Decimal('2.00'), total_amount=quantity * Decimal('2.00'))
+            for quantity in (1, 2, 3)
+        )
+        edited.quantity_sold, edited.total_amount = 5, Decimal('10.00')
+        edited.save()
+        deleted.delete()
+        rollup = self.rollup()
+        self.assertEqual((rollup.quantity_sold, rollup.revenue, rollup.sales_count), (6, Decimal('12.00'), 2))
+
+        # Moved to another day: today's totals lose it, and the emptied day goes
+        edited.sale_date -= timezone.timedelta(days=1)
+        edited.save()
+        Sale.objects.filter(pk=kept.pk).delete()
+        self.assertFalse(DailyProductSales.objects.filter(day=timezone.localdate()).exists())
+        self.assertEqual(DailyProductSales.objects.get().quantity_sold, 5)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.client.force_login(self.user)
+
+    def get_dashboard(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(reverse('dashboard'))
+
+    def test_repeat_reads_hit_the_cache(self):
+        self.get_dashboard()
+        hits = cache_stats()['hits']
+        with self.assertNumQueries(2):  # session + user only
+            response = self.get_dashboard()
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+        self.assertEqual(response.context['total_products'], 0)
+
+    def test_stock_and_bulk_changes_invalidate(self):
+        self.get_dashboard()
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(user=self.user, product_name='Widget', quantity=5, price=1)
+        self.assertEqual(self.get_dashboard().context['total_products'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_sales_rows([{'product_name': 'Widget', 'quantity_sold': '2'}], self.user)
+        self.assertEqual(self.get_dashboard().context['sales_count'], 1)
+
+
+class StockSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        other = User.objects.create_user('other', password='pass')
+        Stock.objects.create(user=self.user, product_name='Blue Widget', sku='BW-1', price=1)
+        Stock.objects.create(user=self.user, product_name='Gadget', supplier='Widget Works', price=1)
+        Stock.objects.create(user=other, product_name='Widget', price=1)
+
+    def names(self, query):
+        return [stock.product_name for stock in search_stocks(self.user, query)[:10]]
+
+    def test_matches_any_field_most_relevant_first(self):
+        self.assertEqual(self.names('widget'), ['Blue Widget', 'Gadget'])
+        self.assertEqual(self.names('bw-1'), ['Blue Widget'])
+
+    def test_index_follows_stock_writes(self):
+        stock = Stock.objects.get(product_name='Gadget')
+        stock.supplier = 'Acme'
+        stock.save()
+        ingest_stock_rows([{'product_name': 'Widget Pro', 'quantity': '1', 'price': '1'}], self.user)
+        self.assertEqual(sorted(self.names('widget')), ['Blue Widget', 'Widget Pro'])
+        Stock.objects.filter(product_name='Blue Widget').delete()
+        self.assertEqual(self.names('widget'), ['Widget Pro'])
+
+    def test_short_queries_fall_back_to_scan(self):
+        self.assertNotIsInstance(search_stocks(self.user, 'bw'), FtsSearchResults)
+        self.assertEqual(self.names('bw'), ['Blue Widget'])
+
+    def test_stock_list_paginates_search_results(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('stock_list'), {'q': 'widget'})
+        self.assertEqual(len(response.context['page_obj']), 2)
+        response = self.client.get(reverse('stock_query'), {'query': 'widget'})
+        self.assertEqual([r['product_name'] for r in response.json()['results']], ['Blue Widget', 'Gadget'])
+
+    def test_filters_narrow_listing_and_search(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('stock_list'), {'supplier': 'Widget Works'})
+        self.assertEqual([stock.product_name for stock in response.context['page_obj']], ['Gadget'])
+        response = self.client.get(reverse('stock_list'), {'q': 'widget', 'supplier': 'Widget Works'})
+        self.assertEqual([stock.product_name for stock in response.context['page_obj']], ['Gadget'])
+        self.assertEqual([stock.product_name for stock in search_stocks(self.user, 'wi', filters={'supplier': 'x'})],
+                         [])
+
+
+class StockExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        Stock.objects.create(user=self.user, product_name='Widget', quantity=3, price=Decimal('2.50'),
+                             supplier='Acme', category='Tools', sku='W-1', description='Blue', minimum_stock=1)
+        Stock.objects.create(user=self.user, product_name='Gadget', quantity=7, price=Decimal('9.99'),
+                             supplier='Other', category='Tools')
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('stock_export'), params)
+        self.assertEqual(response.status_code, 200)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'stock.xlsx')
+        with open(path, 'wb') as file:
+            file.write(b''.join(response.streaming_content))
+        rows = [row for frame in read_xlsx_chunks(path, VALIDATION_CHUNK_SIZE)
+                for row in check_frame(frame, COLUMNS['stock'])[0]]
+        return response, rows
+
+    def test_round_trips_through_the_upload_format(self):
+        response, rows = self.export()
+        self.assertIn('stock.xlsx', response['Content-Disposition'])
+        self.assertEqual([row['product_name'] for row in rows], ['Gadget', 'Widget'])
+        self.assertEqual(rows[1]['price'], '2.5')
+
+        other = User.objects.create_user('other', password='pass')
+        ingest_stock_rows(rows, other)
+        widget = Stock.objects.get(user=other, product_name='Widget')
+        self.assertEqual((widget.quantity, widget.price, widget.sku, widget.minimum_stock),
+                         (3, Decimal('2.50'), 'W-1', 1))
+        self.assertEqual(Stock.objects.get(user=other, product_name='Gadget').price, Decimal('9.99'))
+
+    def test_filters_match_stock_list(self):
+        response, rows = self.export(supplier='Acme', category='Tools')
+        self.assertIn('stock_tools_acme.xlsx', response['Content-Disposition'])
+        self.assertEqual([row['product_name'] for row in rows], ['Widget'])
+
+
+class AddSaleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.widget = Stock.objects.create(user=self.user, product_name='Widget', quantity=3,
+                                           price=Decimal('2.00'), supplier='Acme')
+        self.client.force_login(self.user)
+
+    def post_sale(self, quantity):
+        return self.client.post(reverse('add_sale'), {
+            'product': self.widget.pk, 'quantity_sold': quantity, 'unit_price': '2.00',
+        })
+
+    def test_sale_only_writes_quantity(self):
+        # A stale in-memory copy must not overwrite other columns
+        Stock.objects.filter(pk=self.widget.pk).update(supplier='Changed')
+        Sale.objects.create(user=self.user, product=self.widget, quantity_sold=2,
+                            unit_price=Decimal('2.00'), total_amount=Decimal('4.00'))
+        self.widget.refresh_from_db()
+        self.assertEqual((self.widget.quantity, self.widget.supplier), (1, 'Changed'))
+
+    def test_insufficient_stock_is_reported(self):
+        response = self.post_sale(5)
+        self.assertContains(response, 'Current stock: 3')
+        self.assertFalse(Sale.objects.exists())
+        self.assertRedirects(self.post_sale(3), reverse('sales_list'))
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.quantity, 0)
+
+
+class ConcurrentSaleTests(TransactionTestCase):
+    threads = 8
+    attempts_per_thread = 5
+    initial_stock = 20
+
+    def test_concurrent_sales_never_oversell(self):
+        user = User.objects.create_user('shop', password='pass')
+        product = Stock.objects.create(user=user, product_name='Widget', quantity=self.initial_stock,
+                                       price=Decimal('1.00'))
+        outcomes = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.threads)
+
+        def buy():
+            start.wait()
+            for _ in range(self.attempts_per_thread):
+                while True:
+                    try:
+                        Sale.objects.create(user=user, product_id=product.pk, quantity_sold=1,
+                                            unit_price=Decimal('1.00'), total_amount=Decimal('1.00'))
+                        outcome = 'sold'
+                    except InsufficientStockError:
+                        outcome = 'refused'
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting; retry
+                        continue
+                    break
+                with lock:
+                    outcomes.append(outcome)
+            if connection.vendor != 'sqlite':
+                connection.close()
+
+        workers = [threading.Thread(target=buy) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(outcomes.count('sold'), self.initial_stock)
+        self.assertEqual(Sale.objects.count(), self.initial_stock)
+        self.assertEqual(product.quantity, 0)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.client.force_login(self.user)
+        product = Stock.objects.create(user=self.user, product_name='Widget', quantity=0, price=Decimal('1.00'))
+        # Ties on sale_date must be broken by id
+        day = timezone.now().replace(microsecond=123456)
+        self.sales = Sale.objects.bulk_create([
+            Sale(user=self.user, product=product, quantity_sold=1, unit_price=Decimal('1.00'),
+                 total_amount=Decimal('1.00'), sale_date=day - timezone.timedelta(days=i // 3))
+            for i in range(50)
+        ])
+
+    def walk(self, direction, page):
+        pages = [page]
+        while getattr(page, f'has_{direction}'):
+            page = keyset_page(Sale.objects.filter(user=self.user), getattr(page, f'{direction}_cursor'),
+                               keys=('sale_date', 'id'), per_page=7)
+            pages.append(page)
+        return pages
+
+    def test_keyset_pages_cover_every_row_in_order(self):
+        first = keyset_page(Sale.objects.filter(user=self.user), keys=('sale_date', 'id'), per_page=7)
+        forward = self.walk('next', first)
+        expected = list(Sale.objects.filter(user=self.user).order_by('-sale_date', '-id').values_list('id', flat=True))
+        self.assertEqual([sale.id for page in forward for sale in page], expected)
+        self.assertFalse(first.has_previous)
+
+        backward = self.walk('previous', forward[-1])
+        self.assertEqual([sale.id for page in reversed(backward) for sale in page][:7], expected[:7])
+        self.assertEqual(len(backward[-1]), 7)
+
+    def test_cursor_links_keep_filters_and_skip_count(self):
+        date_from = (timezone.localdate() - timezone.timedelta(days=10)).isoformat()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('sales_list'), {'date_from': date_from})
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'] or 'OFFSET' in q['sql']])
+        page = response.context['page_obj']
+        self.assertIn(f'date_from={date_from}', page.next_url)
+
+        response = self.client.get(reverse('sales_list') + page.next_url)
+        self.assertTrue(response.context['page_obj'].has_previous)
+        self.assertTrue(all(sale.sale_date.date().isoformat() >= date_from
+                            for sale in response.context['page_obj']))
+
+    def test_invalid_cursor_gives_first_page(self):
+        response = self.client.get(reverse('stock_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page_obj']), 1)
+
+    def test_search_results_page_without_count(self):
+        Stock.objects.bulk_create([Stock(user=self.user, product_name=f'Gadget {i:02d}', quantity=1,
+                                         price=Decimal('1.00')) for i in range(25)])
+        response = self.client.get(reverse('stock_list'), {'q': 'Gadget'})
+        page = response.context['page_obj']
+        self.assertEqual(len(page), 20)
+        second = self.client.get(reverse('stock_list') + page.next_url).context['page_obj']
+        self.assertEqual(len(second), 5)
+        self.assertIn('q=Gadget', page.next_url)
+
+
+@override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass', is_staff=True)
+        self.product = Stock.objects.create(user=self.user, product_name='Widget', quantity=100,
+                                            price=Decimal('1.00'))
+        for _ in range(25):
+            Sale.objects.create(user=self.user, product=self.product, quantity_sold=1,
+                                unit_price=Decimal('1.00'), total_amount=Decimal('1.00'))
+        self.client.force_login(self.user)
+
+    def test_every_route_declares_a_budget(self):
+        names = [pattern.name for pattern in urls.urlpatterns]
+        self.assertEqual([name for name in names if get_query_budget(name) is None], [])
+
+    def test_views_stay_within_budget(self):
+        for name, args, params in [
+            ('dashboard', [], {}), ('cache_stats', [], {}), ('stock_list', [], {}),
+            ('stock_list', [], {'q': 'Widget'}), ('stock_query', [], {'query': 'Widget'}),
+            ('add_stock', [], {}), ('edit_stock', [self.product.pk], {}), ('sales_list', [], {}),
+            ('add_sale', [], {}), ('upload_file', [], {}),
+        ]:
+            with self.subTest(name=name, params=params):
+                response = self.client.get(reverse(name, args=args), params)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('queries', response['Server-Timing'])
+
+        response = self.client.post(reverse('add_sale'), {
+            'product': self.product.pk, 'quantity_sold': 1, 'unit_price': '1.00',
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_strict_mode_fails_over_budget_requests(self):
+        with mock.patch.dict(querybudget._budgets, {'sales_list': 1}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'budget is 1'):
+                self.client.get(reverse('sales_list'))
+
+    def test_repeated_query_shapes_are_flagged(self):
+        sales = Sale.objects.filter(user=self.user)[:5]
+        with self.assertRaisesMessage(QueryBudgetExceeded, '5 queries of the same shape'):
+            with assert_query_budget(10):
+                [sale.product.product_name for sale in sales]
+        with assert_query_budget(1):
+            [sale.product.product_name for sale in sales.select_related('product')]
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_USERS=['shop'], PROFILING_SAMPLE_RATE=0,
+                   PROFILING_SLOW_MS=0, PROFILING_BUFFER_SIZE=3)
+class RequestProfilerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        product = Stock.objects.create(user=self.user, product_name='Widget', quantity=0, price=Decimal('1.00'))
+        Sale.objects.bulk_create([Sale(user=self.user, product=product, quantity_sold=1, unit_price=Decimal('1.00'),
+                                       total_amount=Decimal('1.00')) for _ in range(5)])
+
+    def test_opted_in_user_is_profiled(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('sales_list'))
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.url_name, profile.user, profile.status_code), ('sales_list', self.user, 200))
+        self.assertGreater(profile.query_count, 0)
+        self.assertGreater(profile.orm_ms, 0)
+        self.assertGreater(profile.template_ms, 0)
+        self.assertLessEqual(profile.view_ms + profile.orm_ms + profile.template_ms, profile.total_ms + 0.01)
+        self.assertIn('cumulative', profile.top_frames)
+
+    def test_sampling_and_ring_buffer(self):
+        other = User.objects.create_user('other', password='pass')
+        self.client.force_login(other)
+        self.client.get(reverse('stock_list'))
+        self.assertFalse(RequestProfile.objects.exists())
+
+        with self.settings(PROFILING_SAMPLE_RATE=100):
+            for _ in range(5):
+                self.client.get(reverse('stock_list'))
+        self.assertEqual(RequestProfile.objects.count(), 3)
+
+    def test_admin_lists_profiles(self):
+        admin_user = User.objects.create_superuser('admin', password='pass')
+        self.client.force_login(self.user)
+        self.client.get(reverse('dashboard'))
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:inventory_requestprofile_changelist'), {'url_name': 'dashboard'})
+        self.assertContains(response, 'dashboard')
+
+
+class BenchCommandTests(TestCase):
+    def run_bench(self, *args):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        output = os.path.join(tmp_dir, 'bench.json')
+        call_command('bench', '--users', '1', '--stocks', '30', '--sales', '100', '--upload-rows', '20',
+                     '--legacy-sales', '20', '--repeat', '1', '--output', output, *args,
+                     stdout=StringIO(), stderr=StringIO())
+        with open(output) as file:
+            return output, json.load(file)
+
+    def test_reports_every_path_and_rolls_back(self):
+        _, report = self.run_bench()
+        self.assertLessEqual({
+            'dashboard', 'stock_query', 'add_sale', 'process_uploaded_file:csv', 'process_uploaded_file:xlsx',
+            'process_uploads', 'import_legacy_data',
+        }, set(report['results']))
+        self.assertGreater(report['results']['dashboard']['queries'], 0)
+        self.assertFalse(User.objects.exists())
+
+    def test_processes_only_its_own_uploads(self):
+        # Claiming from the queue would pick up users' pending uploads too
+        with mock.patch('inventory.management.commands.process_uploads.claim_next_upload') as claim_next:
+            self.run_bench()
+        claim_next.assert_not_called()
+
+    def test_flags_regressions_against_baseline(self):
+        baseline, report = self.run_bench()
+        for result in report['results'].values():
+            result['best_ms'] = 0.001
+        with open(baseline, 'w') as file:
+            json.dump(report, file)
+        # A sub-millisecond slowdown counts as noise, so only slower paths regress
+        with self.assertRaisesMessage(CommandError, 'regressed by more than 20'):
+            self.run_bench('--baseline', baseline, '--fail-on-regression')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StockAutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_indexes()
+        self.user = User.objects.create_user('shop', password='pass')
+        for name, sku in [('Blue Widget', 'BW-1'), ('Widget Pro', 'WP-2'), ('Gadget', 'WID-3'), ('Sprocket', '')]:
+            Stock.objects.create(user=self.user, product_name=name, sku=sku, quantity=5, price=Decimal('2.50'))
+        self.client.force_login(self.user)
+
+    def get(self, query, **headers):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(reverse('stock_autocomplete'), {'query': query}, headers=headers)
+
+    def names(self, response):
+        return [row['product_name'] for row in response.json()['results']]
+
+    def test_ranks_name_then_word_then_sku_prefixes(self):
+        response = self.get('wid')
+        self.assertEqual(self.names(response), ['Widget Pro', 'Blue Widget', 'Gadget'])
+        self.assertEqual(response.json()['results'][0]['price'], 2.5)
+        self.assertEqual(self.names(self.get('zzz')), [])
+
+    def test_repeat_queries_skip_the_database(self):
+        etag = self.get('wid')['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.names(self.get('widget')), ['Widget Pro', 'Blue Widget'])
+            response = self.get('wid', if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in queries if 'inventory_stock' in q['sql']])
+
+    def test_stock_writes_invalidate_the_index(self):
+        etag = self.get('wid')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(user=self.user, product_name='Widget Mini', quantity=1, price=Decimal('1.00'))
+        response = self.get('wid', if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Widget Mini', self.names(response))
+
+    def test_index_cache_is_bounded(self):
+        other = User.objects.create_user('other', password='pass')
+        Stock.objects.create(user=other, product_name='Widget Other', quantity=1, price=Decimal('1.00'))
+        with mock.patch('inventory.autocomplete.MAX_INDEXED_USERS', 1), \
+                mock.patch('inventory.autocomplete.MAX_INDEXED_ROWS', 3):
+            # Too many products to index: answered by a prefix query
+            self.assertEqual(self.names(self.get('wid')), ['Blue Widget', 'Gadget', 'Widget Pro'])
+            self.client.force_login(other)
+            self.assertEqual(self.names(self.get('wid')), ['Widget Other'])
+            self.assertEqual(list(autocomplete._indexes), [other.pk])
+
+
+@override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_STRICT=True)
+class SalesExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        widget = Stock.objects.create(user=self.user, product_name='Widget, large', sku='W-1', quantity=0,
+                                      price=Decimal('2.50'))
+        Sale.objects.bulk_create([
+            Sale(user=self.user, product=widget, quantity_sold=i + 1, unit_price=Decimal('2.50'),
+                 total_amount=Decimal('2.50') * (i + 1),
+                 sale_date=timezone.make_aware(timezone.datetime(2024, 1, 1 + i, 12)))
+            for i in range(10)
+        ])
+        other = User.objects.create_user('other', password='pass')
+        Sale.objects.create(user=other, product=Stock.objects.create(user=other, product_name='Other', quantity=5,
+                                                                     price=Decimal('1.00')),
+                            quantity_sold=1, unit_price=Decimal('1.00'), total_amount=Decimal('1.00'))
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        with mock.patch('inventory.views.SALES_EXPORT_CHUNK_SIZE', 3):
+            response = self.client.get(reverse('sales_export'), params)
+            self.assertTrue(response.streaming)
+            return list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+    def test_streams_all_sales_in_date_order(self):
+        rows = self.export()
+        self.assertEqual(rows[0][:4], ['Date', 'Product', 'SKU', 'Quantity'])
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(rows[1][:6], ['2024-01-01 12:00:00', 'Widget, large', 'W-1', '1', '2.50', '2.50'])
+
+    def test_honours_the_date_filters(self):
+        response = self.client.get(reverse('sales_export'), {'date_from': '2024-01-03', 'date_to': '2024-01-05'})
+        self.assertIn('sales_2024-01-03_2024-01-05.csv', response['Content-Disposition'])
+        rows = self.export(date_from='2024-01-03', date_to='2024-01-05')
+        self.assertEqual([row[3] for row in rows[1:]], ['3', '4'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   TIME_ZONE='UTC')
+class SalesReportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shop', password='pass')
+        widget = Stock.objects.create(user=self.user, product_name='Widget', category='Tools', quantity=100,
+                                      price=Decimal('2.00'))
+        gadget = Stock.objects.create(user=self.user, product_name='Gadget', supplier='Acme', quantity=100,
+                                      price=Decimal('5.00'))
+        sales = [
+            (widget, 1, timezone.datetime(2024, 1, 1, 10)),   # Monday, week 1
+            (widget, 2, timezone.datetime(2024, 1, 3, 23)),   # Jan 4 in Kolkata
+            (gadget, 1, timezone.datetime(2024, 1, 9, 10)),   # week 2
+            (gadget, 3, timezone.datetime(2024, 2, 1, 10)),   # next month
+        ]
+        for product, quantity, sale_date in sales:
+            Sale.objects.create(user=self.user, product=product, quantity_sold=quantity, unit_price=product.price,
+                                total_amount=quantity * product.price,
+                                sale_date=timezone.make_aware(sale_date))
+        self.client.force_login(self.user)
+
+    def report(self, **params):
+        response = self.client.get(reverse('sales_report'), {'start': '2024-01-01', 'end': '2024-02-29', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_weekly_and_monthly_buckets_by_dimension(self):
+        self.assertContains(self.client.get(reverse('reports')), reverse('sales_report'))
+        report = self.report(grain='week')
+        self.assertEqual(report['buckets'][:2], ['2024-01-01', '2024-01-08'])
+        self.assertEqual(report['totals']['revenue'][:2], [6.0, 5.0])
+        report = self.report(grain='month')
+        self.assertEqual(report['buckets'], ['2024-01-01', '2024-02-01'])
+        self.assertEqual(report['totals']['quantity'], [4, 3])
+        products = {series['name']: series for series in report['product']}
+        self.assertEqual(products['Gadget']['revenue'], [5.0, 15.0])
+        self.assertEqual([series['name'] for series in report['category']], ['(none)', 'Tools'])
+        self.assertEqual(report['supplier'][0]['total_revenue'], 20.0)
+
+    def test_buckets_follow_the_profile_timezone(self):
+        self.assertEqual(self.report(grain='day', end='2024-01-05')['totals']['quantity'][:5], [1, 0, 2, 0, 0])
+        UserProfile.objects.create(user=self.user, timezone='Asia/Kolkata')
+        report = self.report(grain='day', end='2024-01-05')
+        self.assertEqual(report['timezone'], 'Asia/Kolkata')
+        self.assertEqual(report['totals']['quantity'][:5], [1, 0, 0, 2, 0])
+
+    def test_reports_are_cached_until_sales_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.report(grain='week')
+        with CaptureQueriesContext(connection) as queries:
+            self.report(grain='week')
+        self.assertFalse([q for q in queries if 'inventory_sale' in q['sql'] or 'dailyproductsales' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            widget = Stock.objects.get(product_name='Widget')
+            Sale.objects.create(user=self.user, product=widget, quantity_sold=1, unit_price=Decimal('2.00'),
+                                total_amount=Decimal('2.00'),
+                                sale_date=timezone.make_aware(timezone.datetime(2024, 1, 2, 10)))
+        self.assertEqual(self.report(grain='week')['totals']['revenue'][0], 8.0)
+
+    def test_rejects_bad_parameters(self):
+        for params in ({'grain': 'year'}, {'start': 'soon'}, {'start': '2024-03-01', 'end': '2024-01-01'}):
+            response = self.client.get(reverse('sales_report'), params)
+            self.assertEqual(response.status_code, 400)
+
+
+class ForecastTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.today = timezone.localdate()
+        self.steady = Stock.objects.create(user=self.user, product_name='Steady', quantity=20, price=1)
+        self.idle = Stock.objects.create(user=self.user, product_name='Idle', quantity=3, minimum_stock=5, price=1)
+        self.fresh = Stock.objects.create(user=self.user, product_name='Fresh', quantity=50, price=1)
+        old = timezone.now() - timezone.timedelta(days=365)
+        Stock.objects.filter(pk__in=[self.steady.pk, self.idle.pk]).update(created_at=old)
+        Stock.objects.filter(pk=self.fresh.pk).update(created_at=timezone.now() - timezone.timedelta(days=10))
+        # Two a day for the whole window; four a day for the last 10 days
+        rows = [(self.steady, age, 2) for age in range(1, 91)] + [(self.fresh, age, 4) for age in range(1, 11)]
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(user=self.user, product=product, day=self.today - timezone.timedelta(days=age),
+                              quantity_sold=quantity, revenue=quantity, sales_count=1)
+            for product, age, quantity in rows
+        ])
+
+    def test_velocity_reorder_point_and_cover(self):
+        self.assertEqual(forecast_user(self.user, today=self.today), 3)
+        steady = StockForecast.objects.get(product=self.steady)
+        self.assertAlmostEqual(steady.velocity, 2)
+        self.assertEqual(steady.reorder_point, 14)  # No variance: a week at 2/day
+        self.assertAlmostEqual(steady.days_of_cover, 10)
+        # Averaged over its own 10 days, not the 90-day window
+        self.assertAlmostEqual(StockForecast.objects.get(product=self.fresh).velocity, 4)
+        idle = StockForecast.objects.get(product=self.idle)
+        self.assertEqual((idle.velocity, idle.reorder_point, idle.days_of_cover), (0, 0, None))
+
+    def test_recent_days_weigh_more(self):
+        DailyProductSales.objects.filter(product=self.steady, day=self.today - timezone.timedelta(days=1)).update(
+            quantity_sold=30)
+        forecast_user(self.user, today=self.today)
+        steady = StockForecast.objects.get(product=self.steady)
+        self.assertGreater(steady.velocity, 3)
+        self.assertGreater(steady.reorder_point, 21)  # Safety stock for the spike
+
+    def test_command_and_dashboard_rank_by_cover(self):
+        call_command('forecast_stock', stdout=StringIO())
+        self.assertEqual(StockForecast.objects.filter(user=self.user).count(), 3)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['low_stock_products'], [self.idle])
+        with assert_query_budget(get_query_budget('dashboard')):
+            response = self.client.get(reverse('dashboard'), {'low_stock': 'cover'})
+        self.assertEqual(response.context['low_stock_products'], [self.steady, self.fresh])
+        self.assertContains(response, '12.5')  # Fresh: 50 units at 4/day
+
+
+class LowStockTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.widget = Stock.objects.create(user=self.user, product_name='Widget', quantity=6, minimum_stock=5,
+                                           price=Decimal('2.00'))
+        self.gadget = Stock.objects.create(user=self.user, product_name='Gadget', quantity=1, minimum_stock=2,
+                                           price=Decimal('3.00'))
+        self.events = []
+        low_stock_crossed.connect(self.receive)
+        self.addCleanup(low_stock_crossed.disconnect, self.receive)
+
+    def receive(self, sender, user_id, went_low, recovered, **kwargs):
+        self.events.append((sorted(went_low), sorted(recovered)))
+
+    def assertCounted(self, count):
+        self.assertEqual(LowStockCounter.count_for(self.user), count)
+        self.assertEqual(Stock.objects.filter(user=self.user, is_low=True).count(), count)
+
+    def test_sales_and_edits_cross_the_threshold(self):
+        self.assertCounted(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Sale.objects.create(user=self.user, product=self.widget, quantity_sold=2, unit_price=Decimal('2.00'),
+                                total_amount=Decimal('4.00'))
+        self.assertCounted(2)
+        self.assertEqual(self.events, [([self.widget.pk], [])])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.widget.refresh_from_db()
+            self.widget.quantity = 50
+            self.widget.save()
+            self.gadget.minimum_stock = 0
+            self.gadget.save()
+        self.assertTrue(self.widget.quantity > self.widget.minimum_stock and not self.widget.is_low)
+        self.assertCounted(0)
+        self.assertEqual(self.events[1:], [([], [self.widget.pk]), ([], [self.gadget.pk])])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(user=self.user, product_name='Empty', quantity=0, price=1).delete()
+        self.assertCounted(0)
+
+    def test_bulk_paths_batch_their_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_sales_rows([{'product_name': 'Widget', 'quantity_sold': '1'}] * 3, self.user)
+        self.assertEqual(self.events, [([self.widget.pk], [])])
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_stock_rows([
+                {'product_name': 'Widget', 'quantity': '10'},
+                {'product_name': 'Gadget', 'quantity': '10'},
+                {'product_name': 'Bolt', 'quantity': '0', 'minimum_stock': '3'},
+            ], self.user)
+        bolt = Stock.objects.get(product_name='Bolt')
+        self.assertEqual(self.events[1], ([bolt.pk], sorted([self.widget.pk, self.gadget.pk])))
+        self.assertCounted(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_sale_batch(self.user, [{'product': self.widget.pk, 'quantity_sold': 8},
+                                          {'product': self.gadget.pk, 'quantity_sold': 1}])
+        self.assertEqual(self.events[2], ([self.widget.pk], []))
+        self.assertCounted(2)
+
+    def test_dashboard_and_admin_read_the_flag(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['low_stock_count'], 1)
+        self.assertEqual(response.context['low_stock_products'], [self.gadget])
+
+        admin_user = User.objects.create_superuser('admin', password='pass')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:inventory_stock_changelist'), {'is_low__exact': '1'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.gadget])
+
+
+class StockSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.widget = Stock.objects.create(user=self.user, product_name='Widget', quantity=5, price=Decimal('2.50'))
+        self.gadget = Stock.objects.create(user=self.user, product_name='Gadget', quantity=1, price=Decimal('9.00'))
+        other = User.objects.create_user('other', password='pass')
+        Stock.objects.create(user=other, product_name='Other', quantity=1, price=Decimal('1.00'))
+        self.client.force_login(self.user)
+
+    def snapshot(self, since=None):
+        response = self.client.get(reverse('stock_snapshot'), {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def products(self, data):
+        name = data['fields'].index('product_name')
+        return sorted(row[name] for row in data['rows'])
+
+    def test_full_snapshot_then_deltas(self):
+        data = self.snapshot()
+        self.assertTrue(data['full'])
+        self.assertEqual(self.products(data), ['Gadget', 'Widget'])
+        prices = sorted(dict(zip(data['fields'], row))['price'] for row in data['rows'])
+        self.assertEqual(prices, [2.5, 9.0])
+
+        # Nothing changed beyond the overlap window
+        later = self.snapshot((timezone.now() + timezone.timedelta(minutes=1)).isoformat())
+        self.assertEqual((later['rows'], later['deleted']), ([], []))
+
+        cursor = data['cursor']
+        Stock.objects.filter(pk=self.widget.pk).update(updated_at=timezone.now() - timezone.timedelta(hours=1))
+        Stock.objects.filter(pk=self.gadget.pk).update(updated_at=timezone.now() - timezone.timedelta(hours=1))
+        self.widget.quantity = 4
+        self.widget.save()
+        gadget_id = self.gadget.pk
+        self.gadget.delete()
+        delta = self.snapshot(cursor)
+        self.assertFalse(delta['full'])
+        self.assertEqual(self.products(delta), ['Widget'])
+        self.assertEqual(delta['deleted'], [gadget_id])
+
+    def test_rows_committed_late_with_old_timestamps(self):
+        # An upload began a minute ago and is still writing while the
+        # snapshot is read
+        Stock.objects.update(updated_at=timezone.now() - timezone.timedelta(hours=1))
+        started = timezone.now() - timezone.timedelta(minutes=1)
+        with mock.patch('inventory.snapshot.oldest_open_transaction', return_value=started):
+            cursor = self.snapshot()['cursor']
+        # It commits a row stamped when it was written, before the read
+        Stock.objects.filter(pk=self.widget.pk).update(quantity=7, updated_at=started + timezone.timedelta(seconds=1))
+        self.assertEqual(self.products(self.snapshot(cursor)), ['Widget'])
+
+    def test_old_or_bad_cursors(self):
+        old = (timezone.now() - timezone.timedelta(days=365)).isoformat()
+        self.assertTrue(self.snapshot(old)['full'])
+        response = self.client.get(reverse('stock_snapshot'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_deleting_an_account_leaves_no_tombstones(self):
+        self.user.delete()
+        self.assertFalse(StockTombstone.objects.exists())
+
+    def test_service_worker_is_served_from_the_root(self):
+        response = self.client.get('/service-worker.js')
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertIn(b'/stock/snapshot/', b''.join(response.streaming_content))
+
+
+class SalesBatchApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shop', password='pass')
+        self.widget = Stock.objects.create(user=self.user, product_name='Widget', sku='W-1', quantity=10,
+                                           price=Decimal('2.00'))
+        self.gadget = Stock.objects.create(user=self.user, product_name='Gadget', quantity=5, price=Decimal('3.00'))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+    def post(self, lines):
+        return self.client.post(reverse('api_sales_batch'), lines, format='json')
+
+    def test_records_batch_with_aggregated_decrements(self):
+        lines = [{'sku': 'W-1', 'quantity_sold': 1} for _ in range(8)]
+        lines += [{'product': self.gadget.pk, 'quantity_sold': 2, 'unit_price': '2.50', 'customer_name': 'Ann'}]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(lines)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 9)
+        self.assertEqual(response.data['results'][8]['total_amount'], '5.00')
+        # Resolve the products, decrement them, read them back for the low-stock counter
+        self.assertEqual([q['sql'].split()[0] for q in queries if 'inventory_stock' in q['sql']],
+                         ['SELECT', 'UPDATE', 'SELECT'])
+        self.widget.refresh_from_db()
+        self.gadget.refresh_from_db()
+        self.assertEqual((self.widget.quantity, self.gadget.quantity), (2, 3))
+        self.assertEqual(DailyProductSales.objects.get(product=self.widget).quantity_sold, 8)
+
+    def test_rejects_whole_batch_when_lines_together_exceed_stock(self):
+        response = self.post([
+            {'product': self.gadget.pk, 'quantity_sold': 3},
+            {'sku': 'W-1', 'quantity_sold': 1},
+            {'product': self.gadget.pk, 'quantity_sold': 3},
+            {'product': 999999, 'quantity_sold': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([r['status'] for r in response.data['results']],
+                         ['rejected', 'not_applied', 'rejected', 'rejected'])
+        self.assertIn('Required: 6', response.data['results'][0]['errors'][0])
+        self.assertFalse(Sale.objects.exists())
+        self.gadget.refresh_from_db()
+        self.assertEqual(self.gadget.quantity, 5)
+
+    def test_reports_invalid_lines(self):
+        response = self.post([{'sku': 'W-1', 'quantity_sold': 1}, {'quantity_sold': 0}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][0]['status'], 'not_applied')
+        self.assertIn('quantity_sold', response.data['results'][1]['errors'])
+        response = self.post([{'quantity_sold': 1}])
+        self.assertEqual(response.data['results'][0]['errors']['non_field_errors'], ['Give either product or sku.'])
+        self.assertEqual(self.post({'sku': 'W-1'}).status_code, 400)
+
+    def test_requires_authentication(self):
+        self.client.credentials()
+        self.assertEqual(self.post([{'sku': 'W-1', 'quantity_sold': 1}]).status_code, 401)
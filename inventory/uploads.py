@@ -0,0 +1,100 @@
+"""
+Content-hash deduplication of uploaded files.
+
+``HashingUploadHandler`` runs first in ``FILE_UPLOAD_HANDLERS``. It feeds
+each chunk of an uploaded file to SHA-256 as Django streams it into
+memory or a temporary file, so the digest is ready when the view runs
+without reading the file a second time.
+
+``enqueue_upload`` looks the digest up among the user's earlier uploads
+(indexed on ``(user, sha256)``). When the same content of the same type
+is already queued or was processed, the new upload is recorded as a
+``duplicate`` of it and never reaches the queue: re-processing a stock
+file would add its quantities twice. That includes uploads that failed
+after writing some of their rows. When the content was only uploaded
+before under another type, or that upload failed before writing
+anything, the upload is queued again. Either way it points at the stored
+copy instead of writing another one to ``MEDIA_ROOT``.
+"""
+
+import hashlib
+
+from django.contrib.auth.models import User
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+
+from .models import UploadedFile
+
+
+# Earlier uploads in these states make a new upload of the same content a
+# duplicate, as do failed uploads that wrote rows before failing
+PROCESSED_STATUSES = ['pending', 'processing', 'completed']
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Compute the SHA-256 of each uploaded file while it streams in.
+
+    Passes every chunk on unchanged to the next handler, which stores the
+    file. The digests end up in ``request.upload_sha256`` by field name.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_sha256'):
+            self.request.upload_sha256 = {}
+        self.request.upload_sha256[self.field_name] = self.sha256.hexdigest()
+        # Let the next handler return the stored file
+
+
+def uploaded_sha256(request, field_name):
+    """SHA-256 of the file uploaded as ``field_name``, hashed while it streamed in if possible"""
+    digest = getattr(request, 'upload_sha256', {}).get(field_name)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for chunk in request.FILES[field_name].chunks():
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+    return digest
+
+
+def _was_processed(upload):
+    """Whether ``upload`` is queued or wrote rows, so its content must not be processed again"""
+    return upload.processing_status in PROCESSED_STATUSES or (
+        upload.processing_status == 'failed' and upload.records_processed > 0)
+
+
+def enqueue_upload(user, file, file_type, sha256, skip_invalid_rows=False):
+    """Record an upload of ``file`` and queue it, unless ``user`` already uploaded the same content.
+
+    Returns the new UploadedFile; its ``duplicate_of`` is set (and its
+    status is ``duplicate``) when it was not queued.
+    """
+    with transaction.atomic():
+        # Serialise the user's uploads, so two uploads of the same content
+        # can't both miss each other and be queued
+        User.objects.select_for_update().only('pk').get(pk=user.pk)
+        earlier = list(UploadedFile.objects.filter(user=user, sha256=sha256).order_by('-uploaded_at', '-id'))
+        original = next((previous for previous in earlier
+                         if previous.file_type == file_type and _was_processed(previous)), None)
+
+        upload = UploadedFile(user=user, file_name=file.name, file_type=file_type, sha256=sha256,
+                              skip_invalid_rows=skip_invalid_rows)
+        stored = next((previous.file_path for previous in earlier
+                       if previous.file_path and previous.file_path.storage.exists(previous.file_path.name)), None)
+        if stored is not None:
+            upload.file_path = stored.name
+        else:
+            upload.file_path = file
+
+        if original is not None:
+            upload.processing_status = 'duplicate'
+            upload.duplicate_of = original
+        upload.save()
+    return upload
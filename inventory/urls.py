@@ -1,20 +1,61 @@
 from django.urls import path
-from . import views
+from . import api, views
+from .querybudget import declare_query_budgets
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('register/', views.register, name='register'),
+    path('stats/cache/', views.cache_stats, name='cache_stats'),
     
     # Stock management
     path('stock/', views.stock_list, name='stock_list'),
     path('stock/add/', views.add_stock, name='add_stock'),
     path('stock/edit/<int:stock_id>/', views.edit_stock, name='edit_stock'),
     path('stock/query/', views.stock_query, name='stock_query'),
+    path('stock/autocomplete/', views.stock_autocomplete, name='stock_autocomplete'),
+    path('stock/snapshot/', views.stock_snapshot, name='stock_snapshot'),
+    path('stock/export/', views.stock_export, name='stock_export'),
     
     # Sales management
     path('sales/', views.sales_list, name='sales_list'),
     path('sales/add/', views.add_sale, name='add_sale'),
+    path('sales/export/', views.sales_export, name='sales_export'),
+    
+    # Reports
+    path('reports/', views.reports, name='reports'),
+    path('reports/sales/', views.sales_report, name='sales_report'),
     
     # File upload
     path('upload/', views.upload_file, name='upload_file'),
-]
\ No newline at end of file
+    path('upload/<int:pk>/errors/', views.upload_report, name='upload_report'),
+    
+    # Offline support
+    path('service-worker.js', views.service_worker, name='service_worker'),
+    
+    # JSON API
+    path('api/sales/batch/', api.sales_batch, name='api_sales_batch'),
+]
+
+# Most SQL queries a request to each route may run (GET or POST), enforced
+# by QueryBudgetMiddleware. Session and user lookups count too.
+query_budgets = declare_query_budgets({
+    'dashboard': 8,
+    'register': 8,
+    'cache_stats': 3,
+    'stock_list': 5,
+    'add_stock': 4,
+    'edit_stock': 7,
+    'stock_query': 4,
+    'stock_autocomplete': 3,
+    'stock_snapshot': 5,
+    'stock_export': 3,
+    'sales_list': 4,
+    'add_sale': 12,
+    'sales_export': 2,
+    'upload_file': 5,
+    'upload_report': 3,
+    'reports': 2,
+    'sales_report': 5,
+    'api_sales_batch': 8,
+    'service_worker': 0,
+})
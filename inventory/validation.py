@@ -0,0 +1,310 @@
+"""
+Validation pre-pass for uploaded stock and sales files.
+
+Before anything is written, the whole file is read in chunks of
+``VALIDATION_CHUNK_SIZE`` rows and checked column by column with pandas:
+
+* CSV files are decoded by their byte-order mark, else as UTF-8, else as
+  Windows-1252 (what Excel writes), else as Latin-1;
+* the required columns must be present and required cells filled in;
+* numbers must parse (integers must be whole) and fit their database
+  columns, text must fit its column's ``max_length`` and sale dates must
+  be in one of the formats ``parse_sale_date`` reads;
+* sales must name one of the user's products.
+
+Every bad cell is written to a per-row CSV report (row, column, value,
+error) attached to the upload. Unless the upload opted into skipping
+invalid rows, a file with any error is rejected before ingestion starts,
+so nothing is written. Otherwise a second pass re-reads the file and
+passes only the rows that checked out, already normalised, to ingestion.
+Only one chunk is held in memory at a time.
+"""
+
+import codecs
+import csv
+import os
+import tempfile
+from datetime import datetime
+
+from django.core.files import File
+
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+
+try:
+    import openpyxl
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+from .models import Sale, Stock
+
+
+VALIDATION_CHUNK_SIZE = 10000
+
+INTEGER, DECIMAL, TEXT, DATE = 'integer', 'decimal', 'text', 'date'
+
+# file type: {column: (kind, model field, required, minimum)}
+COLUMNS = {
+    'stock': {
+        'product_name': (TEXT, Stock._meta.get_field('product_name'), True, None),
+        'quantity': (INTEGER, Stock._meta.get_field('quantity'), False, None),
+        'price': (DECIMAL, Stock._meta.get_field('price'), False, 0),
+        'minimum_stock': (INTEGER, Stock._meta.get_field('minimum_stock'), False, 0),
+        'supplier': (TEXT, Stock._meta.get_field('supplier'), False, None),
+        'category': (TEXT, Stock._meta.get_field('category'), False, None),
+        'sku': (TEXT, Stock._meta.get_field('sku'), False, None),
+        'description': (TEXT, Stock._meta.get_field('description'), False, None),
+    },
+    'sales': {
+        'product_name': (TEXT, Stock._meta.get_field('product_name'), True, None),
+        'quantity_sold': (INTEGER, Sale._meta.get_field('quantity_sold'), True, 1),
+        'unit_price': (DECIMAL, Sale._meta.get_field('unit_price'), False, 0),
+        'sale_date': (DATE, Sale._meta.get_field('sale_date'), False, None),
+        'customer_name': (TEXT, Sale._meta.get_field('customer_name'), False, None),
+        'customer_phone': (TEXT, Sale._meta.get_field('customer_phone'), False, None),
+        'customer_email': (TEXT, Sale._meta.get_field('customer_email'), False, None),
+        'notes': (TEXT, Sale._meta.get_field('notes'), False, None),
+    },
+}
+
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+INTEGER_LIMIT = 2 ** 31
+
+REPORT_COLUMNS = ['row', 'column', 'value', 'error']
+
+
+class UploadValidationError(Exception):
+    """An upload has invalid rows (or could not be read at all) and nothing was written"""
+
+
+def validate_upload(uploaded_file, chunk_size=VALIDATION_CHUNK_SIZE, progress=None):
+    """Check every row of ``uploaded_file`` and attach the error report.
+
+    Saves ``error_count`` and ``error_report`` on the upload. Raises
+    UploadValidationError when the file can't be read, or has invalid rows
+    and the upload doesn't skip them. ``progress`` is called with 0 after
+    each chunk, as a heartbeat.
+    """
+    rows_checked = error_count = 0
+    bad_rows = set()
+    first_error = None
+    with tempfile.TemporaryFile('w+', newline='', encoding='utf-8') as report:
+        writer = csv.writer(report)
+        writer.writerow(REPORT_COLUMNS)
+        for rows, errors in checked_chunks(uploaded_file, chunk_size):
+            rows_checked += len(rows)
+            error_count += len(errors)
+            bad_rows.update(row for row, *_ in errors)
+            if first_error is None and errors:
+                first_error = errors[0]
+            writer.writerows(errors)
+            if progress:
+                progress(0)
+        rows_checked += len(bad_rows)
+
+        uploaded_file.error_count = error_count
+        if error_count:
+            report.seek(0)
+            name = f'{os.path.splitext(os.path.basename(uploaded_file.file_name))[0]}-errors.csv'
+            uploaded_file.error_report.save(name, File(report), save=False)
+        else:
+            # From an earlier run of a requeued upload
+            uploaded_file.error_report = None
+        uploaded_file.save(update_fields=['error_count', 'error_report'])
+
+    if error_count and not uploaded_file.skip_invalid_rows:
+        row, column, value, message = first_error
+        raise UploadValidationError(
+            f'{len(bad_rows)} of {rows_checked} rows have errors, so nothing was imported '
+            f'(first: row {row}, {column}: {message}). '
+            f'Download the error report, fix the file and upload it again, '
+            f'or upload it with "Skip invalid rows".'
+        )
+    return error_count
+
+
+def valid_rows(uploaded_file, chunk_size=VALIDATION_CHUNK_SIZE):
+    """Yield the normalised rows of ``uploaded_file`` that pass validation"""
+    for rows, errors in checked_chunks(uploaded_file, chunk_size):
+        yield from rows
+
+
+def checked_chunks(uploaded_file, chunk_size=VALIDATION_CHUNK_SIZE):
+    """Yield ``(valid rows, errors)`` per chunk of the file.
+
+    Errors are ``(row number, column, value, message)`` tuples; row 1 is
+    the header.
+    """
+    if not HAS_PANDAS:
+        raise UploadValidationError('Validating uploads requires pandas')
+    columns = COLUMNS.get(uploaded_file.file_type)
+    if columns is None:
+        raise UploadValidationError(f'Unknown file type: {uploaded_file.file_type}')
+
+    path = uploaded_file.file_path.path
+    if uploaded_file.file_name.endswith('.csv'):
+        frames = read_csv_chunks(path, chunk_size)
+    elif uploaded_file.file_name.endswith(('.xlsx', '.xls')):
+        frames = read_xlsx_chunks(path, chunk_size)
+    else:
+        raise UploadValidationError('Only .csv, .xlsx and .xls files can be imported')
+
+    product_names = None
+    if uploaded_file.file_type == 'sales':
+        product_names = set(Stock.objects.filter(user=uploaded_file.user).values_list('product_name', flat=True))
+
+    first = True
+    for frame in frames:
+        if first:
+            missing = [name for name, (_, _, required, _) in columns.items()
+                       if required and name not in frame.columns]
+            if missing:
+                raise UploadValidationError(f'Missing required column(s): {", ".join(missing)}')
+            first = False
+        yield check_frame(frame, columns, product_names)
+
+
+def detect_encoding(path, chunk_size=1024 * 1024):
+    """The encoding of a CSV file: from its byte-order mark, else the first that decodes all of it"""
+    with open(path, 'rb') as file:
+        head = file.read(4)
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    for encoding in ('utf-8', 'cp1252'):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(path, 'rb') as file:
+                while chunk := file.read(chunk_size):
+                    decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    return 'latin-1'
+
+
+def read_csv_chunks(path, chunk_size):
+    """DataFrames of at most ``chunk_size`` rows, every cell a string, indexed by row number"""
+    try:
+        reader = pd.read_csv(path, encoding=detect_encoding(path), dtype=str, keep_default_na=False,
+                             skip_blank_lines=False, chunksize=chunk_size)
+        for frame in reader:
+            frame.columns = [str(name).strip() for name in frame.columns]
+            frame.index = frame.index + 2
+            yield frame
+    except pd.errors.EmptyDataError:
+        raise UploadValidationError('The file is empty')
+    except pd.errors.ParserError as e:
+        raise UploadValidationError(f'The file is not valid CSV: {e}')
+
+
+def read_xlsx_chunks(path, chunk_size):
+    """DataFrames of at most ``chunk_size`` rows of the active sheet, indexed by row number"""
+    if not HAS_OPENPYXL:
+        raise UploadValidationError('Reading Excel files requires openpyxl')
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if headers is None:
+            raise UploadValidationError('The file is empty')
+        headers = [str(name).strip() if name is not None else f'column {i + 1}' for i, name in enumerate(headers)]
+        chunk, index = [], []
+        for number, row in enumerate(rows, start=2):
+            chunk.append(row[:len(headers)])
+            index.append(number)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=headers, index=index, dtype=object)
+                chunk, index = [], []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=headers, index=index, dtype=object)
+    finally:
+        workbook.close()
+
+
+def check_frame(frame, columns, product_names=None):
+    """Check one chunk column by column; returns ``(valid rows, errors)``"""
+    present = [name for name in columns if name in frame.columns]
+    text = {name: frame[name].astype(object).map(_as_text).astype(object) for name in present}
+    blank = {name: text[name] == '' for name in present}
+    # Rows with nothing in the known columns are padding, not data
+    empty = pd.concat(blank.values(), axis=1).all(axis=1) if present else pd.Series(True, index=frame.index)
+
+    errors = []
+    bad = pd.Series(False, index=frame.index)
+    values = {}
+
+    def reject(name, mask, message):
+        nonlocal bad
+        mask = mask & ~empty
+        if mask.any():
+            bad |= mask
+            errors.extend((row, name, text[name][row], message(text[name][row]))
+                          for row in frame.index[mask])
+
+    for name in present:
+        kind, field, required, minimum = columns[name]
+        raw, missing = frame[name].astype(object), blank[name]
+        if required:
+            reject(name, missing, lambda value: 'Required')
+
+        if kind in (INTEGER, DECIMAL):
+            numbers = pd.to_numeric(text[name].where(~missing), errors='coerce')
+            if kind == INTEGER:
+                invalid = ~missing & (numbers.isna() | (numbers % 1 != 0) | (numbers.abs() >= INTEGER_LIMIT))
+                reject(name, invalid, lambda value: f'"{value}" is not a whole number')
+            else:
+                limit = 10 ** (field.max_digits - field.decimal_places)
+                invalid = ~missing & (numbers.isna() | ~(numbers.abs() < limit))
+                reject(name, invalid, lambda value, limit=limit: f'"{value}" is not a number below {limit}')
+            if minimum is not None:
+                reject(name, ~missing & ~invalid & (numbers < minimum),
+                       lambda value, minimum=minimum: f'Must be at least {minimum}')
+            usable = ~missing & ~invalid
+            if kind == INTEGER:
+                values[name] = [int(n) if ok else None for n, ok in zip(numbers, usable)]
+            else:
+                values[name] = text[name].where(usable, None)
+        elif kind == DATE:
+            is_datetime = raw.map(lambda value: isinstance(value, datetime))
+            parsed = pd.Series(False, index=frame.index)
+            for date_format in DATE_FORMATS:
+                parsed |= pd.to_datetime(text[name], format=date_format, errors='coerce').notna()
+            reject(name, ~missing & ~is_datetime & ~parsed,
+                   lambda value: f'"{value}" is not a date (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS)')
+            values[name] = raw.where(is_datetime, text[name].where(~missing, None))
+        else:
+            if field.max_length:
+                reject(name, text[name].str.len() > field.max_length,
+                       lambda value, length=field.max_length: f'Longer than {length} characters')
+            values[name] = text[name]
+
+    if product_names is not None and 'product_name' in present:
+        reject('product_name', ~blank['product_name'] & ~text['product_name'].isin(product_names),
+               lambda value: f'No product named "{value}"')
+
+    keep = (~(bad | empty)).tolist()
+    columns_values = [list(values[name]) for name in present]
+    rows = [
+        {name: value for name, value in zip(present, row) if value is not None}
+        for row, ok in zip(zip(*columns_values), keep) if ok
+    ]
+    errors.sort(key=lambda error: error[0])
+    return rows, errors
+
+
+def _as_text(value):
+    """A cell as text: CSV cells already are, Excel ones may be numbers, dates or empty"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value).strip()
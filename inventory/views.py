@@ -1,12 +1,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
-from django.db.models import Q, Sum, Count, F
-from django.core.paginator import Paginator
+from django.contrib.staticfiles import finders
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+from django.db.models import Sum, Count
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
 from datetime import datetime, timedelta
+import hashlib
+import os
+import tempfile
 import json
 import csv
 from io import TextIOWrapper
@@ -17,7 +24,14 @@ try:
 except ImportError:
     HAS_OPENPYXL = False
 
-from .models import Stock, Sale, UploadedFile, UserProfile
+from .models import Stock, Sale, DailyProductSales, LowStockCounter, StockForecast, UploadedFile, InsufficientStockError
+from .uploads import enqueue_upload, uploaded_sha256
+from .search import FILTER_FIELDS, search_stocks
+from .pagination import add_page_urls, estimated_count, keyset_page, offset_page
+from .cache import get_dashboard_context, get_data_version, cache_stats as dashboard_cache_stats
+from .autocomplete import autocomplete
+from . import reports as sales_reports
+from .snapshot import stock_snapshot as build_stock_snapshot
 from .forms import (CustomUserCreationForm, StockForm, SaleForm, 
                    FileUploadForm, StockQueryForm)
 
@@ -39,82 +53,193 @@ def register(request):
 @login_required
 def dashboard(request):
     """Main dashboard view"""
-    user = request.user
-    
+    # ?low_stock=cover ranks the low stock panel by forecast days of cover
+    low_stock_order = 'cover' if request.GET.get('low_stock') == 'cover' else 'quantity'
+    context = get_dashboard_context(
+        request.user,
+        lambda user: build_dashboard_context(user, low_stock_order),
+        variant=low_stock_order,
+    )
+    return render(request, 'inventory/dashboard.html', context)
+
+
+def build_dashboard_context(user, low_stock_order='quantity'):
+    """Dashboard statistics for ``user``, cached by get_dashboard_context"""
     # Get dashboard statistics
     total_products = Stock.objects.filter(user=user).count()
-    low_stock_count = Stock.objects.filter(user=user, quantity__lte=F('minimum_stock')).count()
+    low_stock_count = LowStockCounter.count_for(user)
     
-    # Recent sales (last 30 days)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    recent_sales = Sale.objects.filter(user=user, sale_date__gte=thirty_days_ago)
-    total_sales = recent_sales.aggregate(total=Sum('total_amount'))['total'] or 0
-    sales_count = recent_sales.count()
+    # Recent sales (last 30 days), read from the daily rollup
+    thirty_days_ago = timezone.localdate() - timedelta(days=30)
+    recent_sales = DailyProductSales.objects.filter(user=user, day__gt=thirty_days_ago)
+    totals = recent_sales.aggregate(total=Sum('revenue'), count=Sum('sales_count'))
+    total_sales = totals['total'] or 0
+    sales_count = totals['count'] or 0
     
     # Top selling products
-    top_products = (Sale.objects.filter(user=user, sale_date__gte=thirty_days_ago)
+    top_products = (recent_sales
                    .values('product__product_name')
                    .annotate(total_sold=Sum('quantity_sold'))
                    .order_by('-total_sold')[:5])
     
     # Low stock products
-    low_stock_products = Stock.objects.filter(
-        user=user, 
-        quantity__lte=F('minimum_stock')
-    ).order_by('quantity')[:10]
+    if low_stock_order == 'cover':
+        # Products running out soonest at their current sales velocity,
+        # read off the (user, days_of_cover) index of the nightly forecasts
+        forecasts = (StockForecast.objects
+                     .filter(user=user, days_of_cover__isnull=False)
+                     .select_related('product')
+                     .order_by('days_of_cover')[:10])
+        low_stock_products = [forecast.product for forecast in forecasts]
+    else:
+        low_stock_products = Stock.objects.filter(
+            user=user, 
+            is_low=True
+        ).select_related('forecast').order_by('quantity')[:10]
     
     context = {
         'total_products': total_products,
         'low_stock_count': low_stock_count,
         'total_sales': total_sales,
         'sales_count': sales_count,
-        'top_products': top_products,
-        'low_stock_products': low_stock_products,
+        'top_products': list(top_products),
+        'low_stock_products': list(low_stock_products),
+        'low_stock_order': low_stock_order,
     }
     
-    return render(request, 'inventory/dashboard.html', context)
+    return context
+
+
+@staff_member_required
+def cache_stats(request):
+    """Cache hit/miss counters of the worker serving the request"""
+    return JsonResponse({'dashboard': dashboard_cache_stats()})
 
 
 @login_required
 def stock_list(request):
-    """Stock listing with search and pagination"""
+    """Stock listing with search and cursor pagination"""
     query = request.GET.get('q', '')
-    stocks = Stock.objects.filter(user=request.user)
+    cursor = request.GET.get('cursor')
+    filters = stock_filters(request.GET)
+    stocks = Stock.objects.filter(user=request.user, **filters)
     
     if query:
-        stocks = stocks.filter(
-            Q(product_name__icontains=query) |
-            Q(sku__icontains=query) |
-            Q(supplier__icontains=query) |
-            Q(category__icontains=query)
-        )
-    
-    paginator = Paginator(stocks, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        page_obj = offset_page(search_stocks(request.user, query, filters=filters), cursor)
+        total_estimate = None
+    else:
+        page_obj = keyset_page(stocks, cursor, keys=('created_at', 'id'))
+        total_estimate = estimated_count(stocks)
+    add_page_urls(page_obj, request)
     
     context = {
         'page_obj': page_obj,
+        'total_estimate': total_estimate,
         'query': query,
+        'filters': filters,
         'form': StockQueryForm(initial={'query': query})
     }
     
     return render(request, 'inventory/stock_list.html', context)
 
 
+def stock_filters(params):
+    """The stock list's optional exact ``category``/``supplier`` filters"""
+    return {field: params[field] for field in FILTER_FIELDS if params.get(field)}
+
+
+# The columns stock uploads accept, so an export can be uploaded again
+STOCK_EXPORT_COLUMNS = ['product_name', 'quantity', 'price', 'supplier', 'category', 'sku', 'description',
+                        'minimum_stock']
+STOCK_EXPORT_CHUNK_SIZE = 2000
+
+
+@login_required
+def stock_export(request):
+    """Download the (filtered) stock as an XLSX file in the upload format"""
+    if not HAS_OPENPYXL:
+        messages.error(request, 'Excel export requires openpyxl to be installed.')
+        return redirect('stock_list')
+    
+    filters = stock_filters(request.GET)
+    rows = (Stock.objects.filter(user=request.user, **filters)
+            .order_by('product_name')
+            .values_list(*STOCK_EXPORT_COLUMNS)
+            .iterator(chunk_size=STOCK_EXPORT_CHUNK_SIZE))
+    
+    # Write-only mode streams rows to a temporary file instead of keeping
+    # cell objects, and the zipped workbook is spooled to disk, so memory
+    # stays flat however many products there are
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Stock')
+    sheet.append(STOCK_EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    
+    filename = '_'.join(['stock', *[slugify(value) for value in filters.values()]])
+    return FileResponse(
+        output, as_attachment=True, filename=f'{filename}.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+def autocomplete_etag(request):
+    """ETag of an autocomplete response: the query at the user's data version"""
+    request.data_version = get_data_version(request.user.pk)
+    if request.data_version is None:
+        return None
+    key = f"{request.user.pk}:{request.data_version}:{request.GET.get('query', '').strip().lower()}"
+    return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+@login_required
+@condition(etag_func=autocomplete_etag)
+def stock_autocomplete(request):
+    """Prefix autocomplete over product names and SKUs for the search box"""
+    query = request.GET.get('query', '').strip()
+    results = autocomplete(request.user, query, request.data_version) if query else []
+    
+    response = JsonResponse({'results': results})
+    # Let the browser keep the response but revalidate it with the ETag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@login_required
+def stock_snapshot(request):
+    """Compact stock snapshot for the offline search, or the changes after ``?since=<cursor>``"""
+    since = None
+    if request.GET.get('since'):
+        since = parse_datetime(request.GET['since'])
+        if since is None or timezone.is_naive(since):
+            return JsonResponse({'error': 'since must be a cursor from an earlier snapshot'}, status=400)
+    
+    response = JsonResponse(build_stock_snapshot(request.user, since))
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def service_worker(request):
+    """Serve the service worker from the site root, so its scope covers every page"""
+    path = finders.find('pwa/service-worker.js')
+    if path is None:
+        raise Http404
+    response = FileResponse(open(path, 'rb'), content_type='application/javascript')
+    # Browsers check for a new worker on navigation; don't make them wait
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 @login_required
 def stock_query(request):
     """AJAX stock query for the original functionality"""
     query = request.GET.get('query', '')
     
     if query:
-        stocks = Stock.objects.filter(
-            user=request.user
-        ).filter(
-            Q(product_name__icontains=query) |
-            Q(sku__icontains=query) |
-            Q(supplier__icontains=query)
-        )[:10]  # Limit results
+        stocks = search_stocks(request.user, query)[:10]  # Limit results
         
         results = []
         for stock in stocks:
@@ -169,24 +294,16 @@ def edit_stock(request, stock_id):
 
 @login_required
 def sales_list(request):
-    """Sales listing with pagination"""
-    sales = Sale.objects.filter(user=request.user)
-    
-    # Date filtering
+    """Sales listing with cursor pagination"""
+    sales = filter_sales_by_date(Sale.objects.filter(user=request.user).select_related('product'), request.GET)
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
     
-    if date_from:
-        sales = sales.filter(sale_date__gte=date_from)
-    if date_to:
-        sales = sales.filter(sale_date__lte=date_to)
-    
-    paginator = Paginator(sales, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = add_page_urls(keyset_page(sales, request.GET.get('cursor'), keys=('sale_date', 'id')), request)
     
     context = {
         'page_obj': page_obj,
+        'total_estimate': estimated_count(sales),
         'date_from': date_from,
         'date_to': date_to,
     }
@@ -194,6 +311,92 @@ def sales_list(request):
     return render(request, 'inventory/sales_list.html', context)
 
 
+def filter_sales_by_date(sales, params):
+    """Apply the ``date_from``/``date_to`` filters of the sales pages"""
+    if params.get('date_from'):
+        sales = sales.filter(sale_date__gte=params['date_from'])
+    if params.get('date_to'):
+        sales = sales.filter(sale_date__lte=params['date_to'])
+    return sales
+
+
+SALES_EXPORT_COLUMNS = [
+    ('sale_date', 'Date'),
+    ('product__product_name', 'Product'),
+    ('product__sku', 'SKU'),
+    ('quantity_sold', 'Quantity'),
+    ('unit_price', 'Unit Price'),
+    ('total_amount', 'Total'),
+    ('customer_name', 'Customer'),
+    ('customer_phone', 'Phone'),
+    ('customer_email', 'Email'),
+    ('notes', 'Notes'),
+]
+SALES_EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object for csv.writer that hands back each line instead of storing it"""
+    def write(self, value):
+        return value
+
+
+@login_required
+def sales_export(request):
+    """Stream the filtered sales as CSV"""
+    sales = filter_sales_by_date(Sale.objects.filter(user=request.user), request.GET)
+    # A server-side cursor on PostgreSQL, so memory stays flat however many rows match
+    rows = (sales.order_by('sale_date', 'id')
+            .values_list(*[field for field, _ in SALES_EXPORT_COLUMNS])
+            .iterator(chunk_size=SALES_EXPORT_CHUNK_SIZE))
+    
+    def lines():
+        writer = csv.writer(Echo())
+        tz = timezone.get_current_timezone()
+        yield writer.writerow([title for _, title in SALES_EXPORT_COLUMNS])
+        batch = []
+        for sale_date, *values in rows:
+            batch.append(writer.writerow([sale_date.astimezone(tz).strftime('%Y-%m-%d %H:%M:%S'), *values]))
+            # One write per few hundred rows; a write per row costs more than the row
+            if len(batch) == 500:
+                yield ''.join(batch)
+                batch = []
+        if batch:
+            yield ''.join(batch)
+    
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    dates = [''.join(c for c in request.GET.get(key, '') if c.isdigit() or c == '-') for key in ('date_from', 'date_to')]
+    filename = '_'.join(['sales', *filter(None, dates)])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    # Don't let a proxy hold the stream back until it ends
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def reports(request):
+    """Sales report charts, fed by sales_report"""
+    return render(request, 'inventory/reports.html', {'grains': list(sales_reports.GRAINS)})
+
+
+@login_required
+def sales_report(request):
+    """Revenue and quantity per day/week/month by product, category and supplier, as JSON for charts"""
+    if not sales_reports.HAS_PANDAS:
+        return JsonResponse({'error': 'Reports require pandas to be installed.'}, status=501)
+    
+    zone = sales_reports.user_timezone(request.user)
+    try:
+        start, end = sales_reports.parse_range(request.GET, timezone.localdate(timezone=zone))
+        report = sales_reports.sales_report(request.user, start, end, request.GET.get('grain', 'day'), zone)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    response = JsonResponse(report)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @login_required
 def add_sale(request):
     """Add new sale"""
@@ -203,12 +406,13 @@ def add_sale(request):
             sale = form.save(commit=False)
             sale.user = request.user
             
-            # Check if enough stock is available
-            if sale.product.quantity < sale.quantity_sold:
-                messages.error(request, f'Not enough stock available. Current stock: {sale.product.quantity}')
+            # Stock is checked and decremented atomically by Sale.save()
+            try:
+                sale.save()
+            except InsufficientStockError as e:
+                messages.error(request, str(e))
                 return render(request, 'inventory/add_sale.html', {'form': form})
             
-            sale.save()
             messages.success(request, f'Sale recorded successfully!')
             return redirect('sales_list')
     else:
@@ -223,35 +427,36 @@ def upload_file(request):
     if request.method == 'POST':
         form = FileUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            uploaded_file = UploadedFile.objects.create(
-                user=request.user,
-                file_name=request.FILES['file'].name,
-                file_path=request.FILES['file'],
-                file_type=form.cleaned_data['file_type'],
-                processing_status='pending'
+            upload = enqueue_upload(
+                request.user,
+                request.FILES['file'],
+                form.cleaned_data['file_type'],
+                uploaded_sha256(request, 'file'),
+                skip_invalid_rows=form.cleaned_data['skip_invalid_rows'],
             )
             
-            # Process the file
-            try:
-                records_processed = process_uploaded_file(uploaded_file)
-                uploaded_file.records_processed = records_processed
-                uploaded_file.processing_status = 'completed'
-                uploaded_file.save()
-                
-                messages.success(request, f'File uploaded and {records_processed} records processed successfully!')
-                
-            except Exception as e:
-                uploaded_file.processing_status = 'failed'
-                uploaded_file.error_message = str(e)
-                uploaded_file.save()
-                messages.error(request, f'Error processing file: {str(e)}')
+            if upload.duplicate_of:
+                original = upload.duplicate_of
+                if original.processing_status == 'failed':
+                    outcome = (f'that upload failed after importing {original.records_processed} records, '
+                               f'so it was not processed again')
+                else:
+                    outcome = 'it was not processed again'
+                messages.warning(
+                    request,
+                    f'"{upload.file_name}" has the same content as "{original.file_name}", uploaded on '
+                    f'{timezone.localtime(original.uploaded_at):%b %d, %Y %H:%M}; {outcome}.'
+                )
+            else:
+                # Pending uploads are picked up by `manage.py upload_worker`
+                messages.success(request, 'File uploaded and queued for processing.')
             
             return redirect('upload_file')
     else:
         form = FileUploadForm()
     
     # Get recent uploads
-    recent_uploads = UploadedFile.objects.filter(user=request.user)[:10]
+    recent_uploads = UploadedFile.objects.filter(user=request.user).select_related('duplicate_of')[:10]
     
     return render(request, 'inventory/upload_file.html', {
         'form': form,
@@ -259,62 +464,14 @@ def upload_file(request):
     })
 
 
-def process_uploaded_file(uploaded_file):
-    """Process uploaded CSV/Excel file"""
-    file_path = uploaded_file.file_path.path
-    file_type = uploaded_file.file_type
-    user = uploaded_file.user
-    
-    records_processed = 0
-    
-    if uploaded_file.file_name.endswith('.csv'):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            records_processed = process_csv_data(reader, file_type, user)
-    
-    elif uploaded_file.file_name.endswith(('.xlsx', '.xls')):
-        workbook = openpyxl.load_workbook(file_path)
-        sheet = workbook.active
-        headers = [cell.value for cell in sheet[1]]
-        
-        data = []
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            data.append(dict(zip(headers, row)))
-        
-        records_processed = process_csv_data(data, file_type, user)
-    
-    return records_processed
-
-
-def process_csv_data(data, file_type, user):
-    """Process CSV data based on file type"""
-    records_processed = 0
-    
-    if file_type == 'stock':
-        for row in data:
-            if not row.get('product_name'):
-                continue
-            
-            stock, created = Stock.objects.get_or_create(
-                user=user,
-                product_name=row['product_name'],
-                defaults={
-                    'quantity': int(row.get('quantity', 0)),
-                    'price': float(row.get('price', 0)),
-                    'supplier': row.get('supplier', ''),
-                    'category': row.get('category', ''),
-                    'sku': row.get('sku', ''),
-                    'description': row.get('description', ''),
-                    'minimum_stock': int(row.get('minimum_stock', 0)),
-                }
-            )
-            
-            if not created:
-                # Update existing stock
-                stock.quantity += int(row.get('quantity', 0))
-                stock.price = float(row.get('price', stock.price))
-                stock.save()
-            
-            records_processed += 1
+@login_required
+def upload_report(request, pk):
+    """Download the per-row error report of an upload"""
+    upload = get_object_or_404(UploadedFile, pk=pk, user=request.user)
+    if not upload.error_report:
+        raise Http404('This upload has no error report')
     
-    return records_processed
+    return FileResponse(
+        upload.error_report.open('rb'), as_attachment=True,
+        filename=os.path.basename(upload.error_report.name), content_type='text/csv',
+    )
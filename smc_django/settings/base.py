@@ -28,6 +28,8 @@ INSTALLED_APPS = [
     # Third party apps
     "corsheaders",
     "django_extensions",
+    "rest_framework",
+    "rest_framework.authtoken",
     
     # Local apps
     "inventory",
@@ -43,6 +45,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "inventory.profiling.RequestProfilerMiddleware",
+    "inventory.querybudget.QueryBudgetMiddleware",
 ]
 
 ROOT_URLCONF = "smc_django.urls"
@@ -135,10 +139,41 @@ CORS_ALLOWED_ORIGINS = config(
 )
 
 # File upload settings
+# Uploads are hashed while they stream in, for deduplication (inventory.uploads)
+FILE_UPLOAD_HANDLERS = [
+    'inventory.uploads.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000
 
+# Dashboard cache (seconds); entries are also invalidated on every stock/sale change
+DASHBOARD_CACHE_TIMEOUT = config('DASHBOARD_CACHE_TIMEOUT', default=900, cast=int)
+
+# JSON API (inventory/api.py): POS terminals authenticate with tokens
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.TokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+}
+
+# Per-URL query budgets (declared in inventory/urls.py); strict mode raises instead of logging
+QUERY_BUDGET_ENABLED = config('QUERY_BUDGET_ENABLED', default=False, cast=bool)
+QUERY_BUDGET_STRICT = config('QUERY_BUDGET_STRICT', default=False, cast=bool)
+
+# Request profiler: always for PROFILING_USERS (usernames), else a sampled percentage of requests
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_USERS = config('PROFILING_USERS', default='', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0, cast=float)
+PROFILING_SLOW_MS = config('PROFILING_SLOW_MS', default=500, cast=int)
+PROFILING_BUFFER_SIZE = config('PROFILING_BUFFER_SIZE', default=500, cast=int)
+
 # Session settings
 SESSION_COOKIE_AGE = 86400 * 7  # 1 week
 SESSION_COOKIE_HTTPONLY = True
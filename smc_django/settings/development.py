@@ -30,6 +30,9 @@ INTERNAL_IPS = [
     "localhost",
 ]
 
+# Report views that go over their query budget
+QUERY_BUDGET_ENABLED = True
+
 # Email backend for development
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
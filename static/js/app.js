@@ -13,12 +13,12 @@ $(document).ready(function() {
         submitBtn.html('<i class="fas fa-spinner fa-spin me-2"></i>Processing...');
     });
 
-    // Stock query functionality (AJAX)
+    // Stock autocomplete (AJAX); repeated queries are answered with 304s
     $('#stock-query').on('input', function() {
-        var query = $(this).val();
-        if (query.length > 2) {
+        var query = $(this).val().trim();
+        if (query.length > 0) {
             $.ajax({
-                url: '/stock/query/',
+                url: '/stock/autocomplete/',
                 data: {
                     'query': query
                 },
@@ -1,21 +1,233 @@
-const CACHE_NAME = 'stock-query-app-cache-v1';
+// Served from /service-worker.js so that its scope is the whole site.
+//
+// The signed-in user's products are kept in IndexedDB and the search box
+// (/stock/autocomplete/) is answered from there, so it works on a flaky
+// connection. The snapshot is downloaded once from /stock/snapshot/ and then
+// kept current with ?since=<cursor> deltas, which carry only changed rows and
+// the ids of deleted products.
+
+const CACHE_NAME = 'stock-query-app-cache-v2';
 const urlsToCache = [
   '/',
-  '512.png',
-  '128.png'
+  '/static/pwa/512.png',
+  '/static/pwa/128.png'
   // Add other assets that you want to cache for offline access
 ];
 
+const DB_NAME = 'smc-stock';
+const SNAPSHOT_URL = '/stock/snapshot/';
+const AUTOCOMPLETE_PATH = '/stock/autocomplete/';
+const SYNC_INTERVAL_MS = 30 * 1000;
+const RESULT_LIMIT = 10;
+
+// In-memory copy of the snapshot; reloaded from IndexedDB when the worker restarts
+let snapshot = null;
+let syncing = null;
+let lastSync = 0;
+
 self.addEventListener('install', event => {
   event.waitUntil(
     caches.open(CACHE_NAME)
       .then(cache => cache.addAll(urlsToCache))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(names => Promise.all(names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name))))
+      .then(() => self.clients.claim())
   );
 });
 
+// Pages tell the worker who is signed in (null when signed out)
+self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'user') {
+    event.waitUntil(setUser(event.data.user).then(() => sync(true)).catch(() => {}));
+  }
+});
+
 self.addEventListener('fetch', event => {
+  const request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin || url.pathname === SNAPSHOT_URL) {
+    return;
+  }
+
+  if (url.pathname === AUTOCOMPLETE_PATH) {
+    event.respondWith(
+      searchLocally(url.searchParams.get('query') || '')
+        .catch(() => fetch(request))
+    );
+    event.waitUntil(sync(false).catch(() => {}));
+    return;
+  }
+
+  if (request.mode === 'navigate') {
+    // Pages must be fresh; the cache is only a fallback when offline
+    event.respondWith(fetch(request).catch(() => caches.match(request).then(response => response || caches.match('/'))));
+    return;
+  }
+
   event.respondWith(
-    caches.match(event.request)
-      .then(response => response || fetch(event.request))
+    caches.match(request)
+      .then(response => response || fetch(request))
   );
 });
+
+// IndexedDB ----------------------------------------------------------------
+
+function openDb() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open(DB_NAME, 1);
+    open.onupgradeneeded = () => {
+      open.result.createObjectStore('stock', { keyPath: 'id' });
+      open.result.createObjectStore('meta');
+    };
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+function done(tx) {
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = tx.onabort = () => reject(tx.error);
+  });
+}
+
+function requestResult(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+async function loadSnapshot() {
+  if (snapshot) {
+    return snapshot;
+  }
+  const db = await openDb();
+  const tx = db.transaction(['stock', 'meta'], 'readonly');
+  const meta = (await requestResult(tx.objectStore('meta').get('meta'))) || { user: null, cursor: null };
+  const rows = await requestResult(tx.objectStore('stock').getAll());
+  db.close();
+  snapshot = { user: meta.user, cursor: meta.cursor, rows: new Map(rows.map(row => [row.id, row])) };
+  return snapshot;
+}
+
+async function setUser(user) {
+  const current = await loadSnapshot();
+  if (current.user === user) {
+    return;
+  }
+  // Another user (or nobody) is signed in: never keep the previous user's products
+  const db = await openDb();
+  const tx = db.transaction(['stock', 'meta'], 'readwrite');
+  tx.objectStore('stock').clear();
+  tx.objectStore('meta').put({ user: user, cursor: null }, 'meta');
+  await done(tx);
+  db.close();
+  snapshot = { user: user, cursor: null, rows: new Map() };
+  const cache = await caches.open(CACHE_NAME);
+  await cache.delete('/');
+}
+
+// Sync ---------------------------------------------------------------------
+
+function sync(force) {
+  if (syncing) {
+    return syncing;
+  }
+  if (!force && Date.now() - lastSync < SYNC_INTERVAL_MS) {
+    return Promise.resolve();
+  }
+  syncing = fetchChanges().finally(() => {
+    syncing = null;
+  });
+  return syncing;
+}
+
+async function fetchChanges() {
+  const current = await loadSnapshot();
+  if (current.user === null) {
+    return;
+  }
+  const url = current.cursor ? SNAPSHOT_URL + '?since=' + encodeURIComponent(current.cursor) : SNAPSHOT_URL;
+  const response = await fetch(url, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } });
+  // A redirect means the session ended (login page)
+  if (!response.ok || response.redirected) {
+    return;
+  }
+  const data = await response.json();
+  if (data.user !== current.user) {
+    return;
+  }
+  lastSync = Date.now();
+
+  const db = await openDb();
+  const tx = db.transaction(['stock', 'meta'], 'readwrite');
+  const store = tx.objectStore('stock');
+  if (data.full) {
+    store.clear();
+    current.rows.clear();
+  }
+  for (const values of data.rows) {
+    const row = {};
+    data.fields.forEach((field, i) => {
+      row[field] = values[i];
+    });
+    store.put(row);
+    current.rows.set(row.id, row);
+  }
+  for (const id of data.deleted) {
+    store.delete(id);
+    current.rows.delete(id);
+  }
+  tx.objectStore('meta').put({ user: current.user, cursor: data.cursor }, 'meta');
+  await done(tx);
+  db.close();
+  current.cursor = data.cursor;
+}
+
+// Search -------------------------------------------------------------------
+
+// Same ranking as the server's prefix index: whole name, then a later word
+// of the name, then SKU; alphabetical within each.
+async function searchLocally(query) {
+  const current = await loadSnapshot();
+  if (current.user === null || current.cursor === null) {
+    throw new Error('No snapshot yet');
+  }
+  query = query.trim().toLowerCase();
+  const results = [];
+  if (query) {
+    const kinds = [[], [], []];
+    for (const row of current.rows.values()) {
+      const name = row.product_name.toLowerCase();
+      if (name.startsWith(query)) {
+        kinds[0].push([name, row]);
+      } else if (name.replace(/\s+/g, ' ').includes(' ' + query)) {
+        kinds[1].push([name, row]);
+      } else if (row.sku && row.sku.toLowerCase().startsWith(query)) {
+        kinds[2].push([row.sku.toLowerCase(), row]);
+      }
+    }
+    for (const matches of kinds) {
+      matches.sort((a, b) => (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : 0));
+      for (const [, row] of matches) {
+        if (results.length === RESULT_LIMIT) {
+          break;
+        }
+        results.push(row);
+      }
+    }
+  }
+  return new Response(JSON.stringify({ results: results }), {
+    headers: { 'Content-Type': 'application/json', 'X-Served-By': 'service-worker' }
+  });
+}